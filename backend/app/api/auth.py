@@ -2,18 +2,20 @@
 Authentication API for IG-Shop-Agent V2
 Instagram OAuth and JWT token management
 """
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-import httpx
-import hashlib
 
-from ..core.database import get_db
+from ..core.database import get_async_db
 from ..core.config import settings
+from ..core.http_client import get_http_client
+from ..core.token_crypto import encrypt_token
 from ..models.merchant import Merchant
+from ..services.merchant_cache import merchant_cache
 
 auth_router = APIRouter()
 security = HTTPBearer()
@@ -41,10 +43,6 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def hash_token(token: str) -> str:
-    """Hash Instagram access token for secure storage"""
-    return hashlib.sha256(token.encode()).hexdigest()
-
 async def exchange_code_for_token(code: str):
     """Exchange Instagram auth code for access token"""
     url = "https://api.instagram.com/oauth/access_token"
@@ -57,37 +55,35 @@ async def exchange_code_for_token(code: str):
         "code": code
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, data=data)
-        
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Instagram OAuth error: {response.text}"
-            )
-        
-        result = response.json()
-        return result
+    response = await get_http_client().post(url, data=data)
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Instagram OAuth error: {response.text}"
+        )
+    
+    result = response.json()
+    return result
 
 async def get_instagram_user_info(access_token: str):
     """Get Instagram user and page information"""
     url = f"https://graph.instagram.com/me?fields=id,username&access_token={access_token}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to get Instagram user info: {response.text}"
-            )
-        
-        return response.json()
+    response = await get_http_client().get(url)
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to get Instagram user info: {response.text}"
+        )
+    
+    return response.json()
 
 @auth_router.post("/instagram/callback", response_model=InstagramAuthResponse)
 async def instagram_oauth_callback(
     auth_request: InstagramAuthRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Handle Instagram OAuth callback"""
     try:
@@ -107,30 +103,31 @@ async def instagram_oauth_callback(
             raise HTTPException(status_code=400, detail="Failed to get Instagram page ID")
         
         # Check if merchant already exists
-        existing_merchant = db.query(Merchant).filter(
+        existing_merchant = await db.scalar(select(Merchant).where(
             Merchant.instagram_page_id == instagram_page_id
-        ).first()
+        ))
         
         if existing_merchant:
             # Update existing merchant
-            existing_merchant.access_token_hash = hash_token(access_token)
+            existing_merchant.access_token_hash = encrypt_token(access_token)
             existing_merchant.page_name = page_name
             existing_merchant.last_active_at = datetime.utcnow()
-            db.commit()
+            await db.commit()
+            merchant_cache.invalidate(existing_merchant.id)
             merchant = existing_merchant
         else:
             # Create new merchant
             merchant = Merchant(
                 instagram_page_id=instagram_page_id,
                 page_name=page_name,
-                access_token_hash=hash_token(access_token),
+                access_token_hash=encrypt_token(access_token),
                 business_name=f"{page_name} Business",
                 subscription_tier="starter",
                 monthly_message_limit=1000
             )
             db.add(merchant)
-            db.commit()
-            db.refresh(merchant)
+            await db.commit()
+            await db.refresh(merchant)
         
         # Create JWT token for merchant
         jwt_token = create_access_token(
@@ -154,7 +151,7 @@ async def instagram_oauth_callback(
 @auth_router.get("/me")
 async def get_current_merchant(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current authenticated merchant"""
     try:
@@ -169,7 +166,7 @@ async def get_current_merchant(
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    merchant = db.query(Merchant).filter(Merchant.id == merchant_id).first()
+    merchant = await merchant_cache.get_by_id(db, merchant_id)
     if merchant is None:
         raise HTTPException(status_code=404, detail="Merchant not found")
     
@@ -89,6 +89,43 @@ async def database_health():
             "timestamp": datetime.utcnow().isoformat()
         }
 
+@health_router.get("/performance")
+async def performance_health():
+    """Cache hit rates and AI client counters"""
+    from ..services.deadline import deadline_stats
+    from ..services.fast_path import fast_path_responder
+    from ..services.llm_client import llm_client
+    from ..services.llm_governor import llm_governor
+    from ..services.llm_resilience import resilient_llm
+    from ..services.load_shedder import load_shedder
+    from ..services.merchant_cache import merchant_cache
+    from ..services.model_router import model_router
+    from ..services.product_embeddings import product_embeddings
+    from ..services.product_index import product_indexes
+    from ..services.prompt_compiler import prompt_compiler
+    from ..services.rate_limiter import rate_limiter
+    from ..services.response_cache import response_cache
+    from ..services.token_budget import token_usage
+    
+    return {
+        "status": "healthy",
+        "deadlines": deadline_stats.stats(),
+        "fast_path": fast_path_responder.stats(),
+        "response_cache": response_cache.stats(),
+        "prompt_cache": prompt_compiler.stats(),
+        "merchant_cache": merchant_cache.stats(),
+        "product_index": product_indexes.stats(),
+        "product_embeddings": product_embeddings.stats(),
+        "llm": llm_client.stats(),
+        "llm_governor": llm_governor.stats(),
+        "llm_resilience": resilient_llm.stats(),
+        "model_router": model_router.stats(),
+        "load": load_shedder.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "tokens": token_usage.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 @health_router.get("/config")
 async def config_health():
     """Configuration validation check"""
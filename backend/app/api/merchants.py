@@ -4,15 +4,23 @@ CRUD operations for merchant settings, products, and business info
 """
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Optional, Dict
 from jose import JWTError, jwt
 
-from ..core.database import get_db
+from ..core.database import get_async_db
 from ..core.config import settings
 from ..models.merchant import Merchant
-from ..services.ai_service import AIService
+from ..services.ai_service import get_ai_service
+from ..services.merchant_cache import merchant_cache
+from ..services.product_embeddings import product_embeddings
+from ..services.product_index import product_indexes
+from ..services.prompt_compiler import merchant_version, prompt_compiler
+from ..services.response_cache import response_cache
+from ..services.usage_tracker import usage_tracker
+from .rate_limits import limit_merchant
 
 merchants_router = APIRouter()
 security = HTTPBearer()
@@ -46,11 +54,10 @@ class MerchantUpdate(BaseModel):
 class TestMessageRequest(BaseModel):
     message: str
 
-def get_current_merchant(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> Merchant:
-    """Get current authenticated merchant"""
+async def get_current_merchant_id(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> str:
+    """Get the authenticated merchant's ID from the JWT (rate limited per merchant)"""
     try:
         payload = jwt.decode(
             credentials.credentials, 
@@ -63,12 +70,42 @@ def get_current_merchant(
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    merchant = db.query(Merchant).filter(Merchant.id == merchant_id).first()
+    await limit_merchant(merchant_id)
+    return merchant_id
+
+async def get_current_merchant(
+    merchant_id: str = Depends(get_current_merchant_id),
+    db: AsyncSession = Depends(get_async_db)
+) -> Merchant:
+    """Get current authenticated merchant (cached, read-only snapshot)"""
+    merchant = await merchant_cache.get_by_id(db, merchant_id)
+    if merchant is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    
+    return merchant
+
+async def get_current_merchant_for_update(
+    merchant_id: str = Depends(get_current_merchant_id),
+    db: AsyncSession = Depends(get_async_db)
+) -> Merchant:
+    """Get current authenticated merchant attached to the request session"""
+    merchant = await db.scalar(select(Merchant).where(Merchant.id == merchant_id))
     if merchant is None:
         raise HTTPException(status_code=404, detail="Merchant not found")
     
     return merchant
 
+def invalidate_merchant_caches(merchant_id: str):
+    """Drop cached state derived from a merchant after a profile or catalog change"""
+    merchant_cache.invalidate(merchant_id)
+    prompt_compiler.invalidate(merchant_id)
+    response_cache.invalidate(merchant_id)
+
+def schedule_catalog_embeddings(merchant: Merchant):
+    """Re-embed a changed catalog in the background (one batched build per change)"""
+    if settings.ENABLE_SEMANTIC_SEARCH:
+        product_embeddings.schedule(merchant)
+
 @merchants_router.get("/profile")
 async def get_merchant_profile(
     merchant: Merchant = Depends(get_current_merchant)
@@ -98,10 +135,11 @@ async def get_merchant_profile(
 @merchants_router.put("/profile")
 async def update_merchant_profile(
     update_data: MerchantUpdate,
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant_for_update),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update merchant profile and settings"""
+    previous_version = merchant_version(merchant)
     try:
         # Update business info
         if update_data.business_info:
@@ -127,8 +165,10 @@ async def update_merchant_profile(
             if update_data.ai_settings.custom_instructions:
                 merchant.custom_instructions = update_data.ai_settings.custom_instructions
         
-        db.commit()
-        db.refresh(merchant)
+        await db.commit()
+        invalidate_merchant_caches(merchant.id)
+        await db.refresh(merchant)
+        product_indexes.rebase(merchant.id, previous_version, merchant_version(merchant))
         
         return {
             "status": "success",
@@ -137,7 +177,7 @@ async def update_merchant_profile(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Update failed: {str(e)}")
 
 @merchants_router.get("/products")
@@ -154,10 +194,11 @@ async def get_products(
 @merchants_router.post("/products")
 async def add_product(
     product: ProductItem,
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant_for_update),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Add product to catalog"""
+    previous_version = merchant_version(merchant)
     try:
         # Initialize product catalog if None
         if merchant.product_catalog is None:
@@ -171,8 +212,11 @@ async def add_product(
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(merchant, "product_catalog")
         
-        db.commit()
-        db.refresh(merchant)
+        await db.commit()
+        invalidate_merchant_caches(merchant.id)
+        await db.refresh(merchant)
+        product_indexes.on_product_added(merchant.id, previous_version, merchant_version(merchant), new_product)
+        schedule_catalog_embeddings(merchant)
         
         return {
             "status": "success",
@@ -182,17 +226,18 @@ async def add_product(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to add product: {str(e)}")
 
 @merchants_router.put("/products/{product_index}")
 async def update_product(
     product_index: int,
     product: ProductItem,
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant_for_update),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update product in catalog"""
+    previous_version = merchant_version(merchant)
     try:
         if not merchant.product_catalog or product_index >= len(merchant.product_catalog):
             raise HTTPException(status_code=404, detail="Product not found")
@@ -204,8 +249,13 @@ async def update_product(
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(merchant, "product_catalog")
         
-        db.commit()
-        db.refresh(merchant)
+        await db.commit()
+        invalidate_merchant_caches(merchant.id)
+        await db.refresh(merchant)
+        product_indexes.on_product_updated(
+            merchant.id, previous_version, merchant_version(merchant), product_index, merchant.product_catalog[product_index]
+        )
+        schedule_catalog_embeddings(merchant)
         
         return {
             "status": "success",
@@ -214,16 +264,17 @@ async def update_product(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to update product: {str(e)}")
 
 @merchants_router.delete("/products/{product_index}")
 async def delete_product(
     product_index: int,
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant_for_update),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete product from catalog"""
+    previous_version = merchant_version(merchant)
     try:
         if not merchant.product_catalog or product_index >= len(merchant.product_catalog):
             raise HTTPException(status_code=404, detail="Product not found")
@@ -235,8 +286,11 @@ async def delete_product(
         from sqlalchemy.orm.attributes import flag_modified
         flag_modified(merchant, "product_catalog")
         
-        db.commit()
-        db.refresh(merchant)
+        await db.commit()
+        invalidate_merchant_caches(merchant.id)
+        await db.refresh(merchant)
+        product_indexes.on_product_deleted(merchant.id, previous_version, merchant_version(merchant), product_index)
+        schedule_catalog_embeddings(merchant)
         
         return {
             "status": "success",
@@ -246,7 +300,7 @@ async def delete_product(
         }
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to delete product: {str(e)}")
 
 @merchants_router.post("/test-ai")
@@ -256,7 +310,7 @@ async def test_ai_response(
 ):
     """Test AI response generation"""
     try:
-        ai_service = AIService()
+        ai_service = get_ai_service()
         result = await ai_service.test_ai_response(merchant, test_request.message)
         
         return {
@@ -300,7 +354,7 @@ async def get_subscription_info(
         "message_limit": merchant.monthly_message_limit,
         "messages_used": merchant.monthly_message_count,
         "messages_remaining": merchant.monthly_message_limit - merchant.monthly_message_count,
-        "can_send_messages": merchant.can_send_message(),
+        "can_send_messages": usage_tracker.can_send_message(merchant),
         "tier_price": tier_info.get("price", 0),
         "available_tiers": settings.TIER_LIMITS
     } 
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+Rate Limit Dependencies for IG-Shop-Agent V2
+Per client IP and per merchant limits on the dashboard API, answered with 429 and Retry-After
+"""
+from fastapi import HTTPException, Request
+
+from ..core.config import settings
+from ..services.rate_limiter import RateDecision, rate_limiter
+
+def too_many_requests(decision: RateDecision) -> HTTPException:
+    """429 response telling the client when to retry"""
+    return HTTPException(
+        status_code=429,
+        detail="Rate limit exceeded. Please slow down.",
+        headers={"Retry-After": decision.retry_after_header}
+    )
+
+def client_ip(request: Request) -> str:
+    """Caller address (first X-Forwarded-For hop when a trusted proxy sets it)"""
+    if settings.RATE_LIMIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+async def limit_client_ip(request: Request) -> None:
+    """Router dependency: RATE_LIMIT_REQUESTS per RATE_LIMIT_WINDOW for each client IP"""
+    decision = await rate_limiter.check("ip", client_ip(request), settings.RATE_LIMIT_REQUESTS, settings.RATE_LIMIT_WINDOW)
+    if not decision.allowed:
+        raise too_many_requests(decision)
+
+async def limit_merchant(merchant_id: str) -> None:
+    """The same budget for each authenticated merchant, whatever IPs it calls from"""
+    decision = await rate_limiter.check("merchant", merchant_id, settings.RATE_LIMIT_REQUESTS, settings.RATE_LIMIT_WINDOW)
+    if not decision.allowed:
+        raise too_many_requests(decision)
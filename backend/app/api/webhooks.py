@@ -2,18 +2,33 @@
 Instagram Webhooks API for IG-Shop-Agent V2
 Process incoming Instagram DMs and trigger AI responses
 """
-from fastapi import APIRouter, Request, HTTPException, Depends, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Request, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import hashlib
 import hmac
 import json
-from typing import Dict, Any
+import time
+from functools import partial
+from typing import Dict, Any, List, Optional, Set, Tuple
 
-from ..core.database import get_db
+from ..core.database import AsyncSessionLocal
 from ..core.config import settings
+from ..core.token_crypto import TokenDecryptionError
 from ..models.merchant import Merchant
-from ..services.ai_service import AIService
-from ..services.instagram_service import InstagramService
+from ..services.ai_service import get_ai_service
+from ..services.instagram_service import get_instagram_service
+from ..services.webhook_queue import WebhookQueue, WebhookWorkerPool, QueuedWebhook
+from ..services.event_dispatcher import EventDispatcher
+from ..services.fair_scheduler import FairScheduler
+from ..services.message_dedup import MessageDeduplicator
+from ..services.message_coalescer import MessageCoalescer, merge_message_events
+from ..services.merchant_cache import merchant_cache
+from ..services.usage_tracker import usage_tracker
+from ..services.conversation_store import conversation_store
+from ..services.deadline import Deadline, deadline_stats
+from ..services.load_shedder import load_shedder
+from ..services.rate_limiter import rate_limiter
 
 webhook_router = APIRouter()
 
@@ -42,12 +57,19 @@ async def verify_webhook(request: Request):
     raise HTTPException(status_code=403, detail="Webhook verification failed")
 
 @webhook_router.post("/instagram")
-async def handle_instagram_webhook(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
-):
-    """Handle incoming Instagram webhook events"""
+async def handle_instagram_webhook(request: Request):
+    """Handle incoming Instagram webhook events
+    
+    Under overload the webhook is turned away with 503 before it is read,
+    so the queue stays bounded; Meta redelivers it later.
+    """
+    received_at = time.time()
+    if load_shedder.sheds():
+        raise HTTPException(
+            status_code=503,
+            detail="Overloaded, retry later",
+            headers={"Retry-After": str(load_shedder.retry_after)}
+        )
     try:
         # Get request body and signature
         body = await request.body()
@@ -61,60 +83,321 @@ async def handle_instagram_webhook(
             if not verify_webhook_signature(body, signature):
                 raise HTTPException(status_code=403, detail="Invalid signature")
         
-        # Parse webhook data
-        webhook_data = json.loads(body.decode())
-        
-        # Process webhook in background to respond quickly
-        background_tasks.add_task(
-            process_webhook_data,
-            webhook_data,
-            db
-        )
+        # Validate payload, then persist it for the worker pool to respond quickly
+        payload = body.decode()
+        json.loads(payload)
+        await asyncio.to_thread(webhook_queue.enqueue, payload, received_at=received_at)
+        webhook_workers.notify()
         
         return {"status": "success", "message": "Webhook received"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Webhook processing error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
-async def process_webhook_data(webhook_data: Dict[Any, Any], db: Session):
-    """Process Instagram webhook data"""
+async def process_queued_webhook(job: QueuedWebhook):
+    """Worker handler: process one queued payload with its own database session"""
+    webhook_data = json.loads(job.payload)
+    async with AsyncSessionLocal() as db:
+        await process_webhook_data(webhook_data, db, received_at=job.received_at)
+
+async def process_webhook_data(webhook_data: Dict[Any, Any], db: AsyncSession, received_at: Optional[float] = None):
+    """Process Instagram webhook data
+
+    Message IDs are leased first: completed ones are dropped, ones another
+    worker is still processing are re-queued to be checked again later.
+    Merchants are then resolved per entry; text bursts are coalesced per
+    conversation and fanned out through the dispatcher so different
+    conversations run concurrently while each (page_id, sender_id) stays in
+    order. Each flush settles its own claims; claims not yet handed to a
+    flush are released on any error or cancellation, and the error
+    propagates so the queue retries the payload. Each message's deadline
+    counts from received_at, when the webhook first arrived, however often
+    it was deferred or retried since; past it the payload is dropped.
+    """
+    entries = webhook_data.get("entry", [])
+    
+    # Drop redelivered messages before any merchant lookup or model work
+    mids = [
+        message_event.get("message", {}).get("mid")
+        for entry in entries
+        for message_event in entry.get("messaging", [])
+    ]
+    fresh_mids, held_mids = await message_deduplicator.claim_many(db, mids)
+    received_at = received_at or time.time()
+    if Deadline(settings.EVENT_DEADLINE, started_at=received_at).expired:
+        # Deferred or retried past its deadline: any reply now would be stale
+        print(f"⌛ Webhook received {time.time() - received_at:.0f}s ago is past its deadline, dropping")
+        await message_deduplicator.mark_done(db, list(fresh_mids))
+        return
+    jobs = []
+    started = False
+    
     try:
-        entries = webhook_data.get("entry", [])
-        
         for entry in entries:
             # Get page/user ID
             page_id = entry.get("id")
             
-            # Find merchant by Instagram page ID
-            merchant = db.query(Merchant).filter(
-                Merchant.instagram_page_id == page_id
-            ).first()
+            held = [
+                message_event for message_event in entry.get("messaging", [])
+                if message_event.get("message", {}).get("mid") in held_mids
+            ]
+            deferred: Set[str] = set()
+            if held:
+                # Still being processed elsewhere; look again once that finished or its lease lapsed
+                if await defer_events(
+                    webhook_data, entry, held, db, settings.DEDUP_HELD_RETRY_DELAY, received_at, release=False
+                ):
+                    deferred.update(conversation_key(page_id, message_event) for message_event in held)
+            
+            messaging = [
+                message_event for message_event in entry.get("messaging", [])
+                if is_fresh_event(message_event, fresh_mids)
+            ]
+            # A conversation with earlier messages waiting in the queue stays in order behind them
+            messaging = await defer_parked(webhook_data, entry, messaging, db, received_at, deferred)
+            if not messaging:
+                continue
+            
+            # Find merchant by Instagram page ID (cached snapshot)
+            merchant = await merchant_cache.get_by_page_id(db, page_id)
             
             if not merchant:
                 print(f"⚠️ Merchant not found for page ID: {page_id}")
+                await message_deduplicator.mark_done(db, event_mids(messaging))
                 continue
             
-            if not merchant.can_send_message():
+            if not usage_tracker.can_send_message(merchant):
                 print(f"⚠️ Merchant {merchant.business_name} cannot send messages (usage limit or inactive)")
+                await message_deduplicator.mark_done(db, event_mids(messaging))
                 continue
             
-            # Process messaging events
-            messaging = entry.get("messaging", [])
+            # Under heavy load lower-tier merchants wait in the queue so higher tiers keep their latency
+            if load_shedder.defers(merchant.subscription_tier, f"{len(messaging)} event(s) of {merchant.business_name}"):
+                await defer_events(webhook_data, entry, messaging, db, load_shedder.defer_delay, received_at)
+                continue
+            
+            # Messages beyond the merchant's per-minute rate or scheduler queue wait in
+            # the webhook queue instead of taking workers and model capacity from other merchants
+            messaging = await defer_over_limit(webhook_data, entry, merchant, messaging, db, received_at)
             
+            # Process messaging events; text bursts are coalesced per conversation
             for message_event in messaging:
-                await process_message_event(message_event, merchant, db)
-                
-    except Exception as e:
-        print(f"❌ Error processing webhook data: {e}")
+                sender_id = message_event.get("sender", {}).get("id")
+                key = (page_id, sender_id)
+                if message_event.get("message", {}).get("text"):
+                    jobs.append(message_coalescer.submit(
+                        key,
+                        message_event,
+                        partial(dispatch_message_events, key, merchant, received_at=received_at)
+                    ))
+                else:
+                    jobs.append(dispatch_message_events(key, merchant, [message_event], received_at=received_at))
+        
+        started = True
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    except BaseException:
+        # The payload will be retried, so claims no flush owns must not look taken
+        if not started:
+            for job in jobs:
+                job.close()
+        await asyncio.shield(message_deduplicator.abandon(db, fresh_mids))
+        raise
+
+async def defer_over_limit(
+    webhook_data: Dict[Any, Any],
+    entry: Dict[Any, Any],
+    merchant: Merchant,
+    messaging: List[Dict[Any, Any]],
+    db: AsyncSession,
+    received_at: float
+) -> List[Dict[Any, Any]]:
+    """Events within the merchant's messages_per_minute and scheduler queue; the rest are re-queued for later"""
+    limits = settings.TIER_LIMITS.get(merchant.subscription_tier or "starter") or settings.TIER_LIMITS["starter"]
+    per_minute = limits["messages_per_minute"]
+    room = fair_scheduler.room(merchant.id, merchant.subscription_tier)
+    decision = None
+    for position, message_event in enumerate(messaging):
+        if position >= room:
+            break
+        decision = await rate_limiter.check("webhook", merchant.id, per_minute, 60)
+        if not decision.allowed:
+            break
+    else:
+        return messaging
+    
+    deferred = messaging[position:]
+    if decision is not None and not decision.allowed:
+        # Late enough for the whole remainder to fit the bucket, so it is not deferred again piecemeal
+        delay = decision.retry_after + (len(deferred) - 1) * 60 / per_minute
+    else:
+        # Waiting jobs would only hold webhook workers until the scheduler reaches them
+        delay = settings.SCHEDULER_DEFER_DELAY
+    reason = f"over {per_minute} messages/minute" if decision is not None and not decision.allowed else "scheduler queue full"
+    if await defer_events(webhook_data, entry, deferred, db, delay, received_at):
+        print(f"⏳ Merchant {merchant.business_name} {reason}, deferring {len(deferred)} for {delay:.1f}s")
+    return messaging[:position]
+
+async def defer_parked(
+    webhook_data: Dict[Any, Any],
+    entry: Dict[Any, Any],
+    messaging: List[Dict[Any, Any]],
+    db: AsyncSession,
+    received_at: float,
+    deferred: Set[str]
+) -> List[Dict[Any, Any]]:
+    """Events whose conversation has no earlier deferred messages; the rest are re-queued behind those
+
+    deferred holds conversations this payload has already deferred events of.
+    """
+    page_id = entry.get("id")
+    keys = {conversation_key(page_id, message_event) for message_event in messaging}
+    parked = await asyncio.to_thread(webhook_queue.parked, keys - deferred, received_at)
+    now = time.time()
+    due: Dict[float, List[Dict[Any, Any]]] = {}
+    kept = []
+    for message_event in messaging:
+        key = conversation_key(page_id, message_event)
+        if key in deferred:
+            delay = settings.DEDUP_HELD_RETRY_DELAY
+        elif key in parked:
+            # Just after the parked messages, which are due at the same time
+            delay = parked[key] - now + 0.01
+        else:
+            kept.append(message_event)
+            continue
+        due.setdefault(delay, []).append(message_event)
+    for delay, events in due.items():
+        await defer_events(webhook_data, entry, events, db, delay, received_at)
+    return kept
+
+async def defer_events(
+    webhook_data: Dict[Any, Any],
+    entry: Dict[Any, Any],
+    events: List[Dict[Any, Any]],
+    db: AsyncSession,
+    delay: float,
+    received_at: float,
+    release: bool = True
+) -> bool:
+    """Put events of an entry back in the webhook queue, due after delay seconds
+
+    The copy keeps received_at, so its deadline still counts from the
+    original webhook. Events that would only be due after that deadline are
+    dropped instead (False). Claims this worker holds are released (or, when
+    dropping, settled); with release=False the events belong to another
+    worker's claims, which are left alone. The events' conversations are
+    parked until they are due, so later messages wait behind them.
+    """
+    if time.time() + delay >= received_at + settings.EVENT_DEADLINE:
+        print(f"⌛ {len(events)} event(s) would only be due past their deadline, dropping instead of deferring")
+        if release:
+            await message_deduplicator.mark_done(db, event_mids(events))
+        return False
+    # The deferred copy must not be dropped as a duplicate when it comes back
+    if release:
+        await message_deduplicator.release(db, event_mids(events))
+    await asyncio.to_thread(
+        webhook_queue.enqueue,
+        json.dumps({"object": webhook_data.get("object"), "entry": [{**entry, "messaging": events}]}),
+        received_at=received_at,
+        delay=delay,
+        conversations={conversation_key(entry.get("id"), message_event) for message_event in events}
+    )
+    return True
+
+async def dispatch_message_events(
+    key: Tuple[str, str],
+    merchant: Merchant,
+    message_events: List[Dict[Any, Any]],
+    received_at: Optional[float] = None
+):
+    """Run a (possibly coalesced) burst of events in its conversation's lane, in the merchant's fair share
 
-async def process_message_event(message_event: Dict[Any, Any], merchant: Merchant, db: Session):
-    """Process individual Instagram message event"""
+    The scheduler slot is taken before the lane, so a job waiting for its
+    merchant's turn never holds a lane another merchant's conversation hashes to.
+    A coalesced burst keeps the deadline of its first message. The burst's
+    message IDs are marked done once it was handled and released if it
+    failed or was cancelled, so a redelivery processes it again.
+    """
+    mids = event_mids(message_events)
+    message_deduplicator.hand_off(mids)
+    deadline = Deadline(settings.EVENT_DEADLINE, started_at=received_at)
+    try:
+        await fair_scheduler.run(
+            merchant.id,
+            merchant.subscription_tier,
+            partial(
+                event_dispatcher.run,
+                key,
+                partial(process_message_event_in_session, merge_message_events(message_events), merchant, deadline)
+            )
+        )
+    except BaseException:
+        await asyncio.shield(settle_claims(mids, done=False))
+        raise
+    await settle_claims(mids, done=True)
+
+async def settle_claims(mids: List[str], done: bool) -> None:
+    """Mark message IDs done or release them, in a session of their own"""
+    if not mids:
+        return
+    async with AsyncSessionLocal() as db:
+        if done:
+            await message_deduplicator.mark_done(db, mids)
+        else:
+            await message_deduplicator.release(db, mids)
+
+def conversation_key(page_id: Optional[str], message_event: Dict[Any, Any]) -> str:
+    """Queue key of an event's (page_id, sender_id) conversation"""
+    return f"{page_id}:{message_event.get('sender', {}).get('id')}"
+
+def event_mids(message_events: List[Dict[Any, Any]]) -> List[str]:
+    """Message IDs of the events that have one"""
+    return [
+        message_event["message"]["mid"]
+        for message_event in message_events
+        if message_event.get("message", {}).get("mid")
+    ]
+
+def is_fresh_event(message_event: Dict[Any, Any], fresh_mids: Set[str]) -> bool:
+    """Events without a message ID (reads, reactions) are never treated as duplicates"""
+    mid = message_event.get("message", {}).get("mid")
+    return mid is None or mid in fresh_mids
+
+async def process_message_event_in_session(
+    message_event: Dict[Any, Any],
+    merchant: Merchant,
+    deadline: Optional[Deadline] = None
+):
+    """Run process_message_event with a session of its own (sessions are not shared across lanes)"""
+    async with AsyncSessionLocal() as db:
+        await process_message_event(message_event, merchant, db, deadline)
+
+async def process_message_event(
+    message_event: Dict[Any, Any],
+    merchant: Merchant,
+    db: AsyncSession,
+    deadline: Optional[Deadline] = None
+):
+    """Process individual Instagram message event within its deadline
+    
+    Time spent in the queue, coalescing window and scheduler is charged to
+    the "queued" stage; the AI service and sender charge theirs as they go.
+    Returns normally once the reply went out or the event was deliberately
+    dropped (invalid, or no reply possible before the deadline); raises if
+    it should be processed again.
+    """
+    deadline = deadline or Deadline(settings.EVENT_DEADLINE)
+    deadline.lap("queued")
     try:
         # Extract message data
         sender_id = message_event.get("sender", {}).get("id")
-        recipient_id = message_event.get("recipient", {}).get("id")
-        timestamp = message_event.get("timestamp")
         
         # Get message content
         message_data = message_event.get("message", {})
@@ -127,36 +410,99 @@ async def process_message_event(message_event: Dict[Any, Any], merchant: Merchan
         
         print(f"📨 Processing message from {sender_id}: {message_text[:50]}...")
         
-        # Initialize services
-        ai_service = AIService()
-        instagram_service = InstagramService()
+        # Application-scoped services sharing pooled connections
+        ai_service = get_ai_service()
+        instagram_service = get_instagram_service()
+        try:
+            instagram_service.access_token(merchant)
+        except TokenDecryptionError as e:
+            # No retry can send without a token; settle the message instead
+            print(f"❌ Cannot reply for merchant {merchant.id}: {e}")
+            return
         
-        # Generate AI response
-        ai_response = await ai_service.generate_response(
-            message_text=message_text,
-            merchant=merchant,
-            sender_id=sender_id,
-            db=db
-        )
+        # Generate the AI response and send it via Instagram (streamed replies
+        # start sending while the rest is still being generated). The n-th
+        # message of the reply to an inbound message is keyed, so a retried
+        # webhook job never sends it twice.
+        sends = 0
         
-        if ai_response:
-            # Send response via Instagram
-            await instagram_service.send_message(
+        async def send(text: str) -> bool:
+            nonlocal sends
+            sends += 1
+            return await instagram_service.send_message(
                 recipient_id=sender_id,
-                message_text=ai_response,
-                merchant=merchant
+                message_text=text,
+                merchant=merchant,
+                idempotency_key=f"{message_id}:{sends}" if message_id else None,
+                deadline=deadline
             )
+        
+        try:
+            ai_response = await ai_service.deliver_response(
+                message_text=message_text,
+                merchant=merchant,
+                sender_id=sender_id,
+                db=db,
+                send=send,
+                deadline=deadline
+            )
+        except Exception as e:
+            print(f"❌ Error processing message event: {e}")
+            raise
+        
+        if not ai_response:
+            if deadline.expired:
+                print(f"⚠️ No AI response sent to {sender_id} before the deadline, dropping")
+                return
+            raise RuntimeError(f"No AI response sent to {sender_id}")
+        
+        try:
+            # Update merchant usage (flushed to the database in batches)
+            usage_tracker.record(merchant.id)
             
-            # Update merchant usage
-            merchant.monthly_message_count += 1
-            db.commit()
-            
-            print(f"✅ AI response sent to {sender_id}")
-        else:
-            print("⚠️ No AI response generated")
-            
-    except Exception as e:
-        print(f"❌ Error processing message event: {e}")
+            # Remember the exchange for the next message of this conversation
+            await conversation_store.record_exchange(db, merchant.id, sender_id, message_text, ai_response)
+            deadline.lap("record")
+        except Exception as e:
+            # The reply is out; processing the message again would only send it twice
+            print(f"⚠️ Failed to record exchange with {sender_id}: {e}")
+        
+        print(f"✅ AI response sent to {sender_id}")
+    finally:
+        deadline_stats.record(deadline)
+
+webhook_queue = WebhookQueue(
+    settings.WEBHOOK_QUEUE_PATH,
+    visibility_timeout=settings.WEBHOOK_VISIBILITY_TIMEOUT,
+    max_attempts=settings.WEBHOOK_MAX_ATTEMPTS,
+    dead_retention=settings.WEBHOOK_DEAD_RETENTION_HOURS * 3600
+)
+event_dispatcher = EventDispatcher(
+    lanes=settings.DISPATCH_LANES,
+    max_concurrency=settings.DISPATCH_MAX_CONCURRENCY
+)
+fair_scheduler = FairScheduler(
+    max_concurrency=settings.SCHEDULER_MAX_CONCURRENCY,
+    tiers=settings.TIER_LIMITS
+)
+message_deduplicator = MessageDeduplicator(
+    ttl_seconds=settings.DEDUP_TTL_HOURS * 3600,
+    cache_size=settings.DEDUP_CACHE_SIZE,
+    lease_seconds=settings.WEBHOOK_VISIBILITY_TIMEOUT
+)
+message_coalescer = MessageCoalescer(
+    window_ms=settings.COALESCE_WINDOW_MS,
+    max_wait_ms=settings.COALESCE_MAX_WAIT_MS,
+    max_messages=settings.COALESCE_MAX_MESSAGES
+)
+webhook_workers = WebhookWorkerPool(
+    webhook_queue,
+    process_queued_webhook,
+    workers=settings.WEBHOOK_WORKERS,
+    poll_interval=settings.WEBHOOK_POLL_INTERVAL,
+    retry_backoff=settings.WEBHOOK_RETRY_BACKOFF
+)
+load_shedder.watch("queue_depth", lambda: webhook_queue.backlog() + fair_scheduler.waiting)
 
 @webhook_router.get("/test")
 async def test_webhook():
@@ -167,5 +513,14 @@ async def test_webhook():
         "version": "2.0.0",
         "verify_token": settings.META_WEBHOOK_VERIFY_TOKEN,
         "app_id": settings.META_APP_ID,
-        "environment": settings.ENVIRONMENT
+        "environment": settings.ENVIRONMENT,
+        "queue": webhook_queue.stats(),
+        "dispatcher": event_dispatcher.stats(),
+        "scheduler": fair_scheduler.stats(),
+        "load": load_shedder.stats(),
+        "deduplication": message_deduplicator.stats(),
+        "coalescing": message_coalescer.stats(),
+        "merchant_cache": merchant_cache.stats(),
+        "usage": usage_tracker.stats(),
+        "conversations": conversation_store.stats()
     } 
\ No newline at end of file
@@ -5,10 +5,8 @@ Ultra Low-Cost Instagram DM Automation Platform
 import os
 from typing import List, Dict, Any, ClassVar
 from pydantic_settings import BaseSettings
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, Text, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+
+DEFAULT_SECRET_KEY = "ultra-low-cost-instagram-ai-agent-v2"  # public; never usable for token encryption
 
 class Settings(BaseSettings):
     """Application settings"""
@@ -19,11 +17,13 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))  # server worker processes (gunicorn/uvicorn --workers)
     
     # Security
-    SECRET_KEY: str = os.getenv("SECRET_KEY", "ultra-low-cost-instagram-ai-agent-v2")
+    SECRET_KEY: str = os.getenv("SECRET_KEY", DEFAULT_SECRET_KEY)
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+    TOKEN_ENCRYPTION_KEY: str = os.getenv("TOKEN_ENCRYPTION_KEY", "")  # Fernet key for stored Instagram tokens (derived from a non-default SECRET_KEY when empty)
     
     # CORS Configuration
     CORS_ORIGINS: List[str] = [
@@ -51,14 +51,88 @@ class Settings(BaseSettings):
     # OpenAI Configuration (Direct API - Cost Optimized)
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = "gpt-4o"
-    OPENAI_MAX_TOKENS: int = 1500
+    OPENAI_SMALL_MODEL: str = os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini")  # routed simple turns
+    OPENAI_MAX_TOKENS: int = 1500           # hard cap; calls use the smaller limit derived from the DM length
     OPENAI_TEMPERATURE: float = 0.7
+    OPENAI_TIMEOUT: float = 10.0           # per-call deadline, including queueing for a slot
+    OPENAI_MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    OPENAI_MAX_CONNECTIONS: int = 20
+    
+    # LLM Resilience (circuit breaker, hedged requests, fallback models)
+    LLM_FALLBACK_MODELS: str = os.getenv("LLM_FALLBACK_MODELS", "gpt-4o-mini")  # tried in order after OPENAI_MODEL
+    LLM_ATTEMPT_SHARE: float = 0.6         # share of the remaining SLO one model gets when others follow it
+    LLM_BREAKER_WINDOW: float = 30.0       # seconds of outcomes behind the rolling error rate
+    LLM_BREAKER_MIN_CALLS: int = 10        # calls in the window before the breaker may trip
+    LLM_BREAKER_ERROR_RATE: float = 0.5    # error rate that opens the breaker
+    LLM_BREAKER_COOLDOWN: float = 15.0     # seconds open before a single probe call is let through
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+    LLM_HEDGE_PERCENTILE: float = 0.95     # a second request goes out once the first is slower than this
+    LLM_HEDGE_MIN_DELAY: float = 0.5       # seconds; floor on the hedge delay
+    LLM_HEDGE_MAX_RATIO: float = 0.1       # at most this share of calls are hedged
+    
+    # OpenAI account rate limits per model (requests and tokens per minute), shared by all workers
+    OPENAI_RATE_LIMITS: ClassVar[Dict[str, Dict[str, int]]] = {
+        "gpt-4o": {"rpm": int(os.getenv("OPENAI_GPT4O_RPM", "500")), "tpm": int(os.getenv("OPENAI_GPT4O_TPM", "30000"))},
+        "gpt-4o-mini": {"rpm": int(os.getenv("OPENAI_GPT4O_MINI_RPM", "500")), "tpm": int(os.getenv("OPENAI_GPT4O_MINI_TPM", "200000"))},
+        "text-embedding-3-small": {"rpm": int(os.getenv("OPENAI_EMBEDDING_RPM", "3000")), "tpm": int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))}
+    }
+    OPENAI_LIMIT_HEADROOM: float = 0.9     # share of the account limits the governor spends
+    OPENAI_LIMIT_BURST: float = 0.25       # bucket size as a share of one minute's budget
+    LLM_AIMD_MIN_CONCURRENCY: int = 1      # adaptive limit floor; OPENAI_MAX_CONCURRENCY is the ceiling
+    LLM_AIMD_LATENCY_TOLERANCE: float = 2.0  # a call slower than this times the baseline counts as overload
+    LLM_AIMD_DECREASE: float = 0.7         # multiplicative decrease on 429s, timeouts and slow calls
+    LLM_OVERLOAD_BACKOFF: float = 2.0      # seconds every worker waits after a 429 without Retry-After
     
     # Meta/Instagram Configuration
     META_APP_ID: str = os.getenv("META_APP_ID", "")
     META_APP_SECRET: str = os.getenv("META_APP_SECRET", "")
     META_WEBHOOK_VERIFY_TOKEN: str = os.getenv("META_WEBHOOK_VERIFY_TOKEN", "igshop_v2_webhook")
     
+    # Shared HTTP client (Instagram Graph API / Meta OAuth)
+    HTTP2_ENABLED: bool = True             # requires the h2 package
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_TIMEOUT: float = 10.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    
+    # Webhook Ingress Queue (durable local queue + async workers)
+    WEBHOOK_QUEUE_PATH: str = os.getenv("WEBHOOK_QUEUE_PATH", "./igshop_webhook_queue.db")
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "16"))
+    WEBHOOK_VISIBILITY_TIMEOUT: int = 120  # seconds before an unacked job is redelivered
+    WEBHOOK_MAX_ATTEMPTS: int = 5
+    WEBHOOK_DEAD_RETENTION_HOURS: int = 168  # dead-lettered payloads are kept a week for inspection
+    WEBHOOK_RETRY_BACKOFF: float = 2.0     # base seconds, doubled per attempt
+    WEBHOOK_POLL_INTERVAL: float = 1.0
+    DISPATCH_LANES: int = 64               # ordering lanes keyed on (page_id, sender_id)
+    DISPATCH_MAX_CONCURRENCY: int = int(os.getenv("DISPATCH_MAX_CONCURRENCY", "16"))
+    SCHEDULER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "16"))  # message jobs shared fairly by merchants
+    SCHEDULER_DEFER_DELAY: float = 5.0     # seconds a merchant's events wait in the queue once its scheduler queue is full
+    DEDUP_TTL_HOURS: int = 48              # Meta redelivers for well under two days
+    DEDUP_CACHE_SIZE: int = 50000          # in-memory message IDs in front of the table
+    DEDUP_HELD_RETRY_DELAY: float = 15.0   # seconds before re-checking a message another worker is processing
+    COALESCE_WINDOW_MS: int = int(os.getenv("COALESCE_WINDOW_MS", "1500"))  # 0 disables coalescing
+    COALESCE_MAX_WAIT_MS: int = 4000       # upper bound on how long a burst is held
+    COALESCE_MAX_MESSAGES: int = 5         # flush early once a burst reaches this size
+    
+    # Load shedding: the level each signal must reach for replies to degrade to templates,
+    # for LOAD_DEFER_TIERS merchants to be deferred, and for webhooks to be shed with 503
+    LOAD_THRESHOLDS: ClassVar[Dict[str, Dict[str, float]]] = {
+        "queue_depth": {"degrade": 200, "defer": 500, "shed": 2000},  # due webhook payloads plus jobs waiting for the scheduler
+        "llm_pressure": {"degrade": 1.5, "defer": 2.0, "shed": 4.0},  # LLM calls in flight or waiting per concurrency slot
+        "loop_lag": {"degrade": 0.1, "defer": 0.25, "shed": 1.0}      # seconds the event loop wakes up late
+    }
+    LOAD_SAMPLE_INTERVAL: float = 0.25     # seconds between samples of the signals
+    LOAD_RECOVERY_SECONDS: float = 5.0     # signals must stay below a level this long before it steps down
+    LOAD_DEFER_TIERS: str = os.getenv("LOAD_DEFER_TIERS", "starter")  # comma-separated tiers deferred first
+    LOAD_DEFER_DELAY: float = 5.0          # seconds deferred events wait in the queue (well within EVENT_DEADLINE)
+    LOAD_SHED_RETRY_AFTER: int = 10        # Retry-After on shed webhooks (Meta redelivers on non-200)
+
+    # Merchant Cache (webhook and auth hot paths)
+    MERCHANT_CACHE_SIZE: int = 1000
+    MERCHANT_CACHE_TTL: int = int(os.getenv("MERCHANT_CACHE_TTL", "300"))  # seconds
+    USAGE_FLUSH_INTERVAL: float = 5.0      # seconds between write-behind usage flushes
+
     # Azure Configuration (Minimal)
     AZURE_STORAGE_CONNECTION_STRING: str = os.getenv("AZURE_STORAGE_CONNECTION_STRING", "")
     AZURE_STORAGE_CONTAINER: str = "igshop-documents"
@@ -66,32 +140,100 @@ class Settings(BaseSettings):
     # Rate Limiting (Cost Control)
     RATE_LIMIT_REQUESTS: int = 100  # requests per minute
     RATE_LIMIT_WINDOW: int = 60     # window in seconds
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "sqlite" if WEB_CONCURRENCY > 1 else "memory")  # "memory" (per worker), "sqlite" or "redis" (shared)
+    RATE_LIMIT_SQLITE_PATH: str = os.getenv("RATE_LIMIT_SQLITE_PATH", "./igshop_rate_limits.db")
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_TRUST_FORWARDED_FOR: bool = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "false").lower() == "true"  # behind a proxy
     
     # AI Response Configuration
     MAX_CONVERSATION_HISTORY: int = 10  # Keep last 10 messages for context
+    CONVERSATION_HISTORY_TOKENS: int = 800  # token budget for history in each prompt
+    CONVERSATION_IDLE_SECONDS: int = 1800   # idle conversations leave memory and reload on demand
+    CONVERSATION_CACHE_SIZE: int = 5000     # conversations kept in memory
     DEFAULT_AI_RESPONSE: str = "I'm sorry, I'm currently unavailable. Please try again later."
+    EVENT_DEADLINE: float = float(os.getenv("EVENT_DEADLINE", "15"))  # seconds from webhook receipt to the last DM sent
+    DEADLINE_MIN_MODEL_SECONDS: float = 2.0  # less left than this: cached or templated reply instead of a model call
+    DEADLINE_SEND_RESERVE: float = 1.0       # seconds kept back from the model for sending the reply
+    INSTAGRAM_MAX_MESSAGE_CHARS: int = 1000  # Instagram DM text limit
+    
+    # Outbound Instagram sends (Send API: 100 text messages per second per professional account)
+    INSTAGRAM_GRAPH_BASE_URL: str = os.getenv("INSTAGRAM_GRAPH_BASE_URL", "https://graph.instagram.com/v18.0")
+    INSTAGRAM_DEMO_MODE: bool = os.getenv("INSTAGRAM_DEMO_MODE", "false").lower() == "true"  # simulate sends (local demos only)
+    INSTAGRAM_SEND_RATE: float = float(os.getenv("INSTAGRAM_SEND_RATE", "90"))  # messages per second per page
+    INSTAGRAM_SEND_BURST: float = 20.0      # messages a page may send back to back
+    INSTAGRAM_SEND_CONCURRENCY: int = 32    # Send API calls in flight per process
+    INSTAGRAM_SEND_MAX_ATTEMPTS: int = 4
+    INSTAGRAM_SEND_BACKOFF: float = 0.5     # base seconds, doubled per attempt, fully jittered
+    INSTAGRAM_SEND_MAX_BACKOFF: float = 8.0
+    REPLY_MAX_CHARS: int = 500              # reply length the prompt asks the model for
+    MIN_CHARS_PER_TOKEN: float = 2.0        # worst case across English and Arabic, sizes max_tokens
+    REPLY_SPLIT_CHARS: int = int(os.getenv("REPLY_SPLIT_CHARS", "0"))  # >0 sends streamed replies as several DMs of about this size
+    PROMPT_CACHE_SIZE: int = 500  # compiled system prompts kept in memory
+    PRODUCT_RETRIEVAL_TOP_K: int = 8      # products per prompt once a catalog is larger than this
+    PRODUCT_INDEX_CACHE_SIZE: int = 500   # merchants with an in-memory product index
+    
+    # Semantic Product Search (used when ENABLE_SEMANTIC_SEARCH is on)
+    EMBEDDING_PROVIDER: str = os.getenv("EMBEDDING_PROVIDER", "local")  # "local" (feature hashing) or "openai"
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    EMBEDDING_DIMENSIONS: int = 256
+    EMBEDDING_BATCH_SIZE: int = 128       # catalog items per embeddings request
+    EMBEDDING_QUERY_TIMEOUT: float = 1.5  # cap on embedding a message; the model's share of the deadline is kept back
+    EMBEDDING_QUERY_MIN_SECONDS: float = 0.3  # less than this to spare: lexical retrieval only
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "numpy")  # "numpy" (memory-mapped files) or "pgvector"
+    EMBEDDINGS_DIR: str = os.getenv("EMBEDDINGS_DIR", "./igshop_embeddings")
+    
+    # Response Cache
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "900"))  # seconds; 0 disables
+    RESPONSE_CACHE_PER_MERCHANT: int = 200  # cached replies kept per merchant
+    FAST_PATH_MIN_CONFIDENCE: float = 0.75  # below this, hours/price/availability questions go to the model
+    DEFAULT_TIMEZONE: str = os.getenv("DEFAULT_TIMEZONE", "Asia/Amman")  # for working hours without a "timezone" key
+    RESPONSE_CACHE_SIMILARITY: float = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))  # cosine threshold; 0 = exact only
     
     # Subscription Tiers (Cost-based) - ClassVar to avoid pydantic field annotation
+    # latency_slo: seconds to the reply (to its first token when streaming), fallback models included
+    # messages_per_minute: webhook messages processed per merchant; the excess is deferred, not dropped
+    # scheduler_weight: share of message job slots under contention; max_in_flight / max_queued: per-merchant caps
     TIER_LIMITS: ClassVar[Dict[str, Dict[str, Any]]] = {
-        "starter": {"messages": 1000, "price": 29},
-        "growth": {"messages": 5000, "price": 59},
-        "business": {"messages": 15000, "price": 99}
+        "starter": {
+            "messages": 1000, "price": 29, "input_tokens": 2000, "latency_slo": 8.0, "messages_per_minute": 30,
+            "scheduler_weight": 1, "max_in_flight": 4, "max_queued": 4
+        },
+        "growth": {
+            "messages": 5000, "price": 59, "input_tokens": 3000, "latency_slo": 6.0, "messages_per_minute": 60,
+            "scheduler_weight": 2, "max_in_flight": 6, "max_queued": 8
+        },
+        "business": {
+            "messages": 15000, "price": 99, "input_tokens": 4500, "latency_slo": 4.0, "messages_per_minute": 120,
+            "scheduler_weight": 4, "max_in_flight": 8, "max_queued": 16
+        }
+    }
+    
+    # Model per message complexity and tier: "small" is OPENAI_SMALL_MODEL, "large" is OPENAI_MODEL
+    MODEL_ROUTES: ClassVar[Dict[str, Dict[str, str]]] = {
+        "starter": {"simple": "small", "standard": "small", "complex": "large"},
+        "growth": {"simple": "small", "standard": "small", "complex": "large"},
+        "business": {"simple": "small", "standard": "large", "complex": "large"}
     }
     
     # Feature Flags
     ENABLE_VOICE_TRANSCRIPTION: bool = False  # Disabled for cost savings
     ENABLE_ADVANCED_ANALYTICS: bool = False   # Basic analytics only
     ENABLE_FILE_UPLOAD: bool = True           # Basic file upload
+    ENABLE_SEMANTIC_SEARCH: bool = False      # Hybrid BM25 + embedding product retrieval
+    ENABLE_FAST_PATH_ANSWERS: bool = True     # Templated hours/price/availability replies
+    ENABLE_STREAMING_REPLIES: bool = True     # Stream completions and stop at the DM length limit
+    ENABLE_MODEL_ROUTING: bool = True         # Simple turns go to OPENAI_SMALL_MODEL per MODEL_ROUTES
+    ENABLE_LOAD_SHEDDING: bool = os.getenv("ENABLE_LOAD_SHEDDING", "true").lower() == "true"  # Degrade, defer and shed under load
     
     @property
     def is_production(self) -> bool:
         """Check if running in production environment"""
-        return self.environment.lower() == "production"
+        return self.ENVIRONMENT.lower() == "production"
     
     @property
     def is_postgresql(self) -> bool:
         """Check if using PostgreSQL database"""
-        return self.database_url.startswith("postgresql://")
+        return self.DATABASE_URL.startswith(("postgresql://", "postgresql+", "postgres://"))
     
     class Config:
         env_file = ".env"
@@ -100,105 +242,6 @@ class Settings(BaseSettings):
 # Create settings instance
 settings = Settings()
 
-# Database Configuration
-if settings.is_postgresql:
-    # PostgreSQL for production
-    engine = create_engine(
-        settings.database_url,
-        pool_pre_ping=True,
-        pool_recycle=300,
-        echo=not settings.is_production
-    )
-else:
-    # SQLite for development
-    engine = create_engine(
-        settings.database_url,
-        connect_args={"check_same_thread": False},
-        echo=settings.debug
-    )
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-def get_db():
-    """Database dependency for FastAPI"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def create_demo_data():
-    """Create demo data - works for both SQLite and PostgreSQL"""
-    from sqlalchemy import text
-    
-    db = SessionLocal()
-    try:
-        # Check if demo data already exists
-        result = db.execute(text("SELECT COUNT(*) FROM merchants")).scalar()
-        if result > 0:
-            print("✅ Demo data already exists")
-            return
-        
-        # Create demo merchant
-        merchant_id = "demo_merchant_v2_2024"
-        
-        demo_merchant_sql = """
-        INSERT INTO merchants (
-            id, business_name, subscription_tier, languages, ai_personality,
-            working_hours, monthly_message_count, created_at, updated_at
-        ) VALUES (
-            :id, :business_name, :tier, :languages, :personality,
-            :hours, :count, :created, :updated
-        )
-        """
-        
-        db.execute(text(demo_merchant_sql), {
-            "id": merchant_id,
-            "business_name": "Demo Business V2 - Cloud Ready",
-            "tier": "starter",
-            "languages": "Arabic,English",
-            "personality": "friendly",
-            "hours": "9:00-17:00",
-            "count": 0,
-            "created": datetime.utcnow().isoformat(),
-            "updated": datetime.utcnow().isoformat()
-        })
-        
-        # Create demo products
-        products = [
-            {"name": "Premium Product", "price": 50.0, "description": "High quality premium item"},
-            {"name": "Quality Product", "price": 30.0, "description": "Good quality standard item"},
-            {"name": "Basic Product", "price": 20.0, "description": "Affordable basic item"}
-        ]
-        
-        for i, product in enumerate(products):
-            product_sql = """
-            INSERT INTO products (
-                id, merchant_id, name, price, description, created_at
-            ) VALUES (
-                :id, :merchant_id, :name, :price, :description, :created
-            )
-            """
-            
-            db.execute(text(product_sql), {
-                "id": f"prod_{i+1}",
-                "merchant_id": merchant_id,
-                "name": product["name"],
-                "price": product["price"],
-                "description": product["description"],
-                "created": datetime.utcnow().isoformat()
-            })
-        
-        db.commit()
-        print("✅ Demo data created successfully")
-        
-    except Exception as e:
-        print(f"⚠️ Error creating demo data: {e}")
-        db.rollback()
-    finally:
-        db.close()
-
 # Validation
 def validate_settings():
     """Validate critical settings"""
@@ -226,7 +269,7 @@ if settings.ENVIRONMENT != "test":
         print("🔧 Please check your .env file or environment variables")
 
 # Print configuration info
-print(f"🔧 Environment: {settings.environment}")
+print(f"🔧 Environment: {settings.ENVIRONMENT}")
 print(f"🗄️ Database: {'PostgreSQL' if settings.is_postgresql else 'SQLite'}")
 print(f"🚀 Production: {settings.is_production}")
-print(f"🤖 AI Model: {settings.openai_model}") 
\ No newline at end of file
+print(f"🤖 AI Model: {settings.OPENAI_MODEL}") 
\ No newline at end of file
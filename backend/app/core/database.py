@@ -1,12 +1,13 @@
 """
 Database configuration for IG-Shop-Agent V2
-Simplified SQLite setup for demo and development
+Simplified SQLite setup for demo and development, with a native async engine for request paths
 """
 import os
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from .config import settings
 
@@ -26,6 +27,48 @@ engine = create_engine(
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def async_database_url(url: str) -> str:
+    """The same database through its asyncio driver (aiosqlite or asyncpg)"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+def create_async_database_engine(url: str, echo: bool = False) -> AsyncEngine:
+    """Async engine for url (already in its async driver form)
+
+    SQLite connections use WAL and wait for the write lock instead of
+    failing at once, since async sessions now write concurrently.
+    """
+    if "sqlite" not in url:
+        return create_async_engine(
+            url,
+            echo=echo,
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+    async_engine = create_async_engine(url, echo=echo)
+    
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=10000")
+        cursor.close()
+    
+    return async_engine
+
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+
+# Async engine for the webhook pipeline and API routes; queries no longer block the event loop
+async_engine = create_async_database_engine(ASYNC_DATABASE_URL, echo=settings.ENVIRONMENT == "development")
+
+# Attributes stay loaded after commit: an async session cannot lazily reload them
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -37,11 +80,19 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
     """Create database tables"""
     try:
         # Import models to register them
         from ..models.merchant import Merchant
+        from ..models.processed_message import ProcessedMessage
+        from ..models.sent_message import SentMessage
+        from ..models.conversation_message import ConversationMessage
         
         # Create all tables
         Base.metadata.create_all(bind=engine)
@@ -0,0 +1,47 @@
+"""
+Shared HTTP Client for IG-Shop-Agent V2
+Application-scoped httpx connection pool for Instagram / Meta API calls
+"""
+import importlib.util
+from typing import Optional
+import httpx
+
+from .config import settings
+
+# httpx speaks HTTP/2 only when the h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create a pooled keep-alive client with connection limits and timeouts"""
+    return httpx.AsyncClient(
+        http2=settings.HTTP2_ENABLED and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily outside the app lifespan (scripts, tests)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+async def startup_http_client() -> httpx.AsyncClient:
+    """Open the shared client at application startup"""
+    client = get_http_client()
+    http2 = settings.HTTP2_ENABLED and HTTP2_AVAILABLE
+    print(f"🔌 Shared HTTP client ready (HTTP/2: {'on' if http2 else 'off'})")
+    return client
+
+async def shutdown_http_client():
+    """Close the shared client at application shutdown"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
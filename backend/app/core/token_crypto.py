@@ -0,0 +1,54 @@
+"""
+Token Encryption for IG-Shop-Agent V2
+Fernet encryption of merchant Instagram access tokens at rest
+"""
+import base64
+import hashlib
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from .config import DEFAULT_SECRET_KEY, settings
+
+# Secret keys published in the code and the env example: a key derived from them protects nothing
+PUBLIC_SECRET_KEYS = frozenset({"", DEFAULT_SECRET_KEY, "your-super-secret-key-change-in-production"})
+
+class TokenKeyError(RuntimeError):
+    """Neither TOKEN_ENCRYPTION_KEY nor a private SECRET_KEY is configured"""
+
+class TokenDecryptionError(Exception):
+    """A stored access token could not be decrypted (another key, or a pre-encryption hash)"""
+
+_cipher: Optional[Fernet] = None
+
+def _get_cipher() -> Fernet:
+    """Fernet on TOKEN_ENCRYPTION_KEY, or on a key derived from SECRET_KEY when it is unset"""
+    global _cipher
+    if _cipher is None:
+        key = settings.TOKEN_ENCRYPTION_KEY
+        if not key:
+            if settings.SECRET_KEY in PUBLIC_SECRET_KEYS:
+                raise TokenKeyError(
+                    "Set TOKEN_ENCRYPTION_KEY or SECRET_KEY: tokens encrypted with the default SECRET_KEY "
+                    "can be decrypted by anyone who has read the code"
+                )
+            key = base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode("utf-8")).digest()).decode()
+        _cipher = Fernet(key)
+    return _cipher
+
+def check_token_key() -> None:
+    """Fail at startup, rather than on the first OAuth callback, without a usable key"""
+    _get_cipher()
+
+def encrypt_token(token: str) -> str:
+    """Encrypt an access token for storage"""
+    return _get_cipher().encrypt(token.encode("utf-8")).decode("ascii")
+
+def decrypt_token(stored: str) -> str:
+    """Decrypt a stored access token"""
+    try:
+        return _get_cipher().decrypt(stored.encode("ascii")).decode("utf-8")
+    except (InvalidToken, UnicodeError, ValueError) as e:
+        raise TokenDecryptionError(
+            "Stored Instagram access token cannot be decrypted; the merchant must reconnect Instagram"
+        ) from e
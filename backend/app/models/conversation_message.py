@@ -0,0 +1,26 @@
+"""
+Conversation Message Model for IG-Shop-Agent V2
+Customer and assistant turns of each Instagram DM conversation
+"""
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from datetime import datetime, timezone
+
+from ..core.database import Base
+
+class ConversationMessage(Base):
+    """One turn of a (merchant, sender) conversation"""
+    
+    __tablename__ = "conversation_messages"
+    __table_args__ = (
+        Index("ix_conversation_messages_thread", "merchant_id", "sender_id", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    merchant_id = Column(String, nullable=False)
+    sender_id = Column(String, nullable=False)
+    role = Column(String(16), nullable=False)  # user, assistant
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    
+    def __repr__(self):
+        return f"<ConversationMessage(merchant_id={self.merchant_id}, sender_id={self.sender_id}, role={self.role})>"
@@ -20,7 +20,7 @@ class Merchant(Base):
     # Instagram Integration
     instagram_page_id = Column(String, unique=True, nullable=False, index=True)
     page_name = Column(String, nullable=False)
-    access_token_hash = Column(String, nullable=False)  # Hashed Instagram token
+    access_token_hash = Column(String, nullable=False)  # Encrypted Instagram token (see core.token_crypto)
     
     # Business Information
     business_name = Column(String, nullable=False)
@@ -0,0 +1,25 @@
+"""
+Processed Message Model for IG-Shop-Agent V2
+Idempotency records for Instagram message IDs (mid) being or already handled
+"""
+from sqlalchemy import Column, String, DateTime, Float
+from datetime import datetime, timezone
+
+from ..core.database import Base
+
+class ProcessedMessage(Base):
+    """Instagram message ID seen by the webhook pipeline, pruned after a TTL
+
+    A row is "processing" while a worker holds its lease and "done" once the
+    reply went out or the message was deliberately dropped.
+    """
+    
+    __tablename__ = "processed_messages"
+    
+    mid = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="processing")
+    lease_expires_at = Column(Float, nullable=True)  # epoch seconds; processing rows only
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    
+    def __repr__(self):
+        return f"<ProcessedMessage(mid={self.mid}, status={self.status})>"
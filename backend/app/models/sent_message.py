@@ -0,0 +1,20 @@
+"""
+Sent Message Model for IG-Shop-Agent V2
+Idempotency records for outbound Instagram DMs the Send API accepted
+"""
+from sqlalchemy import Column, String, DateTime
+from datetime import datetime, timezone
+
+from ..core.database import Base
+
+class SentMessage(Base):
+    """Outbound DM keyed by its idempotency key (one per chunk of a reply), pruned after a TTL"""
+    
+    __tablename__ = "sent_messages"
+    
+    idempotency_key = Column(String, primary_key=True)
+    message_id = Column(String, nullable=True)  # Graph API message ID
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    
+    def __repr__(self):
+        return f"<SentMessage(idempotency_key={self.idempotency_key}, message_id={self.message_id})>"
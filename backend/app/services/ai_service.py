@@ -2,22 +2,51 @@
 AI Service for IG-Shop-Agent V2
 OpenAI GPT-4o integration for generating Instagram DM responses
 """
-import openai
-from typing import Optional
-from sqlalchemy.orm import Session
-import json
+import asyncio
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core.config import settings
 from ..models.merchant import Merchant
+from .conversation_store import conversation_store
+from .deadline import Deadline
+from .fast_path import fast_path_responder
+from .llm_client import LLMRateLimitError, LLMRequestError, LLMError
+from .llm_resilience import resilient_llm
+from .load_shedder import load_shedder
+from .model_router import Route, model_router
+from .product_embeddings import product_embeddings, reciprocal_rank_fusion
+from .product_index import product_indexes
+from .prompt_compiler import CompiledPrompt, prompt_compiler
+from .reply_chunker import ReplyChunker
+from .response_cache import response_cache
+from .token_budget import completion_token_limit, input_token_budget, plan_prompt, token_counter, token_usage
+
+BUSY_RESPONSE = "I'm currently busy helping other customers. Please try again in a moment."
+
+@dataclass
+class PreparedPrompt:
+    """Messages for one model call and what is needed to account for it"""
+    messages: List[Dict[str, str]]
+    estimated_tokens: int
+    budget: int
+    cacheable: bool  # no earlier turns, so the reply may go into the response cache
+    merchant: Merchant
+    message_text: str
+    route: Route
 
 class AIService:
     """AI service for generating conversational responses"""
     
     def __init__(self):
-        """Initialize OpenAI client"""
-        openai.api_key = settings.OPENAI_API_KEY
+        """Initialize model settings (the OpenAI client itself is shared)"""
+        self.llm = resilient_llm
+        self.router = model_router
         self.model = settings.OPENAI_MODEL
-        self.max_tokens = settings.OPENAI_MAX_TOKENS
+        self.max_tokens = min(settings.OPENAI_MAX_TOKENS, completion_token_limit())
         self.temperature = settings.OPENAI_TEMPERATURE
     
     async def generate_response(
@@ -25,19 +54,27 @@ class AIService:
         message_text: str,
         merchant: Merchant,
         sender_id: str,
-        db: Session
+        db: Optional[AsyncSession],
+        deadline: Optional[Deadline] = None
     ) -> Optional[str]:
-        """Generate AI response for Instagram DM"""
+        """Generate AI response for Instagram DM within what is left of the deadline"""
+        deadline = deadline or Deadline(settings.EVENT_DEADLINE)
         try:
-            # Build context and prompt
-            system_prompt = self._build_system_prompt(merchant)
-            user_message = self._format_user_message(message_text, sender_id)
+            answer, prompt = await self._prepare(message_text, merchant, sender_id, db, deadline)
+            deadline.lap("prepare")
+            if prompt is None:
+                return answer
+            if self._skip_model(deadline, merchant):
+                return self._degraded_answer(prompt, settings.DEFAULT_AI_RESPONSE)
             
             # Call OpenAI GPT-4o
-            response = await self._call_openai(system_prompt, user_message)
+            response = await self._call_openai(prompt, self._model_timeout(deadline))
+            deadline.lap("model")
             
             if response:
                 print(f"🤖 AI generated response: {response[:100]}...")
+                if prompt.cacheable and response not in (BUSY_RESPONSE, settings.DEFAULT_AI_RESPONSE):
+                    response_cache.put(merchant, message_text, response)
                 return response
             else:
                 return settings.DEFAULT_AI_RESPONSE
@@ -46,93 +83,279 @@ class AIService:
             print(f"❌ AI service error: {e}")
             return settings.DEFAULT_AI_RESPONSE
     
-    def _build_system_prompt(self, merchant: Merchant) -> str:
-        """Build system prompt with merchant context"""
-        # Default product catalog if none exists
-        products = merchant.product_catalog or [
-            {
-                "name": "Sample Product",
-                "description": "A great product for customers",
-                "price": "Contact for pricing",
-                "availability": "In stock"
-            }
-        ]
+    async def deliver_response(
+        self,
+        message_text: str,
+        merchant: Merchant,
+        sender_id: str,
+        db: Optional[AsyncSession],
+        send: Callable[[str], Awaitable[bool]],
+        deadline: Optional[Deadline] = None
+    ) -> Optional[str]:
+        """Generate a reply and hand it to send, streaming model replies in chunks when enabled
         
-        # Build working hours info
-        hours_info = "We're available during business hours"
-        if merchant.working_hours:
-            hours_info = f"Our working hours: {json.dumps(merchant.working_hours)}"
+        The model gets what is left of the deadline after keeping
+        DEADLINE_SEND_RESERVE back for sending; with less than
+        DEADLINE_MIN_MODEL_SECONDS left, or while the load shedder degrades
+        replies, a templated reply goes out instead. Once the deadline has
+        passed no reply starts going out, not even a templated one.
+        Returns the text that was delivered, or None if nothing was sent.
+        """
+        deadline = deadline or Deadline(settings.EVENT_DEADLINE)
+        if self._stale(deadline, sender_id):
+            return None
+        if not settings.ENABLE_STREAMING_REPLIES:
+            response = await self.generate_response(message_text, merchant, sender_id, db, deadline)
+            delivered = response if response and not self._stale(deadline, sender_id) and await send(response) else None
+            deadline.lap("send")
+            return delivered
         
-        system_prompt = f"""You are a helpful AI assistant for {merchant.business_name}, an Instagram business.
-
-BUSINESS INFORMATION:
-- Business Name: {merchant.business_name}
-- Category: {merchant.business_category or 'General Business'}
-- Description: {merchant.business_description or 'A great business serving customers'}
-- Instagram: @{merchant.page_name}
-- {hours_info}
-
-COMMUNICATION STYLE:
-- Be {merchant.ai_personality or 'friendly'} and professional
-- Respond in {merchant.default_language or 'Arabic'} primarily, fallback to {merchant.fallback_language or 'English'}
-- Keep responses concise and helpful
-- Always be polite and customer-focused
-
-PRODUCT CATALOG:
-{json.dumps(products, indent=2)}
-
-CAPABILITIES:
-- Answer questions about products and services
-- Provide pricing information
-- Help with orders and inquiries
-- Give business information
-- Handle customer service requests
-
-GUIDELINES:
-- If asked about products, refer to the catalog above
-- For orders, collect: product name, quantity, customer info, delivery address
-- If you can't help, politely direct them to contact us directly
-- Never make up information not provided in the context
-- Be helpful but don't overpromise
-
-IMPORTANT: Keep responses under 500 characters for Instagram DM limits."""
-
-        return system_prompt
+        try:
+            answer, prompt = await self._prepare(message_text, merchant, sender_id, db, deadline)
+        except Exception as e:
+            print(f"❌ AI service error: {e}")
+            answer, prompt = settings.DEFAULT_AI_RESPONSE, None
+        deadline.lap("prepare")
+        if prompt is not None and self._skip_model(deadline, merchant):
+            answer, prompt = self._degraded_answer(prompt, settings.DEFAULT_AI_RESPONSE), None
+        if prompt is None:
+            delivered = answer if answer and not self._stale(deadline, sender_id) and await send(answer) else None
+            deadline.lap("send")
+            return delivered
+        
+        response, complete = await self._stream_openai(prompt, send, deadline)
+        # A fragment (stream or a send failed partway) must never be served as the whole answer
+        if complete and prompt.cacheable and response not in (BUSY_RESPONSE, settings.DEFAULT_AI_RESPONSE):
+            response_cache.put(merchant, message_text, response)
+        return response
+    
+    async def _prepare(
+        self,
+        message_text: str,
+        merchant: Merchant,
+        sender_id: str,
+        db: Optional[AsyncSession],
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[Optional[str], Optional[PreparedPrompt]]:
+        """Either a ready answer (fast path or cache) or the prompt for a model call"""
+        # Hours, price and availability questions answered straight from merchant data
+        if settings.ENABLE_FAST_PATH_ANSWERS:
+            answer = fast_path_responder.answer(merchant, message_text)
+            if answer:
+                print(f"⚡ Fast-path answer for merchant {merchant.id}")
+                return answer, None
+        
+        # Recent turns of this conversation (empty for a new one)
+        turns = await conversation_store.history(db, merchant.id, sender_id)
+        
+        # Repeated questions are answered from the merchant's response cache,
+        # but only when no earlier turns could change their meaning
+        if not turns:
+            cached = response_cache.get(merchant, message_text)
+            if cached:
+                print(f"⚡ Cached AI response for merchant {merchant.id}")
+                return cached, None
+        
+        # Fit system prompt, relevant products and history into the tier's input budget
+        compiled = prompt_compiler.compile(merchant)
+        product_lines = await self._relevant_products(merchant, compiled, message_text, deadline)
+        user_message = self._format_user_message(message_text, sender_id)
+        budget = input_token_budget(merchant.subscription_tier)
+        plan = plan_prompt(
+            token_counter,
+            budget,
+            fixed_messages=[
+                {"role": "system", "content": compiled.with_products([])},
+                {"role": "user", "content": user_message}
+            ],
+            product_lines=product_lines,
+            turns=turns,
+            history_cap=settings.CONVERSATION_HISTORY_TOKENS
+        )
+        if plan.product_lines == compiled.product_lines:
+            system_prompt = compiled.full
+        else:
+            system_prompt = compiled.with_products(plan.product_lines)
+        
+        return None, PreparedPrompt(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *plan.history,
+                {"role": "user", "content": user_message}
+            ],
+            estimated_tokens=plan.estimated_tokens,
+            budget=budget,
+            cacheable=not turns,
+            merchant=merchant,
+            message_text=message_text,
+            route=self.router.route(merchant, message_text, turns)
+        )
+    
+    async def _relevant_products(
+        self,
+        merchant: Merchant,
+        compiled: CompiledPrompt,
+        message_text: str,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """Catalog lines for the prompt, most relevant first"""
+        top_k = settings.PRODUCT_RETRIEVAL_TOP_K
+        if compiled.product_count <= top_k:
+            return compiled.product_lines
+        
+        # Large catalogs: only the best BM25 matches (or the first products if nothing matches),
+        # fused with embedding matches when semantic search is enabled
+        index = product_indexes.get(merchant)
+        positions = index.search(message_text, top_k)
+        if settings.ENABLE_SEMANTIC_SEARCH and message_text:
+            semantic = await product_embeddings.search(merchant, message_text, top_k, deadline)
+            if semantic:
+                positions = reciprocal_rank_fusion([positions, semantic], top_k)
+        return index.lines(positions or list(range(top_k)))
     
     def _format_user_message(self, message_text: str, sender_id: str) -> str:
         """Format user message with context"""
         return f"Customer (ID: {sender_id}) says: {message_text}"
     
-    async def _call_openai(self, system_prompt: str, user_message: str) -> Optional[str]:
+    def _skip_model(self, deadline: Deadline, merchant: Merchant) -> bool:
+        """Too little of the deadline left for a model call and the send after it, or too much load"""
+        if not deadline.allows(settings.DEADLINE_MIN_MODEL_SECONDS + settings.DEADLINE_SEND_RESERVE):
+            print(f"⏱️ {deadline.remaining():.1f}s left of the deadline, answering without the model")
+        elif not load_shedder.degrades(f"reply for {merchant.business_name}"):
+            return False
+        deadline.degraded = True
+        return True
+    
+    def _stale(self, deadline: Deadline, sender_id: str) -> bool:
+        """Whether the deadline passed, so a reply would arrive too late to start sending"""
+        if not deadline.expired:
+            return False
+        print(f"⌛ Deadline passed, dropping the reply to {sender_id}")
+        return True
+    
+    def _model_timeout(self, deadline: Deadline) -> float:
+        return deadline.timeout(settings.OPENAI_TIMEOUT, reserve=settings.DEADLINE_SEND_RESERVE)
+    
+    def _degraded_answer(self, prompt: PreparedPrompt, default: str) -> str:
+        """Templated answer when no model could reply, never cached"""
+        prompt.cacheable = False
+        return fast_path_responder.fallback(prompt.merchant, prompt.message_text) or default
+    
+    async def _call_openai(self, prompt: PreparedPrompt, timeout: Optional[float] = None) -> Optional[str]:
         """Call OpenAI API with error handling"""
+        started = time.monotonic()
         try:
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+            completion = await self.llm.complete(
+                messages=prompt.messages,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
-                timeout=10  # 10 second timeout for cost control
+                tier=prompt.merchant.subscription_tier,
+                model=prompt.route.model,
+                estimated_tokens=prompt.estimated_tokens,
+                timeout=timeout
             )
+            self.router.record(prompt.route, time.monotonic() - started)
+            token_usage.record(prompt.estimated_tokens, completion.prompt_tokens, completion.completion_tokens, prompt.budget)
+            return completion.content
             
-            if response.choices and response.choices[0].message:
-                return response.choices[0].message.content.strip()
+        except LLMRateLimitError:
+            print("⚠️ OpenAI rate limit reached")
+            return self._degraded_answer(prompt, BUSY_RESPONSE)
             
-            return None
+        except LLMRequestError as e:
+            print(f"⚠️ OpenAI request error: {e}")
+            return settings.DEFAULT_AI_RESPONSE
+            
+        except LLMError as e:
+            print(f"❌ OpenAI API error: {e}")
+            return self._degraded_answer(prompt, settings.DEFAULT_AI_RESPONSE)
+    
+    async def _stream_openai(
+        self,
+        prompt: PreparedPrompt,
+        send: Callable[[str], Awaitable[bool]],
+        deadline: Deadline
+    ) -> Tuple[Optional[str], bool]:
+        """Stream a completion, sending each finished message while the rest is generated
+        
+        Generation stops at a sentence boundary once the reply reaches the
+        Instagram length limit, so no tokens are paid for past what is sent.
+        Returns the delivered text and whether it is the model's whole reply
+        (the stream finished without a fallback and every message went out).
+        """
+        chunker = ReplyChunker(
+            soft_limit=settings.REPLY_MAX_CHARS,
+            hard_limit=settings.INSTAGRAM_MAX_MESSAGE_CHARS,
+            split_chars=settings.REPLY_SPLIT_CHARS
+        )
+        outbox: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        delivered: List[str] = []
+        missed = 0
+        
+        async def sender():
+            nonlocal missed
+            # Sends in order, concurrently with the rest of the generation; a reply
+            # not started by the deadline is dropped, one under way is finished
+            while (message := await outbox.get()) is not None:
+                if not delivered and deadline.expired:
+                    missed += 1
+                    continue
+                if await send(message):
+                    delivered.append(message)
+                else:
+                    missed += 1
+        
+        sender_task = asyncio.create_task(sender())
+        fallback: Optional[str] = None
+        started = time.monotonic()
+        try:
+            stream = self.llm.stream(
+                messages=prompt.messages,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                tier=prompt.merchant.subscription_tier,
+                model=prompt.route.model,
+                estimated_tokens=prompt.estimated_tokens,
+                timeout=self._model_timeout(deadline)
+            )
+            async with aclosing(stream.chunks()) as chunks:
+                async for delta in chunks:
+                    for message in chunker.feed(delta):
+                        outbox.put_nowait(message)
+                    if chunker.stopped:
+                        break
+            for message in chunker.finish():
+                outbox.put_nowait(message)
+            self.router.record(prompt.route, time.monotonic() - started, stream.first_token_latency)
+            token_usage.record(prompt.estimated_tokens, stream.prompt_tokens, stream.completion_tokens, prompt.budget)
+            if stream.first_token_latency is not None:
+                print(f"🤖 AI reply streamed from {stream.model} ({chunker.released} chars, first token after {stream.first_token_latency:.2f}s)")
             
-        except openai.error.RateLimitError:
+        except LLMRateLimitError:
             print("⚠️ OpenAI rate limit reached")
-            return "I'm currently busy helping other customers. Please try again in a moment."
+            fallback = self._degraded_answer(prompt, BUSY_RESPONSE)
             
-        except openai.error.InvalidRequestError as e:
+        except LLMRequestError as e:
             print(f"⚠️ OpenAI request error: {e}")
-            return settings.DEFAULT_AI_RESPONSE
+            fallback = settings.DEFAULT_AI_RESPONSE
             
-        except Exception as e:
+        except LLMError as e:
             print(f"❌ OpenAI API error: {e}")
-            return None
+            fallback = self._degraded_answer(prompt, settings.DEFAULT_AI_RESPONSE)
+        
+        finally:
+            # Sends overlap generation; "send" is the time spent after the model finished
+            deadline.lap("model")
+            # Nothing was released yet: the customer gets the fallback instead of a fragment
+            if fallback and not chunker.released:
+                outbox.put_nowait(fallback)
+            outbox.put_nowait(None)
+            await sender_task
+            deadline.lap("send")
+        
+        if fallback and not chunker.released:
+            return (fallback if delivered else None), False
+        return "\n".join(delivered) or None, fallback is None and not missed and bool(delivered)
     
     async def test_ai_response(self, merchant: Merchant, test_message: str) -> dict:
         """Test AI response generation (for API testing)"""
@@ -157,4 +380,13 @@ IMPORTANT: Keep responses under 500 characters for Instagram DM limits."""
                 "status": "error",
                 "error": str(e),
                 "test_message": test_message
-            } 
\ No newline at end of file
+            }
+
+_ai_service: Optional[AIService] = None
+
+def get_ai_service() -> AIService:
+    """Application-scoped AIService singleton"""
+    global _ai_service
+    if _ai_service is None:
+        _ai_service = AIService()
+    return _ai_service
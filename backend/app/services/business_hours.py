@@ -0,0 +1,164 @@
+"""
+Business Hours for IG-Shop-Agent V2
+Compiles a merchant's free-form working hours into a weekly schedule with "open now" checks
+"""
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from ..core.config import settings
+from .prompt_compiler import compact_json
+from .text_normalizer import normalize_text
+
+Range = Tuple[int, int]  # minutes from the start of the day; end may pass 1440 for overnight hours
+
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+ARABIC_DAY_NAMES = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+
+_DAY_ALIASES = {}
+for _number, (_english, _arabic) in enumerate(zip(DAY_NAMES, ARABIC_DAY_NAMES)):
+    for _alias in (_english, _english[:3], normalize_text(_arabic)):
+        _DAY_ALIASES[_alias] = _number
+_DAY_ALIASES.update({"tues": 1, "wednes": 2, "thur": 3, "thurs": 3, "اثنين": 0, "ثلاثاء": 1, "اربعاء": 2, "خميس": 3, "جمعه": 4, "سبت": 5, "احد": 6})
+
+_CLOSED = re.compile(r"\bclosed\b|\boff\b|مغلق|مسكر|عطله")
+_ALL_DAY = re.compile(r"24\s*(?:/\s*7|h|hours|hrs|ساعه)|all day|طوال اليوم")
+_TIME = re.compile(r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.|ص|م|صباحا|مساء)?")
+_RANGE_SPLIT = re.compile(r"\s*(?:-|–|—|\bto\b|\bالى\b|\bحتى\b)\s*")
+_PIECE_SPLIT = re.compile(r"\s*(?:,|&|\band\b|؛|;|،)\s*")
+
+def _parse_time(value: str) -> Optional[Tuple[int, bool]]:
+    """Minutes since midnight, and whether an am/pm marker was given"""
+    match = _TIME.search(value)
+    if match is None:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if hour > 24 or minute > 59:
+        return None
+    if meridiem in ("pm", "p.m.", "م", "مساء") and hour < 12:
+        hour += 12
+    elif meridiem in ("am", "a.m.", "ص", "صباحا") and hour == 12:
+        hour = 0
+    return hour * 60 + minute, meridiem is not None
+
+def parse_ranges(value: Any) -> Optional[List[Range]]:
+    """Opening ranges of one day ("9:00 AM - 6:00 PM", "10-14, 16-22", "Closed"), None if unreadable"""
+    text = normalize_text(str(value or "")).strip()
+    if not text or _CLOSED.search(text):
+        return []
+    if _ALL_DAY.search(text):
+        return [(0, 24 * 60)]
+    ranges: List[Range] = []
+    for piece in _PIECE_SPLIT.split(text):
+        bounds = _RANGE_SPLIT.split(piece, maxsplit=1)
+        if len(bounds) != 2:
+            return None
+        start, end = _parse_time(bounds[0]), _parse_time(bounds[1])
+        if start is None or end is None:
+            return None
+        opens, closes = start[0], end[0]
+        if not end[1] and closes <= opens and closes < 12 * 60 and closes + 12 * 60 > opens:
+            closes += 12 * 60  # "9 - 6" means 9 AM to 6 PM
+        if closes <= opens:
+            closes += 24 * 60  # overnight, e.g. 6 PM - 2 AM
+        ranges.append((opens, closes))
+    return ranges
+
+def _parse_days(key: str) -> List[int]:
+    """Weekday numbers for a key like "monday", "sat", "الجمعة" or "mon-fri" """
+    text = normalize_text(key).strip()
+    bounds = [_DAY_ALIASES.get(part.strip()) for part in _RANGE_SPLIT.split(text, maxsplit=1)]
+    if None in bounds:
+        return []
+    if len(bounds) == 1:
+        return [bounds[0]]
+    first, last = bounds
+    return [(first + offset) % 7 for offset in range((last - first) % 7 + 1)]
+
+def format_minutes(minutes: int, arabic: bool = False) -> str:
+    """12-hour clock text for minutes since midnight"""
+    hour, minute = divmod(minutes % (24 * 60), 60)
+    suffix = ("ص" if hour < 12 else "م") if arabic else ("AM" if hour < 12 else "PM")
+    return f"{hour % 12 or 12}:{minute:02d} {suffix}"
+
+class WeeklySchedule:
+    """Opening ranges per weekday in the merchant's timezone"""
+
+    def __init__(self, days: List[List[Range]], timezone: ZoneInfo):
+        self.days = days
+        self.timezone = timezone
+
+    def local_now(self, now: Optional[datetime] = None) -> datetime:
+        """Current time (or the given aware time) in the schedule's timezone"""
+        return (now or datetime.now(self.timezone)).astimezone(self.timezone)
+
+    def open_range(self, now: Optional[datetime] = None) -> Optional[Range]:
+        """The range the business is open in right now, relative to today's midnight"""
+        local = self.local_now(now)
+        minute = local.hour * 60 + local.minute
+        weekday = local.weekday()
+        for opens, closes in self.days[weekday]:
+            if opens <= minute < closes:
+                return opens, closes
+        # Overnight hours that started yesterday
+        for opens, closes in self.days[(weekday - 1) % 7]:
+            if closes > 24 * 60 and minute < closes - 24 * 60:
+                return opens - 24 * 60, closes - 24 * 60
+        return None
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        return self.open_range(now) is not None
+
+    def next_opening(self, now: Optional[datetime] = None) -> Optional[Tuple[int, int]]:
+        """(days from today, minute of that day) of the next opening within a week"""
+        local = self.local_now(now)
+        minute = local.hour * 60 + local.minute
+        for offset in range(8):
+            for opens, _ in sorted(self.days[(local.weekday() + offset) % 7]):
+                if offset > 0 or opens > minute:
+                    return offset, opens
+        return None
+
+def resolve_timezone(name: Optional[str]) -> ZoneInfo:
+    """The named zone, falling back to DEFAULT_TIMEZONE"""
+    for candidate in (name, settings.DEFAULT_TIMEZONE, "UTC"):
+        if candidate:
+            try:
+                return ZoneInfo(candidate)
+            except (ZoneInfoNotFoundError, ValueError):
+                continue
+    return ZoneInfo("UTC")
+
+@lru_cache(maxsize=1024)
+def _compile(working_hours_json: str, timezone_name: Optional[str]) -> Optional[WeeklySchedule]:
+    working_hours = json.loads(working_hours_json)
+    if not isinstance(working_hours, dict):
+        return None
+    days: List[Optional[List[Range]]] = [None] * 7
+    for key, value in working_hours.items():
+        if key == "timezone":
+            continue
+        day_numbers = _parse_days(str(key))
+        ranges = parse_ranges(value)
+        if not day_numbers or ranges is None:
+            return None
+        for day in day_numbers:
+            days[day] = ranges
+    if all(day is None for day in days):
+        return None
+    # Days the merchant did not list are treated as closed
+    return WeeklySchedule([day or [] for day in days], resolve_timezone(working_hours.get("timezone") or timezone_name))
+
+def compile_schedule(working_hours: Any, timezone_name: Optional[str] = None) -> Optional[WeeklySchedule]:
+    """Compiled weekly schedule, or None when the hours cannot be read reliably
+
+    Results are memoized on the serialized hours, so each distinct schedule is
+    parsed once per process. A "timezone" key inside the hours overrides the
+    given zone.
+    """
+    if not working_hours:
+        return None
+    return _compile(compact_json(working_hours), timezone_name)
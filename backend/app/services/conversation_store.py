@@ -0,0 +1,118 @@
+"""
+Conversation Store for IG-Shop-Agent V2
+Recent turns per (merchant, sender) in memory, persisted to conversation_messages
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..models.conversation_message import ConversationMessage
+
+Turn = Tuple[str, str]  # (role, content)
+ThreadKey = Tuple[str, str]  # (merchant_id, sender_id)
+
+class ConversationThread:
+    """Ring buffer of one conversation's latest turns"""
+    __slots__ = ("turns", "last_active")
+
+    def __init__(self, turns: Deque[Turn], last_active: float):
+        self.turns = turns
+        self.last_active = last_active
+
+class ConversationStore:
+    """Bounded conversation history
+
+    Each active conversation keeps its last max_turns turns in a deque. Threads
+    idle for longer than idle_seconds (or pushed out by max_conversations) are
+    dropped from memory and reloaded from the indexed table on their next
+    message; the table is the source of truth across restarts and workers.
+    """
+
+    def __init__(self, max_turns: int = 10, idle_seconds: int = 1800, max_conversations: int = 5000):
+        self.max_turns = max_turns
+        self.idle_seconds = idle_seconds
+        self.max_conversations = max_conversations
+        self._threads: "OrderedDict[ThreadKey, ConversationThread]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.evictions = 0
+
+    def _evict_idle(self, now: float) -> None:
+        """Drop least recently active threads that went idle or overflow the cap (lock held)"""
+        while self._threads:
+            key, thread = next(iter(self._threads.items()))
+            if thread.last_active + self.idle_seconds > now and len(self._threads) <= self.max_conversations:
+                break
+            del self._threads[key]
+            self.evictions += 1
+
+    async def _thread(self, db: AsyncSession, key: ThreadKey) -> ConversationThread:
+        """The conversation's ring buffer, reloading it from the table if needed"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            thread = self._threads.get(key)
+            if thread is not None:
+                thread.last_active = now
+                self._threads.move_to_end(key)
+                return thread
+
+        rows = (await db.execute(
+            select(ConversationMessage.role, ConversationMessage.content)
+            .where(ConversationMessage.merchant_id == key[0], ConversationMessage.sender_id == key[1])
+            .order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc())
+            .limit(self.max_turns)
+        )).all()
+        thread = ConversationThread(deque(((role, content) for role, content in reversed(rows)), maxlen=self.max_turns), now)
+        with self._lock:
+            self.reloads += 1
+            self._threads[key] = thread
+            self._threads.move_to_end(key)
+            self._evict_idle(now)
+        return thread
+
+    async def history(self, db: Optional[AsyncSession], merchant_id: str, sender_id: str) -> List[Turn]:
+        """Latest turns of the conversation, oldest first"""
+        if db is None or not sender_id or self.max_turns <= 0:
+            return []
+        return list((await self._thread(db, (merchant_id, sender_id))).turns)
+
+    async def record_exchange(
+        self,
+        db: Optional[AsyncSession],
+        merchant_id: str,
+        sender_id: str,
+        message_text: str,
+        reply: str
+    ) -> None:
+        """Persist a customer message and the reply sent to it"""
+        if db is None or not sender_id or self.max_turns <= 0:
+            return
+        thread = await self._thread(db, (merchant_id, sender_id))
+        db.add_all([
+            ConversationMessage(merchant_id=merchant_id, sender_id=sender_id, role="user", content=message_text),
+            ConversationMessage(merchant_id=merchant_id, sender_id=sender_id, role="assistant", content=reply)
+        ])
+        await db.commit()
+        with self._lock:
+            thread.turns.append(("user", message_text))
+            thread.turns.append(("assistant", reply))
+
+    def stats(self) -> dict:
+        """Conversations in memory and reload/eviction counters"""
+        return {
+            "conversations": len(self._threads),
+            "reloads": self.reloads,
+            "evictions": self.evictions
+        }
+
+conversation_store = ConversationStore(
+    max_turns=settings.MAX_CONVERSATION_HISTORY,
+    idle_seconds=settings.CONVERSATION_IDLE_SECONDS,
+    max_conversations=settings.CONVERSATION_CACHE_SIZE
+)
@@ -0,0 +1,87 @@
+"""
+Deadline for IG-Shop-Agent V2
+Per-message time budget from webhook receipt to the last DM sent, with per-stage accounting
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from .llm_resilience import LatencyTracker
+
+class Deadline:
+    """What is left of one inbound message's time budget
+
+    The clock starts when the webhook was received (wall time, since the
+    payload may be processed by another worker after a restart). Stages take
+    timeout() for their own waits and lap() when they finish, so the budget
+    each stage consumed is known at the end.
+    """
+
+    def __init__(self, budget: float, started_at: Optional[float] = None):
+        self.budget = budget
+        self.started_at = started_at or time.time()
+        self.expires_at = self.started_at + budget
+        self.stages: Dict[str, float] = {}
+        self.degraded = False
+        self._mark = self.started_at
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least seconds are left"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float, reserve: float = 0.0) -> float:
+        """A stage's timeout: its own cap, or what is left after reserving time for later stages"""
+        return max(0.0, min(cap, self.remaining() - reserve))
+
+    def lap(self, stage: str) -> float:
+        """Charge the time since the previous lap to stage"""
+        now = time.time()
+        elapsed = now - self._mark
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+        self._mark = now
+        return elapsed
+
+class DeadlineStats:
+    """Budget consumed per stage and how many messages finished within their deadline"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, LatencyTracker] = {}
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.totals = LatencyTracker(size=1000, min_samples=1)
+
+    def record(self, deadline: Deadline) -> None:
+        """Account a finished message: met, degraded (cheaper path) or late"""
+        total = time.time() - deadline.started_at
+        outcome = "late" if total > deadline.budget else "degraded" if deadline.degraded else "met"
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.totals.add(total)
+            for stage, seconds in deadline.stages.items():
+                tracker = self.stages.get(stage)
+                if tracker is None:
+                    tracker = self.stages[stage] = LatencyTracker(size=1000, min_samples=1)
+                tracker.add(seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "outcomes": dict(self.outcomes),
+                "p50_total": self.totals.percentile(0.5),
+                "p95_total": self.totals.percentile(0.95),
+                "stages": {
+                    stage: {"p50": tracker.percentile(0.5), "p95": tracker.percentile(0.95)}
+                    for stage, tracker in self.stages.items()
+                }
+            }
+
+deadline_stats = DeadlineStats()
@@ -0,0 +1,55 @@
+"""
+Event Dispatcher for IG-Shop-Agent V2
+Concurrent processing of independent conversations with per-sender ordering
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, List
+
+
+class EventDispatcher:
+    """Runs jobs concurrently across conversations and strictly in order within one
+
+    Keys such as (page_id, sender_id) are hash-partitioned onto a fixed set of
+    lanes. Each lane is a FIFO asyncio.Lock, so jobs for the same key execute
+    one after another in submission order, while a global semaphore bounds how
+    many lanes make progress at once.
+    """
+
+    def __init__(self, lanes: int = 64, max_concurrency: int = 16):
+        self.lanes = lanes
+        self.max_concurrency = max_concurrency
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(lanes)]
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+
+    def lane_for(self, key: Hashable) -> int:
+        """Lane index for a conversation key"""
+        return hash(key) % self.lanes
+
+    async def run(self, key: Hashable, job: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a job in its key's lane once a global slot is free"""
+        self._waiting += 1
+        started = False
+        try:
+            async with self._locks[self.lane_for(key)]:
+                async with self._semaphore:
+                    self._waiting -= 1
+                    started = True
+                    self._in_flight += 1
+                    try:
+                        return await job()
+                    finally:
+                        self._in_flight -= 1
+        finally:
+            if not started:
+                self._waiting -= 1
+
+    def stats(self) -> dict:
+        """Current dispatcher load"""
+        return {
+            "lanes": self.lanes,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting
+        }
@@ -0,0 +1,183 @@
+"""
+Fair Scheduler for IG-Shop-Agent V2
+Weighted deficit round-robin over per-merchant queues, so one busy merchant cannot starve the others
+"""
+import asyncio
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .llm_resilience import LatencyTracker
+
+class _Tenant:
+    """One merchant's queue of waiting jobs and its share of the slots"""
+
+    def __init__(self, tenant_id: str):
+        self.tenant_id = tenant_id
+        self.tier = ""
+        self.weight = 1.0
+        self.max_in_flight = 1
+        self.max_queued = 1
+        self.waiters: Deque[Tuple[float, asyncio.Future]] = deque()  # (enqueued at, waiter)
+        self.in_flight = 0
+        self.deficit = 0.0
+        self.active = False
+
+class FairScheduler:
+    """Shares max_concurrency job slots between merchants by tier weight
+
+    Each merchant has a FIFO queue. When a slot frees up, deficit
+    round-robin picks the queue: a merchant at the head of the ring gets its
+    tier's scheduler_weight in credit and is served one job per credit
+    before the next merchant's turn, so under contention business merchants
+    get four slots for every one a starter merchant gets. A merchant never
+    holds more than its tier's max_in_flight slots, and a merchant with no
+    waiting jobs uses no share at all. Jobs start at once while slots are
+    free and nobody waits.
+    """
+
+    def __init__(self, max_concurrency: int, tiers: Dict[str, Dict[str, Any]]):
+        self.max_concurrency = max_concurrency
+        self.tiers = tiers
+        self._tenants: Dict[str, _Tenant] = {}
+        self._active: Deque[_Tenant] = deque()
+        self.in_flight = 0
+        self.waiting = 0
+        self.served: Dict[str, int] = defaultdict(int)
+        self.wait_times: Dict[str, LatencyTracker] = {}
+
+    def _tenant(self, tenant_id: str, tier: Optional[str]) -> _Tenant:
+        tier = tier if tier in self.tiers else "starter"
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            tenant = self._tenants[tenant_id] = _Tenant(tenant_id)
+        if tenant.tier != tier:
+            # Picks up plan changes between jobs
+            limits = self.tiers[tier]
+            tenant.tier = tier
+            tenant.weight = limits.get("scheduler_weight", 1)
+            tenant.max_in_flight = limits.get("max_in_flight", self.max_concurrency)
+            tenant.max_queued = limits.get("max_queued", self.max_concurrency)
+        return tenant
+
+    def room(self, tenant_id: str, tier: Optional[str]) -> int:
+        """How many more jobs the merchant may queue before it should back off"""
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            limits = self.tiers.get(tier or "starter") or self.tiers["starter"]
+            return limits.get("max_queued", self.max_concurrency)
+        return max(0, tenant.max_queued - len(tenant.waiters))
+
+    async def run(self, tenant_id: str, tier: Optional[str], job: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a job once the merchant's turn comes and a slot is free"""
+        tenant = self._tenant(tenant_id, tier)
+        await self._acquire(tenant)
+        try:
+            return await job()
+        finally:
+            self._release(tenant)
+
+    async def _acquire(self, tenant: _Tenant) -> None:
+        # Free slots with others waiting only happen when those others are at their cap
+        if not tenant.waiters and self.in_flight < self.max_concurrency and tenant.in_flight < tenant.max_in_flight:
+            self._grant(tenant, 0.0)
+            return
+        loop = asyncio.get_running_loop()
+        entry = (loop.time(), loop.create_future())
+        waiter = entry[1]
+        tenant.waiters.append(entry)
+        self.waiting += 1
+        if not tenant.active:
+            tenant.active = True
+            self._active.append(tenant)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(tenant)  # granted just as the caller gave up
+            elif entry in tenant.waiters:
+                tenant.waiters.remove(entry)
+                self.waiting -= 1
+            raise
+
+    def _grant(self, tenant: _Tenant, waited: float) -> None:
+        self.in_flight += 1
+        tenant.in_flight += 1
+        self.served[tenant.tier] += 1
+        tracker = self.wait_times.get(tenant.tier)
+        if tracker is None:
+            tracker = self.wait_times[tenant.tier] = LatencyTracker(size=500, min_samples=1)
+        tracker.add(waited)
+
+    def _release(self, tenant: _Tenant) -> None:
+        self.in_flight -= 1
+        tenant.in_flight -= 1
+        self._dispatch()
+        if not tenant.in_flight and not tenant.waiters and not tenant.active:
+            self._tenants.pop(tenant.tenant_id, None)
+
+    def _next(self) -> Optional[_Tenant]:
+        """Deficit round-robin: the merchant whose turn it is, skipping those at their cap"""
+        capped = 0
+        while self._active and capped < len(self._active):
+            tenant = self._active[0]
+            if not tenant.waiters:
+                self._active.popleft()
+                tenant.active = False
+                tenant.deficit = 0.0
+                if not tenant.in_flight:
+                    self._tenants.pop(tenant.tenant_id, None)
+                continue
+            if tenant.in_flight >= tenant.max_in_flight:
+                # Skipped, not served: its remaining credit waits for a free slot
+                self._active.rotate(-1)
+                capped += 1
+                continue
+            if tenant.deficit < 1:
+                tenant.deficit += tenant.weight
+                if tenant.deficit < 1:
+                    self._active.rotate(-1)
+                    continue
+            tenant.deficit -= 1
+            if tenant.deficit < 1:
+                self._active.rotate(-1)  # turn over
+            return tenant
+        return None
+
+    def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.in_flight < self.max_concurrency:
+            tenant = self._next()
+            if tenant is None:
+                return
+            enqueued, waiter = tenant.waiters.popleft()
+            self.waiting -= 1
+            if waiter.done():
+                continue
+            self._grant(tenant, loop.time() - enqueued)
+            waiter.set_result(None)
+
+    def stats(self, top: int = 10) -> dict:
+        """Slots in use, queue depth and wait percentiles per tier, and the deepest merchant queues"""
+        depth: Dict[str, int] = defaultdict(int)
+        tenants: List[_Tenant] = list(self._tenants.values())
+        for tenant in tenants:
+            depth[tenant.tier] += len(tenant.waiters)
+        deepest = sorted(tenants, key=lambda tenant: len(tenant.waiters), reverse=True)[:top]
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "tiers": {
+                tier: {
+                    "queue_depth": depth.get(tier, 0),
+                    "served": self.served.get(tier, 0),
+                    "p50_wait": self.wait_times[tier].percentile(0.5) if tier in self.wait_times else None,
+                    "p95_wait": self.wait_times[tier].percentile(0.95) if tier in self.wait_times else None
+                }
+                for tier in self.tiers
+            },
+            "merchants": {
+                tenant.tenant_id: {"tier": tenant.tier, "queue_depth": len(tenant.waiters), "in_flight": tenant.in_flight}
+                for tenant in deepest if tenant.waiters or tenant.in_flight
+            }
+        }
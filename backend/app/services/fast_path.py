@@ -0,0 +1,273 @@
+"""
+Fast-Path Answers for IG-Shop-Agent V2
+Deterministic replies to hours, price and availability questions without calling the model
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+from .business_hours import ARABIC_DAY_NAMES, DAY_NAMES, WeeklySchedule, compile_schedule, format_minutes
+from .product_index import product_indexes
+from .prompt_compiler import render_working_hours
+from .text_normalizer import normalize_text, tokenize
+
+HOURS = "hours"
+PRICE = "price"
+AVAILABILITY = "availability"
+
+# Patterns run on normalize_text() output (Arabic letter variants already folded)
+INTENT_PATTERNS = {
+    HOURS: re.compile(
+        r"\b(?:open(?:ing)?|close[sd]?|closing|hours|timings?|what time|working time)\b"
+        r"|دوام|مفتوح|فاتحين|فاتح|بتفتح|تفتح|تسكر|بتسكر|مسكر|ساعات العمل|اوقات|مواعيد"
+    ),
+    PRICE: re.compile(
+        r"\b(?:price|prices|how much|cost|costs)\b"
+        r"|بكم|بكام|بقديش|قديش|سعر|اسعار|ثمن|كم حق"
+    ),
+    AVAILABILITY: re.compile(
+        r"\b(?:available|availability|in stock|do you have|have you got|sold out)\b"
+        r"|متوفر|متاح|موجود|في عندكم|فيه عندكم|عندكم"
+    ),
+}
+
+# Anything beyond a simple lookup (orders, delivery, complaints, ...) goes to the model
+OUT_OF_SCOPE = re.compile(
+    r"\b(?:order|buy|deliver|delivery|shipping|ship|refund|return|exchange|discount|size|color|colour|complain)\w*"
+    r"|اطلب|طلب|اشتري|توصيل|شحن|استرجاع|ارجاع|تبديل|خصم|مقاس|قياس|لون|شكوى"
+)
+
+# Days a question can be about: ("in", days from today) or ("on", weekday number)
+RELATIVE_DAYS = [
+    (re.compile(r"\bday after tomorrow\b|بعد (?:بكره|بكرا|غدا)"), 2),
+    (re.compile(r"\b(?:tomorrow|tmrw|tmr)\b|بكره|بكرا|غدا"), 1),
+    (re.compile(r"\b(?:today|tonight)\b|اليوم|الليله"), 0),
+]
+WEEKDAYS = re.compile(
+    r"\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)s?\b"
+    r"|ال(اثنين|ثلاثاء|اربعاء|خميس|جمعه|سبت|احد)(?!\w)"
+)
+ARABIC_WEEKDAYS = ["اثنين", "ثلاثاء", "اربعاء", "خميس", "جمعه", "سبت", "احد"]
+
+OUT_OF_STOCK = re.compile(r"out of stock|sold out|unavailable|not available|غير متوفر|نفد|نفذ|خلص")
+
+ARABIC_LETTERS = re.compile(r"[\u0600-\u06FF]")
+
+MAX_TOKENS = 12  # longer messages usually carry more than one question
+
+@dataclass
+class FastPathAnswer:
+    """A templated reply and how sure the matcher is about it"""
+    intent: str
+    response: str
+    confidence: float
+
+def detect_intents(normalized: str) -> List[str]:
+    """Intents whose patterns occur in an already normalized message"""
+    return [intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(normalized)]
+
+def day_references(normalized: str) -> List[Tuple[str, int]]:
+    """Days an already normalized message asks about, in order of appearance"""
+    found: List[Tuple[int, Tuple[str, int]]] = []
+    for pattern, days_ahead in RELATIVE_DAYS:
+        for match in pattern.finditer(normalized):
+            found.append((match.start(), ("in", days_ahead)))
+        normalized = pattern.sub(lambda match: " " * len(match.group()), normalized)  # "بعد بكره" is not also "بكره"
+    for match in WEEKDAYS.finditer(normalized):
+        english, arabic = match.groups()
+        weekday = DAY_NAMES.index(english) if english else ARABIC_WEEKDAYS.index(arabic)
+        found.append((match.start(), ("on", weekday)))
+    references: List[Tuple[str, int]] = []
+    for _, reference in sorted(found):
+        if reference not in references:
+            references.append(reference)
+    return references
+
+def named_products(merchant: Merchant, message_text: str, limit: int = 3) -> List[Tuple[float, Dict[str, Any]]]:
+    """(share of the name's tokens in the message, product) for the best BM25 matches, best first"""
+    catalog = merchant.product_catalog or []
+    if not catalog:
+        return []
+    query_tokens = set(tokenize(message_text))
+    scored = []
+    for position in product_indexes.get(merchant).search(message_text, limit):
+        name_tokens = set(tokenize(str(catalog[position].get("name") or "")))
+        # Single letters ("Product B") are model codes customers often leave out
+        name_tokens = {token for token in name_tokens if len(token) > 1} or name_tokens
+        if name_tokens:
+            scored.append((len(name_tokens & query_tokens) / len(name_tokens), catalog[position]))
+    scored.sort(key=lambda item: -item[0])
+    return scored
+
+class FastPathResponder:
+    """Answers structured questions from Merchant.working_hours and product_catalog
+
+    Each answer carries a confidence; anything below min_confidence (several
+    intents, several equally good products, long or out-of-scope messages)
+    is left to the model.
+    """
+
+    def __init__(self, min_confidence: float = 0.75):
+        self.min_confidence = min_confidence
+        self.answered: Dict[str, int] = {HOURS: 0, PRICE: 0, AVAILABILITY: 0}
+        self.low_confidence = 0
+        self.unmatched = 0
+        self.fallbacks = 0
+
+    def answer(self, merchant: Merchant, message_text: str, now: Optional[datetime] = None) -> Optional[str]:
+        """Templated reply, or None when the model should answer"""
+        result = self.match(merchant, message_text, now)
+        if result is None:
+            self.unmatched += 1
+            return None
+        if result.confidence < self.min_confidence:
+            self.low_confidence += 1
+            return None
+        self.answered[result.intent] += 1
+        return result.response
+
+    def fallback(self, merchant: Merchant, message_text: str, min_confidence: float = 0.4) -> Optional[str]:
+        """Best template even below min_confidence, for when no model can answer"""
+        result = self.match(merchant, message_text)
+        if result is None or result.confidence < min_confidence:
+            return None
+        self.fallbacks += 1
+        return result.response
+
+    def match(self, merchant: Merchant, message_text: str, now: Optional[datetime] = None) -> Optional[FastPathAnswer]:
+        """Best templated answer with its confidence"""
+        normalized = normalize_text(message_text)
+        intents = detect_intents(normalized)
+        if not intents:
+            return None
+        arabic = bool(ARABIC_LETTERS.search(message_text))
+        penalty = 1.0
+        if OUT_OF_SCOPE.search(normalized):
+            penalty *= 0.5
+        if len(tokenize(message_text, keep_stopwords=True)) > MAX_TOKENS:
+            penalty *= 0.8
+
+        product_intents = [intent for intent in intents if intent != HOURS]
+        match = self._named_product(merchant, message_text) if product_intents else None
+        if match is not None:
+            coverage, product = match
+            intent = PRICE if PRICE in product_intents else AVAILABILITY
+            if HOURS in intents:
+                penalty *= 0.5
+            return FastPathAnswer(intent, self._product_reply(intent, product, arabic), coverage * penalty)
+        if HOURS not in intents:
+            return None
+
+        days = day_references(normalized)
+        if len(days) > 1:
+            penalty *= 0.5  # "friday or saturday?" needs a reply about both
+        reply = self._hours_reply(merchant, arabic, now, days[0] if days else None)
+        if reply is None:
+            return None
+        return FastPathAnswer(HOURS, reply, 0.95 * penalty)
+
+    def _named_product(self, merchant: Merchant, message_text: str):
+        """(name coverage, product) of the single product the message names, if any"""
+        scored = named_products(merchant, message_text)
+        if not scored:
+            return None
+        coverage, product = scored[0]
+        if len(scored) > 1 and scored[1][0] >= coverage:
+            coverage *= 0.5  # two products match equally well
+        return coverage, product
+
+    def _product_reply(self, intent: str, product: Dict[str, Any], arabic: bool) -> str:
+        name = product.get("name") or ""
+        price = product.get("price")
+        availability = str(product.get("availability") or "")
+        in_stock = not OUT_OF_STOCK.search(normalize_text(availability))
+
+        if intent == PRICE:
+            if arabic:
+                reply = f"سعر {name}: {price}"
+                return reply + ("" if in_stock else " (غير متوفر حالياً)")
+            reply = f"{name} costs {price}"
+            return reply + ("." if in_stock else ", but it is currently out of stock.")
+
+        if arabic:
+            if in_stock:
+                return f"نعم، {name} متوفر" + (f" بسعر {price}" if price else "") + " 😊"
+            return f"عذراً، {name} غير متوفر حالياً."
+        if in_stock:
+            return f"Yes, {name} is available" + (f" for {price}" if price else "") + " 😊"
+        return f"Sorry, {name} is currently out of stock."
+
+    def _hours_reply(
+        self,
+        merchant: Merchant,
+        arabic: bool,
+        now: Optional[datetime],
+        day: Optional[Tuple[str, int]] = None
+    ) -> Optional[str]:
+        """Open-now status, or the hours of the day the message asks about"""
+        schedule = compile_schedule(merchant.working_hours, settings.DEFAULT_TIMEZONE)
+        if schedule is None:
+            return None
+        hours_text = render_working_hours({
+            day: hours for day, hours in merchant.working_hours.items() if day != "timezone"
+        })
+        if day is not None and day != ("in", 0):
+            return self._day_hours_reply(schedule, day, arabic, now, hours_text)
+        open_range = schedule.open_range(now)
+        if open_range is not None:
+            closes = format_minutes(open_range[1], arabic)
+            if arabic:
+                return f"نعم، نحن مفتوحون الآن حتى {closes}. أوقات العمل: {hours_text}"
+            return f"Yes, we're open now until {closes}. Our working hours: {hours_text}"
+
+        reopening = schedule.next_opening(now)
+        if reopening is None:
+            return None
+        days_ahead, opens = reopening
+        weekday = (schedule.local_now(now).weekday() + days_ahead) % 7
+        if arabic:
+            day = "اليوم" if days_ahead == 0 else "غداً" if days_ahead == 1 else f"يوم {ARABIC_DAY_NAMES[weekday]}"
+            return f"نحن مغلقون الآن، ونفتح {day} الساعة {format_minutes(opens, True)}. أوقات العمل: {hours_text}"
+        day = "today" if days_ahead == 0 else "tomorrow" if days_ahead == 1 else f"on {DAY_NAMES[weekday].capitalize()}"
+        return f"We're closed right now and open again {day} at {format_minutes(opens)}. Our working hours: {hours_text}"
+
+    def _day_hours_reply(
+        self,
+        schedule: WeeklySchedule,
+        day: Tuple[str, int],
+        arabic: bool,
+        now: Optional[datetime],
+        hours_text: str
+    ) -> str:
+        kind, value = day
+        weekday = (schedule.local_now(now).weekday() + value) % 7 if kind == "in" else value
+        ranges = sorted(schedule.days[weekday])
+        if arabic:
+            label = {1: "غداً", 2: "بعد غد"}.get(value) if kind == "in" else None
+            label = label or f"يوم {ARABIC_DAY_NAMES[weekday]}"
+            if not ranges:
+                return f"عذراً، نحن مغلقون {label}. أوقات العمل: {hours_text}"
+            spans = " و".join(
+                f"من {format_minutes(opens, True)} إلى {format_minutes(closes, True)}" for opens, closes in ranges
+            )
+            return f"نعم، نحن مفتوحون {label} {spans}. أوقات العمل: {hours_text}"
+        label = {1: "tomorrow", 2: "the day after tomorrow"}.get(value) if kind == "in" else None
+        label = label or f"on {DAY_NAMES[weekday].capitalize()}"
+        if not ranges:
+            return f"Sorry, we're closed {label}. Our working hours: {hours_text}"
+        spans = " and ".join(f"{format_minutes(opens)} to {format_minutes(closes)}" for opens, closes in ranges)
+        return f"Yes, we're open {label} from {spans}. Our working hours: {hours_text}"
+
+    def stats(self) -> dict:
+        """Answers per intent and how often the model was needed"""
+        return {
+            "answered": dict(self.answered),
+            "low_confidence": self.low_confidence,
+            "unmatched": self.unmatched,
+            "fallbacks": self.fallbacks
+        }
+
+fast_path_responder = FastPathResponder(min_confidence=settings.FAST_PATH_MIN_CONFIDENCE)
@@ -0,0 +1,371 @@
+"""
+Instagram Outbox for IG-Shop-Agent V2
+Outbound DM pipeline: per-page send rate, in-order delivery per recipient, retries with jittered backoff and idempotency keys
+"""
+import asyncio
+import hashlib
+import random
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal
+from ..core.http_client import get_http_client
+from ..models.sent_message import SentMessage
+from .rate_limiter import RateLimiter, rate_limiter
+
+# Graph API error codes for application, user and page level throttling
+THROTTLING_CODES = frozenset({4, 17, 32, 613})
+
+class GraphAPIError(Exception):
+    """A send the Graph API rejected, or that never reached it"""
+
+    def __init__(self, message: str, retryable: bool = False, throttled: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+def graph_error(response: httpx.Response) -> GraphAPIError:
+    """Classify an error response: throttling and 5xx or transient errors may be retried"""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        error = {}
+    code = error.get("code")
+    throttled = response.status_code == 429 or code in THROTTLING_CODES
+    try:
+        retry_after = float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    return GraphAPIError(
+        f"HTTP {response.status_code} (code {code}): {error.get('message') or response.text[:200]}",
+        retryable=throttled or response.status_code >= 500 or bool(error.get("is_transient")),
+        throttled=throttled,
+        retry_after=retry_after
+    )
+
+@dataclass
+class OutboundMessage:
+    """One DM to send"""
+    page_id: str
+    recipient_id: str
+    text: str
+    access_token: str
+    idempotency_key: str
+    expires_at: Optional[float] = None  # wall time of the inbound message's deadline
+
+class InstagramOutbox:
+    """Queue of outbound DMs, sent as fast as each page's rate allows
+
+    Every message takes a token from its page's bucket (INSTAGRAM_SEND_RATE
+    per second, in the shared rate limiter store) before it goes out.
+    Messages to one recipient are sent in submission order; the chunks of a
+    long reply are queued together, each one taking its token while the one
+    before it is in flight, and a chunk whose predecessor failed is dropped
+    so the recipient never sees a reply with a hole in it.
+
+    Throttling, 5xx and transient errors are retried with exponentially
+    growing, fully jittered delays (or Retry-After); a throttled page's
+    bucket is emptied so its other sends pause too. Each message carries an
+    idempotency key: sent keys are recorded in the sent_messages table
+    (with an LRU in front of it), so a repeated send (a retried webhook
+    job, even in another worker or after a restart) is skipped, and the key
+    goes out in an Idempotency-Key header. The Graph API itself does not
+    deduplicate, so failures after the request may have been delivered
+    (read timeouts) are not retried.
+    Messages with a deadline are not retried past it, and each call's HTTP
+    timeout is what is left of it (at least min_timeout).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        limiter: RateLimiter,
+        rate_per_second: float = 90.0,
+        burst: float = 20.0,
+        concurrency: int = 32,
+        max_attempts: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        demo_mode: bool = False,
+        min_timeout: float = 1.0,
+        sent_keys: int = 10000,
+        http_client: Optional[httpx.AsyncClient] = None,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        sent_ttl: int = 48 * 3600,
+        prune_interval: int = 3600
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.demo_mode = demo_mode
+        self.min_timeout = min_timeout
+        self.sent_keys = sent_keys
+        self._http_client = http_client
+        self.session_factory = session_factory  # None keeps sent keys in memory only
+        self.sent_ttl = sent_ttl
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._sent: "OrderedDict[str, str]" = OrderedDict()  # idempotency key -> Graph message ID
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._tails: Dict[Tuple[str, str], asyncio.Task] = {}  # last queued message per conversation
+        self._page_locks: Dict[str, asyncio.Lock] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.paced = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.expired = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = get_http_client()
+        return self._http_client
+
+    @staticmethod
+    def message_key(page_id: str, recipient_id: str, key: Optional[str], index: int) -> str:
+        """Idempotency key of the index-th message of a reply (random when the reply has no key)"""
+        base = key or uuid.uuid4().hex
+        return hashlib.sha256(f"{page_id}:{recipient_id}:{base}:{index}".encode("utf-8")).hexdigest()[:32]
+
+    async def send(
+        self,
+        page_id: str,
+        recipient_id: str,
+        texts: List[str],
+        access_token: str,
+        idempotency_key: Optional[str] = None,
+        expires_at: Optional[float] = None
+    ) -> bool:
+        """Queue the messages of one reply; True once all of them were delivered
+
+        Queued messages are sent even if the caller stops waiting.
+        """
+        if idempotency_key:
+            await self._load_sent([
+                self.message_key(page_id, recipient_id, idempotency_key, index) for index in range(len(texts))
+            ])
+        conversation = (page_id, recipient_id)
+        previous = self._tails.get(conversation)
+        tasks: List[asyncio.Task] = []
+        for index, text in enumerate(texts):
+            key = self.message_key(page_id, recipient_id, idempotency_key, index)
+            task = self._pending.get(key)
+            if task is None:
+                message = OutboundMessage(page_id, recipient_id, text, access_token, key, expires_at)
+                task = asyncio.create_task(self._deliver(message, previous, index > 0))
+                self._pending[key] = task
+                task.add_done_callback(lambda _, key=key: self._pending.pop(key, None))
+            tasks.append(task)
+            previous = task
+        if previous is not None:
+            self._tails[conversation] = previous
+            previous.add_done_callback(
+                lambda done: self._tails.pop(conversation, None) if self._tails.get(conversation) is done else None
+            )
+        results = await asyncio.shield(asyncio.gather(*tasks))
+        return all(results)
+
+    async def _take(self, page_id: str) -> None:
+        """Wait for a token from the page's send bucket
+
+        Waiters line up on a per-page lock, so only the one at the front
+        polls the bucket instead of all of them waking at once.
+        """
+        lock = self._page_locks.get(page_id)
+        if lock is None:
+            lock = self._page_locks[page_id] = asyncio.Lock()
+        async with lock:
+            while True:
+                decision = await self.limiter.check("ig_send", page_id, self.rate_per_second, 1.0, burst=self.burst)
+                if decision.allowed:
+                    return
+                self.paced += 1
+                await asyncio.sleep(decision.retry_after)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: anywhere up to the exponentially growing cap"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    async def _deliver(self, message: OutboundMessage, previous: Optional[asyncio.Task], same_reply: bool) -> bool:
+        """Send one message after the one queued before it, retrying what may be retried"""
+        if message.idempotency_key in self._sent:
+            self.duplicates += 1
+            return True
+        try:
+            await self._take(message.page_id)
+            if previous is not None:
+                delivered = await previous
+                if same_reply and not delivered:
+                    self.skipped += 1
+                    return False
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    async with self._semaphore:
+                        message_id = await self._post(message)
+                except GraphAPIError as e:
+                    delay = self._backoff(attempt)
+                    if e.throttled:
+                        self.throttled += 1
+                        delay = max(delay, e.retry_after or 0.0)
+                        # Every send to this page waits, not just the one that was throttled
+                        await self.limiter.drain("ig_send", message.page_id, -self.rate_per_second * delay)
+                    past_deadline = message.expires_at is not None and time.time() + delay > message.expires_at
+                    if not e.retryable or attempt == self.max_attempts or past_deadline:
+                        self.failed += 1
+                        if past_deadline and e.retryable:
+                            self.expired += 1
+                        print(f"❌ Instagram send to {message.recipient_id} failed after {attempt} attempt(s): {e}")
+                        return False
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+                    await self._take(message.page_id)
+                    continue
+                self._remember(message.idempotency_key, message_id)
+                await self._record_sent(message.idempotency_key, message_id)
+                self.sent += 1
+                return True
+            return False
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Instagram service error: {e}")
+            return False
+
+    def _remember(self, key: str, message_id: str) -> None:
+        self._sent[key] = message_id
+        if len(self._sent) > self.sent_keys:
+            self._sent.popitem(last=False)
+
+    async def _load_sent(self, keys: List[str]) -> None:
+        """Pull the recorded sends among keys into the LRU"""
+        missing = [key for key in keys if key not in self._sent]
+        if self.session_factory is None or not missing:
+            return
+        try:
+            async with self.session_factory() as db:
+                rows = await db.execute(
+                    select(SentMessage.idempotency_key, SentMessage.message_id)
+                    .where(SentMessage.idempotency_key.in_(missing))
+                )
+                for key, message_id in rows:
+                    self._remember(key, message_id or "")
+        except Exception as e:
+            # Without the records a retried reply may go out twice, but it does go out
+            print(f"⚠️ Failed to load sent message keys: {e}")
+
+    async def _record_sent(self, key: str, message_id: str) -> None:
+        """Record a delivered message so no worker sends it again"""
+        if self.session_factory is None:
+            return
+        try:
+            async with self.session_factory() as db:
+                await self._prune_if_due(db)
+                db.add(SentMessage(idempotency_key=key, message_id=message_id))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()  # recorded already
+        except Exception as e:
+            print(f"⚠️ Failed to record sent message {key}: {e}")
+
+    async def _prune_if_due(self, db: AsyncSession) -> None:
+        """Delete sent records older than the TTL at most once per interval"""
+        now = time.time()
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.sent_ttl)
+        result = await db.execute(delete(SentMessage).where(SentMessage.created_at < cutoff))
+        await db.commit()
+        if result.rowcount:
+            print(f"🧹 Pruned {result.rowcount} expired sent message keys")
+
+    async def _post(self, message: OutboundMessage) -> str:
+        """One Send API call; the Graph message ID on success"""
+        print(f"📤 Sending message to {message.recipient_id}: {message.text[:50]}...")
+        if self.demo_mode:
+            # Demo deployments (e.g. the seeded demo merchant, which has no real token) only simulate the call
+            await asyncio.sleep(0.5)
+            print("✅ Message simulated successfully (V2 Demo Mode)")
+            return f"demo-{message.idempotency_key[:16]}"
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/me/messages",
+                json={
+                    "recipient": {"id": message.recipient_id},
+                    "message": {"text": message.text},
+                    "access_token": message.access_token
+                },
+                headers={"Idempotency-Key": message.idempotency_key},
+                timeout=self._timeout(message)
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise GraphAPIError(f"not sent: {e!r}", retryable=True)
+        except httpx.HTTPError as e:
+            # The request may have been delivered; retrying could send it twice
+            raise GraphAPIError(f"outcome unknown: {e!r}")
+        if response.status_code == 200:
+            return response.json().get("message_id", "")
+        raise graph_error(response)
+
+    def _timeout(self, message: OutboundMessage) -> httpx.Timeout:
+        """The client's timeouts, shortened to what is left of the message's deadline"""
+        seconds = settings.HTTP_TIMEOUT
+        if message.expires_at is not None:
+            seconds = min(seconds, max(self.min_timeout, message.expires_at - time.time()))
+        return httpx.Timeout(seconds, connect=min(seconds, settings.HTTP_CONNECT_TIMEOUT))
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Wait for queued messages to go out"""
+        pending = list(self._pending.values())
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+    def stats(self) -> dict:
+        """Queue size and outcome counters"""
+        return {
+            "demo_mode": self.demo_mode,
+            "queued": len(self._pending),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "paced": self.paced,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "expired": self.expired
+        }
+
+instagram_outbox = InstagramOutbox(
+    settings.INSTAGRAM_GRAPH_BASE_URL,
+    rate_limiter,
+    rate_per_second=settings.INSTAGRAM_SEND_RATE,
+    burst=settings.INSTAGRAM_SEND_BURST,
+    concurrency=settings.INSTAGRAM_SEND_CONCURRENCY,
+    max_attempts=settings.INSTAGRAM_SEND_MAX_ATTEMPTS,
+    backoff_base=settings.INSTAGRAM_SEND_BACKOFF,
+    backoff_max=settings.INSTAGRAM_SEND_MAX_BACKOFF,
+    demo_mode=settings.INSTAGRAM_DEMO_MODE,
+    min_timeout=settings.DEADLINE_SEND_RESERVE,
+    session_factory=AsyncSessionLocal,
+    sent_ttl=settings.DEDUP_TTL_HOURS * 3600
+)
@@ -4,60 +4,56 @@ Handle Instagram DM sending and API interactions
 """
 import httpx
 from typing import Optional, Dict, Any
-import asyncio
 
 from ..core.config import settings
+from ..core.http_client import get_http_client
+from ..core.token_crypto import decrypt_token
 from ..models.merchant import Merchant
+from .deadline import Deadline
+from .instagram_outbox import InstagramOutbox, instagram_outbox
+from .reply_chunker import split_message
 
 class InstagramService:
     """Service for Instagram Graph API interactions"""
     
-    def __init__(self):
-        """Initialize Instagram service"""
-        self.base_url = "https://graph.instagram.com/v18.0"
-        self.timeout = 10  # 10 second timeout
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None, outbox: Optional[InstagramOutbox] = None):
+        """Initialize Instagram service on the shared connection pool and outbound queue"""
+        self.base_url = settings.INSTAGRAM_GRAPH_BASE_URL.rstrip("/")
+        self._http_client = http_client
+        self.outbox = outbox or instagram_outbox
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Pooled keep-alive HTTP client"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = get_http_client()
+        return self._http_client
     
     async def send_message(
         self,
         recipient_id: str,
         message_text: str,
-        merchant: Merchant
+        merchant: Merchant,
+        idempotency_key: Optional[str] = None,
+        deadline: Optional[Deadline] = None
     ) -> bool:
-        """Send message via Instagram Graph API"""
-        try:
-            # For V2, we'll simulate message sending since we need actual Instagram access tokens
-            # In production, you would decrypt the access token and use it here
-            
-            print(f"📤 Sending message to {recipient_id}: {message_text[:50]}...")
-            
-            # Simulate API call delay
-            await asyncio.sleep(0.5)
-            
-            # In production, use this logic:
-            # access_token = self._decrypt_access_token(merchant.access_token_hash)
-            # url = f"{self.base_url}/me/messages"
-            # data = {
-            #     "recipient": {"id": recipient_id},
-            #     "message": {"text": message_text},
-            #     "access_token": access_token
-            # }
-            # 
-            # async with httpx.AsyncClient() as client:
-            #     response = await client.post(url, json=data, timeout=self.timeout)
-            #     
-            #     if response.status_code == 200:
-            #         return True
-            #     else:
-            #         print(f"❌ Instagram API error: {response.text}")
-            #         return False
-            
-            # For V2 demo, always return success
-            print(f"✅ Message simulated successfully (V2 Demo Mode)")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Instagram service error: {e}")
+        """Send message via Instagram Graph API
+        
+        Text above the DM length limit goes out as several messages in
+        order. Sends with the same idempotency_key are delivered once, and
+        failed sends are not retried past the deadline.
+        """
+        texts = split_message(message_text, settings.INSTAGRAM_MAX_MESSAGE_CHARS)
+        if not texts:
             return False
+        return await self.outbox.send(
+            page_id=merchant.instagram_page_id,
+            recipient_id=recipient_id,
+            texts=texts,
+            access_token=self.access_token(merchant),
+            idempotency_key=idempotency_key,
+            expires_at=deadline.expires_at if deadline else None
+        )
     
     async def get_user_info(self, user_id: str, access_token: str) -> Optional[Dict[Any, Any]]:
         """Get Instagram user information"""
@@ -68,15 +64,14 @@ class InstagramService:
                 "access_token": access_token
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"❌ Failed to get user info: {response.text}")
-                    return None
-                    
+            response = await self.client.get(url, params=params)
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"❌ Failed to get user info: {response.text}")
+                return None
+            
         except Exception as e:
             print(f"❌ Error getting user info: {e}")
             return None
@@ -87,11 +82,10 @@ class InstagramService:
             url = f"{self.base_url}/me"
             params = {"access_token": access_token}
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                
-                return response.status_code == 200
-                
+            response = await self.client.get(url, params=params)
+            
+            return response.status_code == 200
+            
         except Exception as e:
             print(f"❌ Token validation error: {e}")
             return False
@@ -105,25 +99,28 @@ class InstagramService:
                 "access_token": access_token
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, params=params, timeout=self.timeout)
-                
-                if response.status_code == 200:
-                    print(f"✅ Webhook setup successful for {webhook_url}")
-                    return True
-                else:
-                    print(f"❌ Webhook setup failed: {response.text}")
-                    return False
-                    
+            response = await self.client.post(url, params=params)
+            
+            if response.status_code == 200:
+                print(f"✅ Webhook setup successful for {webhook_url}")
+                return True
+            else:
+                print(f"❌ Webhook setup failed: {response.text}")
+                return False
+            
         except Exception as e:
             print(f"❌ Webhook setup error: {e}")
             return False
     
-    def _decrypt_access_token(self, token_hash: str) -> str:
-        """Decrypt Instagram access token (placeholder)"""
-        # In production, implement proper encryption/decryption
-        # For V2, return a demo token
-        return "demo_access_token_v2"
+    def access_token(self, merchant: Merchant) -> str:
+        """Decrypt the merchant's Instagram access token
+        
+        Demo mode only simulates sends and needs no token; otherwise a token
+        that cannot be decrypted raises TokenDecryptionError.
+        """
+        if self.outbox.demo_mode:
+            return ""
+        return decrypt_token(merchant.access_token_hash)
     
     async def get_page_info(self, access_token: str) -> Optional[Dict[Any, Any]]:
         """Get Instagram page information"""
@@ -134,15 +131,14 @@ class InstagramService:
                 "access_token": access_token
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=self.timeout)
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"❌ Failed to get page info: {response.text}")
-                    return None
-                    
+            response = await self.client.get(url, params=params)
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"❌ Failed to get page info: {response.text}")
+                return None
+            
         except Exception as e:
             print(f"❌ Error getting page info: {e}")
             return None
@@ -153,11 +149,21 @@ class InstagramService:
             "status": "healthy",
             "service": "Instagram Graph API",
             "base_url": self.base_url,
-            "demo_mode": True,  # V2 uses demo mode
+            "demo_mode": settings.INSTAGRAM_DEMO_MODE,
+            "outbox": self.outbox.stats(),
             "capabilities": [
                 "send_messages",
                 "receive_webhooks", 
                 "user_authentication",
                 "webhook_verification"
             ]
-        } 
\ No newline at end of file
+        }
+
+_instagram_service: Optional[InstagramService] = None
+
+def get_instagram_service() -> InstagramService:
+    """Application-scoped InstagramService singleton"""
+    global _instagram_service
+    if _instagram_service is None:
+        _instagram_service = InstagramService()
+    return _instagram_service
@@ -0,0 +1,446 @@
+"""
+LLM Client for IG-Shop-Agent V2
+Non-blocking OpenAI chat completions with pooled connections, bounded concurrency and governed rate limits
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+
+from ..core.config import settings
+from .llm_governor import Admission, GovernorThrottled, LLMGovernor, llm_governor
+from .token_budget import token_counter
+
+class LLMError(Exception):
+    """Base class for LLM client failures"""
+
+class LLMRateLimitError(LLMError):
+    """The provider rejected the call with a rate limit (429)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMThrottledError(LLMRateLimitError):
+    """The governor held the call back: no rate limit budget or slot before the deadline"""
+
+class LLMTimeoutError(LLMError):
+    """The call did not finish within its deadline"""
+
+class LLMRequestError(LLMError):
+    """The request itself was invalid (4xx other than 429)"""
+
+class LLMUnavailableError(LLMError):
+    """Connection failures, 5xx responses or missing credentials"""
+
+def translate_error(error: openai.OpenAIError) -> LLMError:
+    """Map an OpenAI SDK exception onto the client's error hierarchy"""
+    if isinstance(error, openai.RateLimitError):
+        return LLMRateLimitError(str(error), retry_after=retry_after_seconds(error))
+    if isinstance(error, openai.APITimeoutError):
+        return LLMTimeoutError(str(error))
+    if isinstance(error, (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)):
+        return LLMRequestError(str(error))
+    return LLMUnavailableError(str(error))
+
+def retry_after_seconds(error: openai.APIStatusError) -> Optional[float]:
+    """Retry-After of a 429 response, in seconds"""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+@dataclass
+class LLMCompletion:
+    """Result of a chat completion"""
+    content: Optional[str]
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+
+class LLMStream:
+    """A streaming completion; token usage is filled in as the stream is consumed"""
+
+    def __init__(self, client: "LLMClient", request: Dict[str, Any], deadline: float, cost: int, admit_timeout: float):
+        self._client = client
+        self._request = request
+        self.deadline = deadline
+        self.cost = cost
+        self.admit_timeout = admit_timeout
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.first_token_latency: Optional[float] = None
+
+    def chunks(self) -> AsyncIterator[str]:
+        """Content deltas; closing the iterator early aborts the request
+
+        Use it with contextlib.aclosing so that stopping early closes the
+        HTTP stream right away and the model stops generating tokens.
+        """
+        return self._client._stream(self)
+
+class LLMClient:
+    """Shared async OpenAI client
+
+    One AsyncOpenAI instance (and one httpx connection pool) serves the whole
+    process. A semaphore caps in-flight completions, and every call runs under
+    a deadline that includes the time spent waiting for a slot. Chat
+    completions and embeddings are first admitted by the governor, which
+    keeps them within the account's rate limits and the model's adaptive
+    concurrency limit.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_concurrency: int = 8,
+        timeout: float = 10.0,
+        max_connections: int = 20,
+        governor: Optional[LLMGovernor] = None
+    ):
+        self.api_key = api_key
+        self.governor = governor
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: Optional[openai.AsyncOpenAI] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.errors = 0
+
+    def _get_client(self) -> openai.AsyncOpenAI:
+        """Create the AsyncOpenAI client on first use"""
+        if self._client is None:
+            if not self.api_key:
+                raise LLMUnavailableError("OPENAI_API_KEY is not configured")
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    ),
+                    timeout=self.timeout
+                )
+            )
+        return self._client
+
+    async def _admit(self, model: str, cost: int, timeout: float, kind: str) -> Optional[Admission]:
+        """Governor admission, raising LLMThrottledError when it does not come in time"""
+        if self.governor is None:
+            return None
+        try:
+            return await self.governor.admit(model, cost, timeout, kind)
+        except GovernorThrottled as e:
+            self.errors += 1
+            raise LLMThrottledError(str(e)) from e
+
+    async def _overloaded(self, admission: Optional[Admission], error: LLMError) -> None:
+        """Tell the governor about a 429 so every worker backs off"""
+        if admission is not None and isinstance(error, LLMRateLimitError):
+            await self.governor.backoff(admission.model, error.retry_after)
+
+    def _release(self, admission: Optional[Admission], overloaded: bool, latency: Optional[float]) -> None:
+        if admission is not None:
+            self.governor.release(admission, overloaded, latency)
+
+    async def _reconcile(self, admission: Optional[Admission], used_tokens: int) -> None:
+        """Refund the admitted tokens the call did not use"""
+        if admission is not None:
+            await self.governor.reconcile(admission, used_tokens)
+
+    async def _acquire_slot(self, expires_at: float, deadline: float) -> None:
+        """Wait for a concurrency slot until expires_at
+
+        Running out of time here means the request was never sent, so it is
+        reported as throttling (LLMThrottledError), not as a slow model.
+        """
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(0.0, expires_at - loop.time()))
+        except asyncio.TimeoutError:
+            self.errors += 1
+            raise LLMThrottledError(f"No free LLM slot within the {deadline:.1f}s deadline")
+        finally:
+            self.waiting -= 1
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        timeout: Optional[float] = None,
+        estimated_tokens: Optional[int] = None
+    ) -> LLMCompletion:
+        """Run one chat completion under the governor, the concurrency cap and a deadline"""
+        deadline = timeout if timeout is not None else self.timeout
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + deadline
+        prompt_tokens = estimated_tokens if estimated_tokens is not None else token_counter.count_messages(messages)
+        admission = await self._admit(model, prompt_tokens + max_tokens, deadline, "complete")
+        overloaded = False
+        latency = None
+        try:
+            await self._acquire_slot(expires_at, deadline)
+            try:
+                completion = await asyncio.wait_for(
+                    self._complete(messages, model, max_tokens, temperature, deadline),
+                    timeout=max(0.0, expires_at - loop.time())
+                )
+            finally:
+                self._semaphore.release()
+            latency = completion.latency
+            if completion.prompt_tokens:
+                await self._reconcile(admission, completion.prompt_tokens + completion.completion_tokens)
+            return completion
+        except LLMThrottledError:
+            await self._reconcile(admission, 0)
+            raise
+        except asyncio.TimeoutError:
+            # The request was sent and the model did not answer in time
+            self.errors += 1
+            overloaded = True
+            raise LLMTimeoutError(f"Completion exceeded {deadline:.1f}s deadline")
+        except LLMError as e:
+            self.errors += 1
+            overloaded = isinstance(e, (LLMRateLimitError, LLMTimeoutError))
+            await self._overloaded(admission, e)
+            raise
+        finally:
+            # Cancelled calls (e.g. the slower of two hedged requests) leave the limit alone
+            self._release(admission, overloaded, latency)
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        timeout: float
+    ) -> LLMCompletion:
+        """Call the API on a held slot and map SDK exceptions"""
+        client = self._get_client()
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout
+            )
+        except openai.OpenAIError as e:
+            raise translate_error(e) from e
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        content = None
+        if response.choices and response.choices[0].message and response.choices[0].message.content:
+            content = response.choices[0].message.content.strip()
+        usage = response.usage
+        return LLMCompletion(
+            content=content,
+            model=response.model or model,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            latency=time.monotonic() - started
+        )
+
+    def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        timeout: Optional[float] = None,
+        estimated_tokens: Optional[int] = None,
+        admit_timeout: Optional[float] = None
+    ) -> LLMStream:
+        """Streaming chat completion under the governor, the concurrency cap and a deadline
+
+        admit_timeout bounds the wait for the governor when the first token
+        is due sooner than the deadline.
+        """
+        deadline = timeout if timeout is not None else self.timeout
+        prompt_tokens = estimated_tokens if estimated_tokens is not None else token_counter.count_messages(messages)
+        return LLMStream(
+            self,
+            {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature},
+            deadline,
+            prompt_tokens + max_tokens,
+            min(deadline, admit_timeout) if admit_timeout is not None else deadline
+        )
+
+    async def _stream(self, stream: LLMStream) -> AsyncIterator[str]:
+        """Get admitted, acquire a slot, open the stream and yield deltas until done, stopped or late"""
+        client = self._get_client()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        expires_at = started + stream.deadline
+
+        admission = await self._admit(stream._request["model"], stream.cost, stream.admit_timeout, "first_token")
+        try:
+            await self._acquire_slot(expires_at, stream.deadline)
+        except BaseException as e:
+            self._release(admission, False, None)
+            if isinstance(e, LLMThrottledError):
+                await self._reconcile(admission, 0)
+            raise
+
+        self.in_flight += 1
+        sent = loop.time()
+        response = None
+        deltas = 0
+        usage = None
+        overloaded = False
+        try:
+            response = await asyncio.wait_for(
+                client.chat.completions.create(
+                    **stream._request,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=stream.deadline
+                ),
+                timeout=max(0.0, expires_at - loop.time())
+            )
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, expires_at - loop.time()))
+                except StopAsyncIteration:
+                    break
+                if chunk.usage:
+                    usage = chunk.usage
+                    stream.prompt_tokens = chunk.usage.prompt_tokens
+                    stream.completion_tokens = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    deltas += 1
+                    if stream.first_token_latency is None:
+                        stream.first_token_latency = loop.time() - started
+                    yield chunk.choices[0].delta.content
+            self.completed += 1
+        except GeneratorExit:
+            self.completed += 1  # the consumer stopped early, e.g. at the reply length limit
+            raise
+        except asyncio.TimeoutError:
+            self.errors += 1
+            overloaded = True
+            raise LLMTimeoutError(f"Completion exceeded {stream.deadline:.1f}s deadline")
+        except openai.OpenAIError as e:
+            self.errors += 1
+            error = translate_error(e)
+            overloaded = isinstance(error, LLMRateLimitError)
+            await self._overloaded(admission, error)
+            raise error from e
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            # The model's load shows in its time to first token (queueing excluded); a stream stopped early still has it
+            if overloaded or stream.first_token_latency is None:
+                self._release(admission, overloaded, None)
+            else:
+                self._release(admission, False, started + stream.first_token_latency - sent)
+            stream.latency = loop.time() - started
+            if not stream.completion_tokens:
+                stream.completion_tokens = deltas  # stopped before the usage chunk; one token per delta
+            if response is not None:
+                await response.close()
+            if usage is not None:
+                await self._reconcile(admission, usage.prompt_tokens + usage.completion_tokens)
+
+    async def embed(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> List[List[float]]:
+        """Embed a batch of texts in one request under the governor, the same cap and a deadline"""
+        deadline = timeout if timeout is not None else self.timeout
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + deadline
+        admission = await self._admit(model, sum(token_counter.count(text) for text in texts), deadline, "embed")
+        overloaded = False
+        latency = None
+        try:
+            await self._acquire_slot(expires_at, deadline)
+            try:
+                embeddings, latency = await asyncio.wait_for(
+                    self._embed(texts, model, dimensions, deadline),
+                    timeout=max(0.0, expires_at - loop.time())
+                )
+            finally:
+                self._semaphore.release()
+            return embeddings
+        except LLMThrottledError:
+            await self._reconcile(admission, 0)
+            raise
+        except asyncio.TimeoutError:
+            self.errors += 1
+            raise LLMTimeoutError(f"Embedding exceeded {deadline:.1f}s deadline")
+        except LLMError as e:
+            self.errors += 1
+            overloaded = isinstance(e, LLMRateLimitError)
+            await self._overloaded(admission, e)
+            raise
+        finally:
+            self._release(admission, overloaded, latency)
+
+    async def _embed(
+        self,
+        texts: List[str],
+        model: str,
+        dimensions: Optional[int],
+        timeout: float
+    ) -> Tuple[List[List[float]], float]:
+        """Call the embeddings endpoint on a held slot; returns the vectors and the request latency"""
+        client = self._get_client()
+        extra: Dict[str, Any] = {"dimensions": dimensions} if dimensions else {}
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            response = await client.embeddings.create(model=model, input=texts, timeout=timeout, **extra)
+        except openai.OpenAIError as e:
+            raise translate_error(e) from e
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], time.monotonic() - started
+
+    async def close(self) -> None:
+        """Close the underlying connection pool"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> dict:
+        """Concurrency and outcome counters (governor state is under llm_governor)"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "errors": self.errors
+        }
+
+llm_client = LLMClient(
+    api_key=settings.OPENAI_API_KEY,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+    timeout=settings.OPENAI_TIMEOUT,
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    governor=llm_governor
+)
@@ -0,0 +1,295 @@
+"""
+LLM Governor for IG-Shop-Agent V2
+OpenAI requests and tokens per minute from the rate limiter store, and an adaptive (AIMD) concurrency limit per model
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+from ..core.config import settings
+from .rate_limiter import RateLimiter, rate_limiter
+
+class GovernorThrottled(Exception):
+    """The call could not be admitted before its deadline"""
+
+class AdaptiveLimit:
+    """Concurrency limit for one model, adjusted by additive increase and multiplicative decrease
+
+    Every call that returns at normal latency adds 1/limit (about one slot
+    per limit calls). A 429, a timeout, or a latency above tolerance times
+    the running baseline cuts the limit by the decrease factor, at most once
+    per second so one burst of failures counts once.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        tolerance: float = 2.0,
+        decrease: float = 0.7,
+        min_samples: int = 20
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = max(float(self.min_limit), self.max_limit / 2)
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.min_samples = min_samples
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._baselines: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting in FIFO order; False when none frees up within timeout"""
+        if self._has_slot() and not self._waiters:
+            self.in_flight += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=max(0.0, timeout))
+            return True
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the wait expired
+            return waiter.done() and not waiter.cancelled()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_slot():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, kind: str, overloaded: bool = False, latency: Optional[float] = None) -> None:
+        """Free a slot and adjust the limit from the call's outcome
+
+        Calls that were cancelled or failed for other reasons pass neither
+        overloaded nor latency and leave the limit alone.
+        """
+        self.in_flight -= 1
+        baseline = self._baselines.get(kind)
+        slow = (latency is not None and baseline is not None
+                and self._samples.get(kind, 0) >= self.min_samples and latency > baseline * self.tolerance)
+        if overloaded or slow:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self._last_decrease = now
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                self.decreases += 1
+        elif latency is not None and self.limit < self.max_limit:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.increases += 1
+        if latency is not None:
+            # Slow EWMA, so a spell of slow calls is judged against the latency before it
+            self._baselines[kind] = latency if baseline is None else baseline * 0.95 + latency * 0.05
+            self._samples[kind] = self._samples.get(kind, 0) + 1
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "baselines": {kind: round(value, 3) for kind, value in self._baselines.items()},
+            "increases": self.increases,
+            "decreases": self.decreases
+        }
+
+@dataclass
+class Admission:
+    """A call let through by the governor; hand it back with release()"""
+    model: str
+    kind: str
+    limit: AdaptiveLimit
+    cost: float = 0.0  # tokens taken from the model's tokens-per-minute bucket
+
+class LLMGovernor:
+    """Admits LLM calls within the account's rate limits and the adaptive concurrency limit
+
+    OPENAI_RATE_LIMITS gives each model's requests and tokens per minute;
+    OPENAI_LIMIT_HEADROOM of them are spent. Both are token buckets in the
+    rate limiter store. With the sqlite or redis backend (sqlite is the
+    default when WEB_CONCURRENCY > 1) every worker draws from the same
+    budget; with the memory backend each worker has the whole budget.
+    A call takes its estimated cost (prompt tokens plus max_tokens, which is
+    how OpenAI counts a request against the limit) before it is sent, and
+    waits for the buckets to refill when they are short. A 429 from OpenAI
+    empties the model's request bucket for its Retry-After, so all workers
+    sharing the store back off together. Once a call reports its usage, the
+    tokens it was charged but did not use are refunded. Models without
+    configured limits only get the concurrency limit.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        rate_limits: Dict[str, Dict[str, int]],
+        headroom: float = 0.9,
+        burst: float = 0.25,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        latency_tolerance: float = 2.0,
+        decrease: float = 0.7,
+        overload_backoff: float = 2.0
+    ):
+        self.limiter = limiter
+        self.rate_limits = rate_limits
+        self.headroom = headroom
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.decrease = decrease
+        self.overload_backoff = overload_backoff
+        self.limits: Dict[str, AdaptiveLimit] = {}
+        self.admitted = 0
+        self.delayed = 0
+        self.throttled = 0
+        self.backoffs = 0
+        self.wait_seconds = 0.0
+        self.refunded_tokens = 0.0
+        self.pacing = 0  # calls sleeping for rate limit budget
+
+    def _limit(self, model: str) -> AdaptiveLimit:
+        limit = self.limits.get(model)
+        if limit is None:
+            limit = self.limits[model] = AdaptiveLimit(
+                self.max_concurrency,
+                min_limit=self.min_concurrency,
+                tolerance=self.latency_tolerance,
+                decrease=self.decrease
+            )
+        return limit
+
+    def _budgets(self, model: str) -> Optional[Dict[str, float]]:
+        limits = self.rate_limits.get(model)
+        if not limits:
+            return None
+        return {"rpm": limits["rpm"] * self.headroom, "tpm": limits["tpm"] * self.headroom}
+
+    async def _take(self, model: str, budgets: Dict[str, float], cost: float, expires_at: float) -> float:
+        """Take one request and cost tokens, sleeping until both buckets allow it; returns the tokens taken"""
+        loop = asyncio.get_running_loop()
+        tpm_burst = budgets["tpm"] * self.burst
+        rpm_burst = max(1.0, budgets["rpm"] * self.burst)
+        cost = min(float(cost), tpm_burst)  # a prompt larger than the burst would never fit
+        delayed = False
+        try:
+            while True:
+                decision = await self.limiter.check("llm_tpm", model, budgets["tpm"], 60, cost=cost, burst=tpm_burst)
+                if decision.allowed:
+                    decision = await self.limiter.check("llm_rpm", model, budgets["rpm"], 60, burst=rpm_burst)
+                    if decision.allowed:
+                        return cost
+                    # Give the tokens back while waiting for a request slot
+                    await self.limiter.check("llm_tpm", model, budgets["tpm"], 60, cost=-cost, burst=tpm_burst)
+                wait = decision.retry_after
+                # Waiting is only worth it while most of the deadline is left for the call itself
+                if wait > (expires_at - loop.time()) / 2:
+                    self.throttled += 1
+                    raise GovernorThrottled(f"{model} rate limit: next slot in {wait:.1f}s, past the deadline")
+                if not delayed:
+                    delayed = True
+                    self.delayed += 1
+                    self.pacing += 1
+                self.wait_seconds += wait
+                await asyncio.sleep(wait)
+        finally:
+            if delayed:
+                self.pacing -= 1
+
+    async def admit(self, model: str, cost: int, timeout: float, kind: str = "complete") -> Admission:
+        """Wait for rate limit budget and a concurrency slot, within timeout seconds"""
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout
+        budgets = self._budgets(model)
+        taken = 0.0
+        if budgets is not None:
+            taken = await self._take(model, budgets, cost, expires_at)
+        limit = self._limit(model)
+        if not await limit.acquire(expires_at - loop.time()):
+            self.throttled += 1
+            if taken:
+                await self.limiter.check("llm_tpm", model, budgets["tpm"], 60, cost=-taken, burst=budgets["tpm"] * self.burst)
+            raise GovernorThrottled(f"{model} concurrency limit {int(limit.limit)} reached")
+        self.admitted += 1
+        return Admission(model, kind, limit, taken)
+
+    def release(self, admission: Admission, overloaded: bool = False, latency: Optional[float] = None) -> None:
+        """Hand back the slot with the call's outcome (latency only for answered calls)"""
+        admission.limit.release(admission.kind, overloaded, latency)
+
+    async def reconcile(self, admission: Admission, used_tokens: int) -> None:
+        """Refund the admitted tokens a call did not use (all of them when it was never sent)
+
+        The admitted cost counts max_tokens in full, while the usage OpenAI
+        reports is usually far less; every worker gets the difference back.
+        """
+        budgets = self._budgets(admission.model)
+        refund = admission.cost - used_tokens
+        if budgets is None or refund <= 0:
+            return
+        admission.cost = used_tokens
+        self.refunded_tokens += refund
+        await self.limiter.check(
+            "llm_tpm", admission.model, budgets["tpm"], 60, cost=-refund, burst=budgets["tpm"] * self.burst
+        )
+
+    async def backoff(self, model: str, retry_after: Optional[float] = None) -> None:
+        """OpenAI answered 429: no worker sends to the model until Retry-After has passed"""
+        budgets = self._budgets(model)
+        self.backoffs += 1
+        if budgets is None:
+            return
+        seconds = retry_after if retry_after else self.overload_backoff
+        await self.limiter.drain("llm_rpm", model, -budgets["rpm"] / 60 * seconds)
+
+    def pressure(self) -> float:
+        """LLM calls in flight or waiting per concurrency slot (above 1 means calls are queueing)"""
+        limits = list(self.limits.values())
+        slots = sum(int(limit.limit) for limit in limits) or self.max_concurrency
+        calls = sum(limit.in_flight + len(limit._waiters) for limit in limits) + self.pacing
+        return calls / slots
+
+    def stats(self) -> dict:
+        """Admission counters and the adaptive limit per model"""
+        return {
+            "rate_limits": {model: self._budgets(model) for model in self.rate_limits},
+            "models": {model: limit.stats() for model, limit in self.limits.items()},
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "throttled": self.throttled,
+            "backoffs": self.backoffs,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "refunded_tokens": int(self.refunded_tokens),
+            "pressure": round(self.pressure(), 2)
+        }
+
+llm_governor = LLMGovernor(
+    rate_limiter,
+    settings.OPENAI_RATE_LIMITS,
+    headroom=settings.OPENAI_LIMIT_HEADROOM,
+    burst=settings.OPENAI_LIMIT_BURST,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+    min_concurrency=settings.LLM_AIMD_MIN_CONCURRENCY,
+    latency_tolerance=settings.LLM_AIMD_LATENCY_TOLERANCE,
+    decrease=settings.LLM_AIMD_DECREASE,
+    overload_backoff=settings.LLM_OVERLOAD_BACKOFF
+)
@@ -0,0 +1,483 @@
+"""
+LLM Resilience for IG-Shop-Agent V2
+Circuit breakers, hedged requests and an ordered fallback chain of models around the LLM client
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from ..core.config import settings
+from .llm_client import (
+    LLMClient, LLMCompletion, LLMError, LLMRequestError, LLMStream, LLMThrottledError, LLMTimeoutError,
+    LLMUnavailableError, llm_client
+)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class LLMCircuitOpenError(LLMUnavailableError):
+    """Every model in the chain is short-circuited by its breaker"""
+
+def latency_slo(tier: Optional[str]) -> float:
+    """Seconds a tier's reply may take, fallbacks included (never above OPENAI_TIMEOUT)"""
+    limits = settings.TIER_LIMITS.get(tier or "starter") or settings.TIER_LIMITS["starter"]
+    return min(settings.OPENAI_TIMEOUT, limits.get("latency_slo", settings.OPENAI_TIMEOUT))
+
+class CircuitBreaker:
+    """Rolling error-rate breaker for one model
+
+    Outcomes of the last window_seconds are kept. Once at least min_calls
+    were made and the error share reaches error_rate, the breaker opens and
+    calls skip the model. After cooldown a single probe is let through: its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, window_seconds: float = 30.0, min_calls: int = 10, error_rate: float = 0.5, cooldown: float = 15.0):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._errors = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.trips = 0
+        self.rejected = 0
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            if not self._outcomes.popleft()[1]:
+                self._errors -= 1
+
+    @property
+    def error_rate(self) -> float:
+        self._trim(time.monotonic())
+        return self._errors / len(self._outcomes) if self._outcomes else 0.0
+
+    def allow(self) -> bool:
+        """Whether a call may go to the model now"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self._opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._probe_started = None
+        # One probe at a time; a probe that never reported back is replaced after cooldown
+        if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.cooldown):
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok: bool) -> None:
+        """Outcome of a call that allow() let through"""
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            if ok:
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._errors = 0
+            else:
+                self._trip(now)
+            return
+        self._outcomes.append((now, ok))
+        if not ok:
+            self._errors += 1
+        self._trim(now)
+        if (self.state == CLOSED and not ok and len(self._outcomes) >= self.min_calls
+                and self._errors / len(self._outcomes) >= self.error_rate_threshold):
+            self._trip(now)
+
+    def skip(self) -> None:
+        """A call allow() let through never reached the model; a pending probe may go again"""
+        if self.state == HALF_OPEN:
+            self._probe_started = None
+
+    def _trip(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_started = None
+        self.trips += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate, 3),
+            "calls_in_window": len(self._outcomes),
+            "trips": self.trips,
+            "rejected": self.rejected
+        }
+
+class LatencyTracker:
+    """Recent latencies of one model and call kind, for percentile-based hedge delays"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Latency at the given fraction, or None until enough samples were seen"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class ResilientStream:
+    """A streamed completion from whichever model and request answered first"""
+
+    def __init__(
+        self,
+        llm: "ResilientLLM",
+        request: Dict[str, Any],
+        tier: Optional[str],
+        preferred: Optional[str],
+        timeout: Optional[float] = None
+    ):
+        self._llm = llm
+        self._request = request
+        self.tier = tier
+        self.preferred = preferred
+        self.timeout = timeout
+        self.stream: Optional[LLMStream] = None
+        self.model: Optional[str] = None
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.stream.prompt_tokens if self.stream else 0
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.stream.completion_tokens if self.stream else 0
+
+    @property
+    def first_token_latency(self) -> Optional[float]:
+        return self.stream.first_token_latency if self.stream else None
+
+    def chunks(self) -> AsyncIterator[str]:
+        """Content deltas; use with contextlib.aclosing like LLMStream.chunks()"""
+        return self._llm._stream(self)
+
+class ResilientLLM:
+    """Fallback chain of models with per-model breakers and hedging
+
+    A call walks the chain (OPENAI_MODEL, then LLM_FALLBACK_MODELS, or the
+    routed model first and the rest after it) within the tier's latency SLO, skipping models whose breaker is open. Each
+    model gets LLM_ATTEMPT_SHARE of the remaining time while others follow
+    it. When an attempt is slower than the model's recent p95 and a
+    connection slot is free, an identical second request is raised and the
+    first answer wins; the other is cancelled. Invalid requests are raised
+    at once, since another model would reject them as well. Calls the
+    governor held back move on to the next model without counting against
+    the breaker, since the model itself never failed. When the chain
+    is exhausted the last error is raised, and callers answer from a template.
+    """
+
+    def __init__(
+        self,
+        llm: LLMClient,
+        models: List[str],
+        attempt_share: float = 0.6,
+        breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker,
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 0.5,
+        hedge_max_ratio: float = 0.1
+    ):
+        self.llm = llm
+        self.models = list(dict.fromkeys(model for model in models if model))
+        self.attempt_share = attempt_share
+        self._breaker_factory = breaker_factory
+        self.breakers: Dict[str, CircuitBreaker] = {model: breaker_factory() for model in self.models}
+        self.latencies: Dict[Tuple[str, str], LatencyTracker] = {}
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.calls = 0
+        self.fallbacks = 0
+        self.exhausted = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.slo_misses = 0
+
+    def _tracker(self, model: str, kind: str) -> LatencyTracker:
+        tracker = self.latencies.get((model, kind))
+        if tracker is None:
+            tracker = self.latencies[(model, kind)] = LatencyTracker()
+        return tracker
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = self._breaker_factory()
+        return breaker
+
+    def _attempt_budget(self, later: List[str], remaining: float) -> float:
+        """Time one model gets, leaving room for the models after it"""
+        if any(self._breaker(model).state != OPEN for model in later):
+            return remaining * self.attempt_share
+        return remaining
+
+    def _hedge_delay(self, model: str, kind: str, budget: float) -> Optional[float]:
+        """When to send the second request, or None to not hedge this call"""
+        if not self.hedge_enabled:
+            return None
+        p = self._tracker(model, kind).percentile(self.hedge_percentile)
+        if p is None:
+            return None
+        delay = max(self.hedge_min_delay, p)
+        return delay if delay < budget * 0.8 else None
+
+    def _can_hedge(self) -> bool:
+        """A spare connection slot and hedges within their share of calls"""
+        spare = self.llm.in_flight + self.llm.waiting < self.llm.max_concurrency
+        return spare and self.hedged < self.hedge_max_ratio * self.calls
+
+    async def _hedged(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        budget: float,
+        delay: Optional[float],
+        discard: Optional[Callable[[T], Awaitable[None]]] = None
+    ) -> T:
+        """Run attempt(timeout), racing a second copy of it once delay has passed"""
+        started = time.monotonic()
+        first = asyncio.ensure_future(attempt(budget))
+        if delay is None:
+            return await first
+        try:
+            return await asyncio.wait_for(asyncio.shield(first), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            first.cancel()
+            raise
+        if not self._can_hedge():
+            return await first
+
+        self.hedged += 1
+        second = asyncio.ensure_future(attempt(max(0.0, budget - (time.monotonic() - started))))
+        pending = {first, second}
+        try:
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    for task in winners[1:]:
+                        if discard is not None:
+                            await discard(task.result())
+                    if winners[0] is second:
+                        self.hedge_wins += 1
+                    return winners[0].result()
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                for result in await asyncio.gather(*pending, return_exceptions=True):
+                    if discard is not None and not isinstance(result, BaseException):
+                        await discard(result)
+
+    def _chain(self, tier: Optional[str], preferred: Optional[str], timeout: Optional[float] = None):
+        """(position, model, breaker, seconds for the attempt) for each model that may be tried"""
+        models = [preferred, *(model for model in self.models if model != preferred)] if preferred else self.models
+        slo = latency_slo(tier) if timeout is None else min(timeout, latency_slo(tier))
+        deadline = time.monotonic() + slo
+        for position, model in enumerate(models):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.slo_misses += 1
+                return
+            breaker = self._breaker(model)
+            if breaker.allow():
+                yield position, model, breaker, self._attempt_budget(models[position + 1:], remaining)
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        temperature: float,
+        tier: Optional[str] = None,
+        model: Optional[str] = None,
+        estimated_tokens: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> LLMCompletion:
+        """Chat completion from the first model in the chain that answers within the SLO (or timeout, if sooner)"""
+        self.calls += 1
+        last_error: Optional[LLMError] = None
+        for position, model, breaker, budget in self._chain(tier, model, timeout):
+
+            def attempt(timeout: float, model: str = model) -> Awaitable[LLMCompletion]:
+                return self.llm.complete(
+                    messages, model, max_tokens, temperature, timeout=timeout, estimated_tokens=estimated_tokens
+                )
+
+            try:
+                completion = await self._hedged(attempt, budget, self._hedge_delay(model, "complete", budget))
+            except LLMRequestError:
+                breaker.record(True)
+                raise
+            except LLMThrottledError as e:
+                breaker.skip()
+                print(f"⚠️ {model} throttled, trying the next model: {e}")
+                last_error = e
+                continue
+            except LLMError as e:
+                breaker.record(False)
+                print(f"⚠️ {model} failed, trying the next model: {e}")
+                last_error = e
+                continue
+            breaker.record(True)
+            self._tracker(model, "complete").add(completion.latency)
+            if position > 0:
+                self.fallbacks += 1
+            return completion
+
+        self.exhausted += 1
+        raise last_error or LLMCircuitOpenError("No model available: circuit breakers open or latency SLO spent")
+
+    def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        temperature: float,
+        tier: Optional[str] = None,
+        model: Optional[str] = None,
+        estimated_tokens: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> ResilientStream:
+        """Streamed completion; the SLO and hedging apply to the first token, timeout to the whole stream"""
+        request = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "estimated_tokens": estimated_tokens
+        }
+        return ResilientStream(self, request, tier, model, timeout)
+
+    async def _open(
+        self,
+        model: str,
+        request: Dict[str, Any],
+        timeout: float,
+        total_timeout: Optional[float] = None
+    ) -> Tuple[LLMStream, AsyncIterator[str], str]:
+        """Start a stream and wait for its first delta"""
+        stream = self.llm.stream(
+            model=model,
+            timeout=settings.OPENAI_TIMEOUT if total_timeout is None else min(total_timeout, settings.OPENAI_TIMEOUT),
+            admit_timeout=timeout,
+            **request
+        )
+        chunks = stream.chunks()
+        try:
+            first = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+        except StopAsyncIteration:
+            first = ""
+        except asyncio.TimeoutError:
+            await chunks.aclose()
+            raise LLMTimeoutError(f"No first token from {model} within {timeout:.1f}s")
+        except BaseException:
+            await chunks.aclose()
+            raise
+        return stream, chunks, first
+
+    @staticmethod
+    async def _discard(opened: Tuple[LLMStream, AsyncIterator[str], str]) -> None:
+        await opened[1].aclose()
+
+    async def _stream(self, resilient: ResilientStream) -> AsyncIterator[str]:
+        """Deltas of the first model (and request) to produce a token"""
+        self.calls += 1
+        last_error: Optional[LLMError] = None
+        expires_at = time.monotonic() + resilient.timeout if resilient.timeout is not None else None
+        for position, model, breaker, budget in self._chain(resilient.tier, resilient.preferred, resilient.timeout):
+
+            def attempt(timeout: float, model: str = model) -> Awaitable[Tuple[LLMStream, AsyncIterator[str], str]]:
+                total = max(0.0, expires_at - time.monotonic()) if expires_at is not None else None
+                return self._open(model, resilient._request, timeout, total)
+
+            try:
+                stream, chunks, first = await self._hedged(
+                    attempt, budget, self._hedge_delay(model, "first_token", budget), discard=self._discard
+                )
+            except LLMRequestError:
+                breaker.record(True)
+                raise
+            except LLMThrottledError as e:
+                breaker.skip()
+                print(f"⚠️ {model} throttled, trying the next model: {e}")
+                last_error = e
+                continue
+            except LLMError as e:
+                breaker.record(False)
+                print(f"⚠️ {model} failed, trying the next model: {e}")
+                last_error = e
+                continue
+
+            resilient.stream, resilient.model = stream, model
+            if stream.first_token_latency is not None:
+                self._tracker(model, "first_token").add(stream.first_token_latency)
+            if position > 0:
+                self.fallbacks += 1
+            ok = True
+            try:
+                if first:
+                    yield first
+                async for delta in chunks:
+                    yield delta
+            except LLMError as e:
+                ok = isinstance(e, LLMRequestError)
+                raise
+            finally:
+                breaker.record(ok)
+                await chunks.aclose()
+            return
+
+        self.exhausted += 1
+        raise last_error or LLMCircuitOpenError("No model available: circuit breakers open or latency SLO spent")
+
+    def stats(self) -> dict:
+        """Breaker state per model, p95 latencies and fallback/hedge counters"""
+        return {
+            "models": {
+                model: {
+                    **breaker.stats(),
+                    "p95_latency": self._tracker(model, "complete").percentile(0.95),
+                    "p95_first_token": self._tracker(model, "first_token").percentile(0.95)
+                }
+                for model, breaker in self.breakers.items()
+            },
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "exhausted": self.exhausted,
+            "slo_misses": self.slo_misses,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins
+        }
+
+resilient_llm = ResilientLLM(
+    llm_client,
+    models=[settings.OPENAI_MODEL, *(model.strip() for model in settings.LLM_FALLBACK_MODELS.split(","))],
+    attempt_share=settings.LLM_ATTEMPT_SHARE,
+    breaker_factory=lambda: CircuitBreaker(
+        window_seconds=settings.LLM_BREAKER_WINDOW,
+        min_calls=settings.LLM_BREAKER_MIN_CALLS,
+        error_rate=settings.LLM_BREAKER_ERROR_RATE,
+        cooldown=settings.LLM_BREAKER_COOLDOWN
+    ),
+    hedge_enabled=settings.LLM_HEDGE_ENABLED,
+    hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+    hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY,
+    hedge_max_ratio=settings.LLM_HEDGE_MAX_RATIO
+)
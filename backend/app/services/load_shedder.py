@@ -0,0 +1,180 @@
+"""
+Load Shedder for IG-Shop-Agent V2
+Staged admission control from queue depth, LLM pressure and event-loop lag: degrade, defer, then shed
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from ..core.config import settings
+from .llm_governor import llm_governor
+
+NORMAL, DEGRADE, DEFER, SHED = range(4)
+LEVELS = ("normal", "degrade", "defer", "shed")
+
+class LoadShedder:
+    """Load level from sampled pressure signals, rising at once and falling slowly
+
+    A background task samples every interval: how late the event loop woke
+    up from its own sleep, and each watched probe (webhook queue backlog,
+    LLM calls per concurrency slot). Each signal's thresholds map its value
+    to a level and the highest one wins:
+
+    - degrade: replies that need the model get the templated answer instead
+    - defer: events of defer_tiers merchants go back to the queue for later
+    - shed: the webhook endpoint answers 503 with Retry-After and Meta redelivers
+
+    The level drops one step once every signal has stayed below it for
+    recovery seconds, so it does not flap. Requests only read the level;
+    they never run the probes. Every decision taken at a raised level is
+    counted and logged.
+    """
+
+    def __init__(
+        self,
+        thresholds: Dict[str, Dict[str, float]],
+        interval: float = 0.25,
+        recovery: float = 5.0,
+        defer_tiers: Optional[List[str]] = None,
+        defer_delay: float = 5.0,
+        retry_after: int = 10,
+        enabled: bool = True
+    ):
+        self.thresholds = thresholds
+        self.interval = interval
+        self.recovery = recovery
+        self.defer_tiers = set(defer_tiers or ["starter"])
+        self.defer_delay = defer_delay
+        self.retry_after = retry_after
+        self.enabled = enabled
+        self.level = NORMAL
+        self.causes: List[str] = []  # signals at the highest level in the last sample
+        self.signals: Dict[str, float] = {}
+        self.decisions: Dict[str, int] = defaultdict(int)
+        self.transitions = 0
+        self._probes: Dict[str, Callable[[], float]] = {}
+        self._probe_errors = 0
+        self._calm_since = 0.0
+        self._lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def level_name(self) -> str:
+        return LEVELS[self.level]
+
+    def watch(self, name: str, probe: Callable[[], float]) -> None:
+        """Sample probe as signal name (thresholds come from LOAD_THRESHOLDS)"""
+        self._probes[name] = probe
+
+    async def start(self) -> None:
+        """Start the sampling task"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="load-shedder")
+
+    async def stop(self) -> None:
+        """Stop sampling and go back to normal"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.level = NORMAL
+
+    async def _run(self) -> None:
+        """Sample loop; the loop lag is how much later than asked the sleep returned, smoothed over a few samples"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self._lag = self._lag * 0.5 + max(0.0, loop.time() - started - self.interval) * 0.5
+            try:
+                self.sample(self._lag)
+            except Exception as e:
+                print(f"❌ Load shedder sample error: {e}")
+
+    def sample(self, lag: float) -> int:
+        """Read the signals and move the level; returns the new level"""
+        signals = {"loop_lag": lag}
+        for name, probe in self._probes.items():
+            try:
+                signals[name] = float(probe())
+            except Exception as e:
+                self._probe_errors += 1
+                if self._probe_errors == 1 or self._probe_errors % 1000 == 0:
+                    print(f"⚠️ Load signal {name} unavailable: {e}")
+        self.signals = signals
+        levels = {name: self._level_of(name, value) for name, value in signals.items()}
+        target = max(levels.values())
+        self.causes = [name for name, level in levels.items() if level == target > NORMAL]
+        now = time.monotonic()
+        if target >= self.level:
+            if target > self.level:
+                self._move(target)
+            self._calm_since = now
+        elif now - self._calm_since >= self.recovery:
+            self._move(self.level - 1)
+            self._calm_since = now
+        return self.level
+
+    def _level_of(self, name: str, value: float) -> int:
+        thresholds = self.thresholds.get(name) or {}
+        for level in (SHED, DEFER, DEGRADE):
+            threshold = thresholds.get(LEVELS[level])
+            if threshold is not None and value >= threshold:
+                return level
+        return NORMAL
+
+    def _move(self, level: int) -> None:
+        rising = level > self.level
+        self.level = level
+        self.transitions += 1
+        detail = ", ".join(f"{name}={self.signals.get(name, 0):.2f}" for name in self.causes)
+        print(f"{'🚨' if rising else '📉'} Load level {LEVELS[level]}" + (f" ({detail})" if detail else ""))
+
+    def _decide(self, action: str, subject: str) -> None:
+        self.decisions[action] += 1
+        detail = ", ".join(f"{name}={self.signals.get(name, 0):.2f}" for name in self.causes)
+        print(f"🛑 Load {self.level_name}: {action} {subject} ({detail})")
+
+    def sheds(self) -> bool:
+        """Whether to turn a webhook away"""
+        if self.level < SHED:
+            return False
+        self._decide("shed", "webhook")
+        return True
+
+    def defers(self, tier: Optional[str], subject: str) -> bool:
+        """Whether a merchant's events should wait in the queue"""
+        if self.level < DEFER or (tier or "starter") not in self.defer_tiers:
+            return False
+        self._decide("deferred", subject)
+        return True
+
+    def degrades(self, subject: str) -> bool:
+        """Whether a reply should skip the model"""
+        if self.level < DEGRADE:
+            return False
+        self._decide("degraded", subject)
+        return True
+
+    def stats(self) -> dict:
+        """Current level, the signals behind it and decisions taken so far"""
+        return {
+            "enabled": self.enabled,
+            "level": self.level_name,
+            "causes": list(self.causes),
+            "signals": {name: round(value, 3) for name, value in self.signals.items()},
+            "decisions": dict(self.decisions),
+            "transitions": self.transitions
+        }
+
+load_shedder = LoadShedder(
+    settings.LOAD_THRESHOLDS,
+    interval=settings.LOAD_SAMPLE_INTERVAL,
+    recovery=settings.LOAD_RECOVERY_SECONDS,
+    defer_tiers=[tier.strip() for tier in settings.LOAD_DEFER_TIERS.split(",") if tier.strip()],
+    defer_delay=settings.LOAD_DEFER_DELAY,
+    retry_after=settings.LOAD_SHED_RETRY_AFTER,
+    enabled=settings.ENABLE_LOAD_SHEDDING
+)
+load_shedder.watch("llm_pressure", llm_governor.pressure)
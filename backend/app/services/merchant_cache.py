@@ -0,0 +1,116 @@
+"""
+Merchant Cache for IG-Shop-Agent V2
+In-process TTL/LRU cache of merchants for the webhook and auth hot paths
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+
+class MerchantCache:
+    """Merchants indexed by id and instagram_page_id
+
+    Cached merchants are detached from any session and must be treated as
+    read-only snapshots; code that mutates a merchant loads it from the
+    database and calls invalidate() after committing. The TTL bounds how long
+    other worker processes can serve a stale snapshot.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl_seconds: int = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._by_id: "OrderedDict[str, Tuple[Merchant, float]]" = OrderedDict()
+        self._id_by_page: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_by_id(self, db: AsyncSession, merchant_id: str) -> Optional[Merchant]:
+        """Cached lookup by primary key"""
+        merchant = self._get(merchant_id)
+        if merchant is not None:
+            return merchant
+        return self._load(db, await db.scalar(select(Merchant).where(Merchant.id == merchant_id)))
+
+    async def get_by_page_id(self, db: AsyncSession, page_id: str) -> Optional[Merchant]:
+        """Cached lookup by Instagram page ID"""
+        with self._lock:
+            merchant_id = self._id_by_page.get(page_id)
+            if merchant_id is None:
+                self.misses += 1
+        if merchant_id is not None:
+            merchant = self._get(merchant_id)
+            if merchant is not None:
+                return merchant
+        return self._load(db, await db.scalar(select(Merchant).where(Merchant.instagram_page_id == page_id)))
+
+    def _get(self, merchant_id: str) -> Optional[Merchant]:
+        """Return a live entry and refresh its LRU position"""
+        with self._lock:
+            entry = self._by_id.get(merchant_id)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._drop(merchant_id)
+                self.misses += 1
+                return None
+            self._by_id.move_to_end(merchant_id)
+            self.hits += 1
+            return entry[0]
+
+    def _load(self, db: AsyncSession, merchant: Optional[Merchant]) -> Optional[Merchant]:
+        """Detach a freshly queried merchant and store it"""
+        if merchant is None:
+            return None
+        db.expunge(merchant)
+        with self._lock:
+            self._drop(merchant.id)
+            self._by_id[merchant.id] = (merchant, time.monotonic() + self.ttl_seconds)
+            self._id_by_page[merchant.instagram_page_id] = merchant.id
+            while len(self._by_id) > self.max_size:
+                self._drop(next(iter(self._by_id)))
+        return merchant
+
+    def _drop(self, merchant_id: str) -> None:
+        """Remove an entry and its page index (lock held)"""
+        entry = self._by_id.pop(merchant_id, None)
+        if entry is not None and self._id_by_page.get(entry[0].instagram_page_id) == merchant_id:
+            del self._id_by_page[entry[0].instagram_page_id]
+
+    def apply_usage(self, merchant_id: str, count: int) -> None:
+        """Reflect flushed usage in a cached snapshot without reloading it"""
+        with self._lock:
+            entry = self._by_id.get(merchant_id)
+            if entry is not None:
+                entry[0].monthly_message_count = (entry[0].monthly_message_count or 0) + count
+
+    def invalidate(self, merchant_id: str) -> None:
+        """Forget a merchant after its row has changed"""
+        with self._lock:
+            self._drop(merchant_id)
+
+    def clear(self) -> None:
+        """Drop every cached merchant"""
+        with self._lock:
+            self._by_id.clear()
+            self._id_by_page.clear()
+
+    def stats(self) -> dict:
+        """Cache size and hit rate"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._by_id),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+merchant_cache = MerchantCache(
+    max_size=settings.MERCHANT_CACHE_SIZE,
+    ttl_seconds=settings.MERCHANT_CACHE_TTL
+)
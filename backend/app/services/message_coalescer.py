@@ -0,0 +1,120 @@
+"""
+Message Coalescer for IG-Shop-Agent V2
+Merges rapid-fire DMs from the same customer into a single AI turn
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+FlushHandler = Callable[[List[Dict[Any, Any]]], Awaitable[None]]
+
+class _PendingBatch:
+    """Messages buffered for one conversation"""
+
+    def __init__(self, flush: FlushHandler):
+        self.flush = flush
+        self.events: List[Dict[Any, Any]] = []
+        self.started_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class MessageCoalescer:
+    """Per-conversation debounce window
+
+    The first message of a burst opens a window; every further message
+    restarts it, bounded by max_wait_ms from the first one. The batch flushes
+    when the window expires or max_messages is reached, and every submitter
+    waits until its batch has been handled, failed or was cancelled.
+    """
+
+    def __init__(self, window_ms: int = 1500, max_wait_ms: int = 4000, max_messages: int = 5):
+        self.window = window_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self.max_messages = max_messages
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._flushing: Set[asyncio.Task] = set()  # strong references until each flush finishes
+        self.batches_flushed = 0
+        self.messages_coalesced = 0
+
+    async def submit(self, key: Hashable, message_event: Dict[Any, Any], flush: FlushHandler) -> None:
+        """Buffer a message event and wait for its batch to be flushed"""
+        if self.window <= 0 or self.max_messages <= 1:
+            await flush([message_event])
+            return
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _PendingBatch(flush)
+            self._pending[key] = batch
+        batch.events.append(message_event)
+
+        if len(batch.events) >= self.max_messages:
+            self._fire(key, batch)
+        else:
+            self._schedule(key, batch)
+
+        await asyncio.shield(batch.done)
+
+    def _schedule(self, key: Hashable, batch: _PendingBatch) -> None:
+        """(Re)arm the debounce timer, never past the batch's max wait"""
+        if batch.timer is not None:
+            batch.timer.cancel()
+        remaining = self.max_wait - (time.monotonic() - batch.started_at)
+        delay = max(0.0, min(self.window, remaining))
+        batch.timer = asyncio.get_running_loop().call_later(delay, self._fire, key, batch)
+
+    def _fire(self, key: Hashable, batch: _PendingBatch) -> None:
+        """Detach the batch from its key and run the flush handler"""
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: _PendingBatch) -> None:
+        """Hand the batch over and resolve everyone waiting on it"""
+        self.batches_flushed += 1
+        self.messages_coalesced += len(batch.events) - 1
+        try:
+            await batch.flush(batch.events)
+        except asyncio.CancelledError:
+            batch.done.set_exception(RuntimeError("Coalesced batch flush was cancelled"))
+            raise
+        except Exception as e:
+            batch.done.set_exception(e)
+        else:
+            batch.done.set_result(None)
+        finally:
+            # Anything else (e.g. KeyboardInterrupt) must not leave submitters waiting
+            if not batch.done.done():
+                batch.done.cancel()
+
+    def stats(self) -> dict:
+        """Coalescing counters"""
+        return {
+            "open_windows": len(self._pending),
+            "flushing": len(self._flushing),
+            "batches_flushed": self.batches_flushed,
+            "messages_coalesced": self.messages_coalesced
+        }
+
+def merge_message_events(events: List[Dict[Any, Any]]) -> Dict[Any, Any]:
+    """Fold a burst of message events into one event carrying all their text"""
+    if len(events) == 1:
+        return events[0]
+
+    last = events[-1]
+    texts = [
+        event.get("message", {}).get("text", "")
+        for event in events
+    ]
+    merged = dict(last)
+    merged["message"] = {
+        **last.get("message", {}),
+        "text": "\n".join(text for text in texts if text),
+        "mids": [event.get("message", {}).get("mid") for event in events]
+    }
+    return merged
@@ -0,0 +1,243 @@
+"""
+Message Deduplication for IG-Shop-Agent V2
+Idempotency store keyed on Instagram message IDs so webhook retries are dropped
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.processed_message import ProcessedMessage
+
+PROCESSING = "processing"
+DONE = "done"
+
+class MessageDeduplicator:
+    """Two-level idempotency store for message IDs
+
+    A claim is a "processing" row with a lease; it becomes "done" only once
+    the message was answered or deliberately dropped, and is released when
+    processing fails or is cancelled. A claim whose holder died lapses with
+    its lease, so a redelivery processes the message again (at-least-once).
+    An in-process LRU of done IDs answers most redeliveries without touching
+    the database. Rows older than the TTL are pruned periodically.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 48 * 3600,
+        cache_size: int = 50000,
+        prune_interval: int = 3600,
+        lease_seconds: float = 120.0
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.prune_interval = prune_interval
+        self.lease_seconds = lease_seconds
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.duplicates_dropped = 0
+        self.held_retried = 0
+        self.leases_taken_over = 0
+
+    def _seen_recently(self, mid: str, now: float) -> bool:
+        """LRU lookup; expired entries count as unseen"""
+        with self._lock:
+            expires_at = self._seen.get(mid)
+            if expires_at is None:
+                return False
+            if expires_at < now:
+                del self._seen[mid]
+                return False
+            self._seen.move_to_end(mid)
+            return True
+
+    def _remember(self, mids: Iterable[str], now: float) -> None:
+        """Add done message IDs to the LRU front"""
+        with self._lock:
+            for mid in mids:
+                self._seen[mid] = now + self.ttl_seconds
+                self._seen.move_to_end(mid)
+            while len(self._seen) > self.cache_size:
+                self._seen.popitem(last=False)
+
+    async def claim_many(self, db: AsyncSession, mids: List[str]) -> Tuple[Set[str], Set[str]]:
+        """Lease message IDs for processing
+
+        Returns (fresh, held): fresh IDs are now leased to the caller; held IDs
+        are under another worker's live lease and should be retried later.
+        IDs already done are in neither set.
+        """
+        now = time.time()
+        mids = [mid for mid in mids if mid]
+        candidates = [
+            mid for mid in dict.fromkeys(mids)
+            if not self._seen_recently(mid, now)
+        ]
+        if not candidates:
+            self.duplicates_dropped += len(mids)
+            return set(), set()
+
+        await self._prune_if_due(db, now)
+
+        rows = {
+            row.mid: row
+            for row in await db.execute(
+                select(ProcessedMessage.mid, ProcessedMessage.status, ProcessedMessage.lease_expires_at)
+                .where(ProcessedMessage.mid.in_(candidates))
+            )
+        }
+        fresh: List[str] = []
+        expired: List[str] = []
+        held: Set[str] = set()
+        done: List[str] = []
+        for mid in candidates:
+            row = rows.get(mid)
+            if row is None:
+                fresh.append(mid)
+            elif row.status == DONE:
+                done.append(mid)
+            elif (row.lease_expires_at or 0) > now:
+                held.add(mid)
+            else:
+                expired.append(mid)
+        self._remember(done, now)
+
+        lease_until = now + self.lease_seconds
+        try:
+            db.add_all([
+                ProcessedMessage(mid=mid, status=PROCESSING, lease_expires_at=lease_until)
+                for mid in fresh
+            ])
+            await db.commit()
+        except IntegrityError:
+            # Another worker claimed some of these concurrently; settle one by one
+            await db.rollback()
+            claimed = []
+            for mid in fresh:
+                if await self._claim_one(db, mid, lease_until):
+                    claimed.append(mid)
+                else:
+                    held.add(mid)
+            fresh = claimed
+
+        # Leases whose holder never finished (crash, cancelled worker) are taken over
+        for mid in expired:
+            if await self._take_over(db, mid, now, lease_until):
+                fresh.append(mid)
+                self.leases_taken_over += 1
+            else:
+                held.add(mid)
+
+        with self._lock:
+            self._pending.update(fresh)
+        self.duplicates_dropped += len(mids) - len(fresh) - len(held)
+        self.held_retried += len(held)
+        return set(fresh), held
+
+    async def _claim_one(self, db: AsyncSession, mid: str, lease_until: float) -> bool:
+        """Insert a single message ID; False if it already exists"""
+        try:
+            db.add(ProcessedMessage(mid=mid, status=PROCESSING, lease_expires_at=lease_until))
+            await db.commit()
+            return True
+        except IntegrityError:
+            await db.rollback()
+            return False
+
+    async def _take_over(self, db: AsyncSession, mid: str, now: float, lease_until: float) -> bool:
+        """Renew a lapsed lease for this worker; False if someone else got there first"""
+        result = await db.execute(
+            update(ProcessedMessage)
+            .where(
+                ProcessedMessage.mid == mid,
+                ProcessedMessage.status == PROCESSING,
+                ProcessedMessage.lease_expires_at <= now
+            )
+            .values(lease_expires_at=lease_until)
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    def hand_off(self, mids: Iterable[str]) -> None:
+        """Note that a flush now owns these claims and will settle them itself"""
+        with self._lock:
+            self._pending.difference_update(mids)
+
+    async def mark_done(self, db: AsyncSession, mids: Iterable[str]) -> None:
+        """Settle claims once their messages were answered or deliberately dropped"""
+        mids = [mid for mid in mids if mid]
+        if not mids:
+            return
+        try:
+            await db.execute(
+                update(ProcessedMessage)
+                .where(ProcessedMessage.mid.in_(mids))
+                .values(status=DONE, lease_expires_at=None)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"⚠️ Failed to mark message IDs done: {e}")
+            return
+        with self._lock:
+            self._pending.difference_update(mids)
+        self._remember(mids, time.time())
+
+    async def release(self, db: AsyncSession, mids: Iterable[str]) -> None:
+        """Drop processing claims so a retried payload processes them again"""
+        mids = [mid for mid in mids if mid]
+        if not mids:
+            return
+        with self._lock:
+            self._pending.difference_update(mids)
+            for mid in mids:
+                self._seen.pop(mid, None)
+        try:
+            await db.rollback()
+            await db.execute(
+                delete(ProcessedMessage)
+                .where(ProcessedMessage.mid.in_(mids), ProcessedMessage.status == PROCESSING)
+            )
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f"⚠️ Failed to release message IDs: {e}")
+
+    async def abandon(self, db: AsyncSession, mids: Iterable[str]) -> None:
+        """Release the claims among mids that no flush has taken over"""
+        with self._lock:
+            unowned = [mid for mid in mids if mid in self._pending]
+        await self.release(db, unowned)
+
+    async def _prune_if_due(self, db: AsyncSession, now: float) -> None:
+        """Delete idempotency rows older than the TTL at most once per interval"""
+        if now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        try:
+            result = await db.execute(delete(ProcessedMessage).where(ProcessedMessage.created_at < cutoff))
+            await db.commit()
+            if result.rowcount:
+                print(f"🧹 Pruned {result.rowcount} expired message IDs")
+        except Exception as e:
+            await db.rollback()
+            print(f"⚠️ Message ID pruning failed: {e}")
+
+    def stats(self) -> dict:
+        """Deduplication counters"""
+        return {
+            "cached_ids": len(self._seen),
+            "pending_claims": len(self._pending),
+            "duplicates_dropped": self.duplicates_dropped,
+            "held_retried": self.held_retried,
+            "leases_taken_over": self.leases_taken_over
+        }
@@ -0,0 +1,150 @@
+"""
+Model Router for IG-Shop-Agent V2
+Cheap message classification that sends simple turns to a smaller, faster model
+"""
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+from .fast_path import ARABIC_LETTERS, detect_intents, named_products
+from .llm_resilience import LatencyTracker
+from .text_normalizer import normalize_text, tokenize
+
+SIMPLE = "simple"
+STANDARD = "standard"
+COMPLEX = "complex"
+
+# Stemmed tokens of acknowledgements and greetings ("thanks!", "ok", "شكرا جزيلا")
+SMALL_TALK_WORDS = frozenset({
+    "thank", "thanks", "thx", "ty", "you", "so", "much", "very", "ok", "okay", "k", "great", "cool", "nice",
+    "perfect", "awesome", "hi", "hello", "hey", "bye", "good", "morning", "evening", "night", "yes", "no", "sure",
+    "شكرا", "جزيلا", "مشكور", "مشكورين", "تمام", "طيب", "اوكي", "ممتاز", "مرحبا", "اهلا", "هلا", "سلام", "عليكم",
+    "مع", "سلامه", "يعطيك", "عافيه", "نعم", "لا", "اه", "صباح", "مساء", "خير", "نور",
+})
+
+# Patterns run on normalize_text() output
+ORDER_DETAILS = re.compile(
+    r"\b(?:order\w*|buy|purchase|checkout|address|deliver\w*|shipping|ship|quantity|pieces|pcs|cash on delivery|cod)\b"
+    r"|اطلب|طلب|اشتري|عنوان|توصيل|شحن|كميه|حبات|قطع|الدفع عند"
+)
+PHONE_NUMBER = re.compile(r"\+?\d[\d\s-]{6,}\d")
+COMPARISON = re.compile(
+    r"\b(?:compare|comparison|difference|differences|vs|versus|better|which one)\b"
+    r"|الفرق|فرق|مقارنه|قارن|افضل|احسن|ايهما|اي واحد"
+)
+
+LONG_MESSAGE_TOKENS = 40         # longer English messages usually carry several requests
+LONG_ARABIC_MESSAGE_TOKENS = 30  # Arabic packs more into each word
+LOOKUP_MAX_TOKENS = 12
+NAMED_PRODUCT_COVERAGE = 0.75    # share of a product name's tokens the message must contain
+
+@dataclass
+class Route:
+    """Which model a message goes to and why"""
+    complexity: str
+    model: str
+    tier: str
+    language: str
+    reason: str
+
+def classify(merchant: Merchant, message_text: str, previous_user_message: Optional[str] = None) -> Tuple[str, str, str]:
+    """(complexity, reason, language) from length, intent, language and order details"""
+    normalized = normalize_text(message_text)
+    tokens = tokenize(message_text, keep_stopwords=True)
+    language = "ar" if ARABIC_LETTERS.search(message_text) else "en"
+
+    if ORDER_DETAILS.search(normalized) or PHONE_NUMBER.search(normalized):
+        return COMPLEX, "order", language
+    # "ok" or an address in reply to an order question continues the order
+    if previous_user_message and ORDER_DETAILS.search(normalize_text(previous_user_message)):
+        return COMPLEX, "order_follow_up", language
+    # Most of a name must appear, so a shared word like "product" does not count as a second product
+    named = [product for coverage, product in named_products(merchant, message_text) if coverage >= NAMED_PRODUCT_COVERAGE]
+    if len(named) >= 2 or (named and COMPARISON.search(normalized)):
+        return COMPLEX, "comparison", language
+    long_tokens = LONG_ARABIC_MESSAGE_TOKENS if language == "ar" else LONG_MESSAGE_TOKENS
+    if len(tokens) > long_tokens or message_text.count("?") + message_text.count("؟") >= 3:
+        return COMPLEX, "long", language
+
+    if tokens and len(tokens) <= 6 and all(token in SMALL_TALK_WORDS for token in tokens):
+        return SIMPLE, "small_talk", language
+    if len(detect_intents(normalized)) == 1 and len(tokens) <= LOOKUP_MAX_TOKENS:
+        return SIMPLE, "lookup", language
+    return STANDARD, "default", language
+
+class ModelRouter:
+    """Picks the model for each AI call from the tier's MODEL_ROUTES
+
+    Classification is a few regexes and one BM25 lookup, well under a
+    millisecond. Decisions are counted per tier, complexity and reason, and
+    latencies are tracked per routed model.
+    """
+
+    def __init__(self, routes: Dict[str, Dict[str, str]], large_model: str, small_model: str, enabled: bool = True):
+        self.routes = routes
+        self.models = {"large": large_model, "small": small_model}
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.reasons: Dict[str, int] = defaultdict(int)
+        self.languages: Dict[str, int] = defaultdict(int)
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.first_token_latencies: Dict[str, LatencyTracker] = {}
+
+    def route(self, merchant: Merchant, message_text: str, turns: List[Tuple[str, str]]) -> Route:
+        """The model for this message, counted in the decision stats"""
+        tier = merchant.subscription_tier if merchant.subscription_tier in self.routes else "starter"
+        if not self.enabled:
+            return Route(STANDARD, self.models["large"], tier, "", "disabled")
+        previous = next((content for role, content in reversed(turns) if role == "user"), None)
+        complexity, reason, language = classify(merchant, message_text, previous)
+        size = self.routes.get(tier, {}).get(complexity, "large")
+        route = Route(complexity, self.models.get(size, size), tier, language, reason)
+        with self._lock:
+            self.decisions[tier][f"{complexity}:{route.model}"] += 1
+            self.reasons[reason] += 1
+            self.languages[language] += 1
+        return route
+
+    def record(self, route: Route, latency: float, first_token_latency: Optional[float] = None) -> None:
+        """Latency of a call made for this route (fallback models included)"""
+        with self._lock:
+            tracker = self.latencies.get(route.model)
+            if tracker is None:
+                tracker = self.latencies[route.model] = LatencyTracker(size=500, min_samples=1)
+            tracker.add(latency)
+            if first_token_latency is not None:
+                tracker = self.first_token_latencies.get(route.model)
+                if tracker is None:
+                    tracker = self.first_token_latencies[route.model] = LatencyTracker(size=500, min_samples=1)
+                tracker.add(first_token_latency)
+
+    def stats(self) -> dict:
+        """Decisions per tier and latency percentiles per routed model"""
+        with self._lock:
+            models = {}
+            for model, tracker in self.latencies.items():
+                first_token = self.first_token_latencies.get(model)
+                models[model] = {
+                    "p50_latency": tracker.percentile(0.5),
+                    "p95_latency": tracker.percentile(0.95),
+                    "p95_first_token": first_token.percentile(0.95) if first_token else None
+                }
+            return {
+                "enabled": self.enabled,
+                "decisions": {tier: dict(counts) for tier, counts in self.decisions.items()},
+                "reasons": dict(self.reasons),
+                "languages": dict(self.languages),
+                "models": models
+            }
+
+model_router = ModelRouter(
+    settings.MODEL_ROUTES,
+    large_model=settings.OPENAI_MODEL,
+    small_model=settings.OPENAI_SMALL_MODEL,
+    enabled=settings.ENABLE_MODEL_ROUTING
+)
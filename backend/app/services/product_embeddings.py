@@ -0,0 +1,352 @@
+"""
+Product Embeddings for IG-Shop-Agent V2
+Batched catalog embeddings in a shared vector store with cosine top-k search
+"""
+import asyncio
+import glob
+import hashlib
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.merchant import Merchant
+from .deadline import Deadline
+from .llm_client import LLMClient, LLMError, llm_client
+from .prompt_compiler import compact_json, merchant_version
+from .text_normalizer import tokenize
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a dot product is the cosine similarity"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+def product_text(product: Dict[str, Any]) -> str:
+    """The text embedded for a product"""
+    return ". ".join(str(product.get(field) or "") for field in ("name", "category", "description"))
+
+def reciprocal_rank_fusion(rankings: List[List[int]], top_k: int, k: int = 60) -> List[int]:
+    """Merge ranked position lists, rewarding items ranked high in any of them"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (k + rank + 1)
+    return [position for position, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]]
+
+class Embedder(ABC):
+    """Turns texts into unit-length float32 vectors"""
+    name = "embedder"
+    dimensions = 0
+
+    @abstractmethod
+    async def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """One row per text"""
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embedder: signed feature hashing of tokens and character trigrams
+
+    Needs no network or model files, so it works offline and in tests; the
+    trigrams give some tolerance for spelling and morphology differences.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _features(self, value: str) -> List[Tuple[str, float]]:
+        """Weighted token and trigram features"""
+        features: List[Tuple[str, float]] = []
+        for token in tokenize(value):
+            features.append((token, 1.0))
+            padded = f"#{token}#"
+            features.extend((padded[i:i + 3], 0.5) for i in range(len(padded) - 2))
+        return features
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, value in enumerate(texts):
+            for feature, weight in self._features(value):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+                sign = 1.0 if digest >> 63 else -1.0
+                matrix[row, digest % self.dimensions] += sign * weight
+        return normalize_rows(matrix)
+
+    async def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        return self.embed_sync(texts)
+
+class OpenAIEmbedder(Embedder):
+    """OpenAI embeddings requested in batches through the shared LLM client (and its governor)"""
+
+    def __init__(self, llm: LLMClient, model: str, dimensions: int = 256, batch_size: int = 128):
+        self.llm = llm
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.name = f"{model}-{dimensions}"
+
+    async def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            rows.extend(await self.llm.embed(
+                texts[start:start + self.batch_size], model=self.model, dimensions=self.dimensions, timeout=timeout
+            ))
+        return normalize_rows(np.asarray(rows, dtype=np.float32).reshape(len(texts), self.dimensions))
+
+class NumpyVectorStore:
+    """One float32 matrix file per merchant, memory-mapped read-only
+
+    Files are written atomically and named after the catalog tag, so every
+    worker process maps the same pages from the OS cache instead of holding
+    its own copy, and a rebuilt catalog simply appears under a new name.
+    """
+
+    def __init__(self, directory: str, max_open: int = 500):
+        self.directory = directory
+        self.max_open = max_open
+        self._open: "OrderedDict[str, Tuple[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, merchant_id: str, tag: str) -> str:
+        return os.path.join(self.directory, f"{re.sub(r'[^A-Za-z0-9_-]', '_', merchant_id)}-{tag}.npy")
+
+    def _matrix(self, merchant_id: str, tag: str) -> Optional[np.ndarray]:
+        """Mapped matrix for the tag, opening the file on first use"""
+        with self._lock:
+            entry = self._open.get(merchant_id)
+            if entry is not None and entry[0] == tag:
+                self._open.move_to_end(merchant_id)
+                return entry[1]
+        path = self._path(merchant_id, tag)
+        if not os.path.exists(path):
+            return None
+        matrix = np.load(path, mmap_mode="r")
+        with self._lock:
+            self._open[merchant_id] = (tag, matrix)
+            self._open.move_to_end(merchant_id)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return matrix
+
+    def has(self, merchant_id: str, tag: str) -> bool:
+        return self._matrix(merchant_id, tag) is not None
+
+    def save(self, merchant_id: str, tag: str, matrix: np.ndarray) -> None:
+        """Atomically write the matrix and remove the merchant's older files"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(merchant_id, tag)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as handle:
+            np.save(handle, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(temp_path, path)
+        for stale in glob.glob(self._path(merchant_id, "*")):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        with self._lock:
+            self._open.pop(merchant_id, None)
+
+    def search(self, merchant_id: str, tag: str, query: np.ndarray, top_k: int) -> List[int]:
+        """Rows with the highest cosine similarity (best first)"""
+        matrix = self._matrix(merchant_id, tag)
+        if matrix is None or not len(matrix):
+            return []
+        scores = matrix @ query
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return [int(row) for row in best[np.argsort(-scores[best], kind="stable")]]
+
+class PgVectorStore:
+    """Embeddings in a PostgreSQL table searched with the pgvector cosine operator"""
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self._ready = False
+
+    def _ensure_table(self, db) -> None:
+        if self._ready:
+            return
+        db.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        db.execute(text(
+            "CREATE TABLE IF NOT EXISTS product_embeddings ("
+            "merchant_id VARCHAR NOT NULL, tag VARCHAR NOT NULL, position INTEGER NOT NULL, "
+            f"embedding vector({self.dimensions}) NOT NULL, PRIMARY KEY (merchant_id, position))"
+        ))
+        db.commit()
+        self._ready = True
+
+    @staticmethod
+    def _literal(vector: np.ndarray) -> str:
+        return "[" + ",".join(f"{value:.6f}" for value in vector) + "]"
+
+    def has(self, merchant_id: str, tag: str) -> bool:
+        with SessionLocal() as db:
+            self._ensure_table(db)
+            return db.execute(
+                text("SELECT 1 FROM product_embeddings WHERE merchant_id = :merchant_id AND tag = :tag LIMIT 1"),
+                {"merchant_id": merchant_id, "tag": tag}
+            ).first() is not None
+
+    def save(self, merchant_id: str, tag: str, matrix: np.ndarray) -> None:
+        with SessionLocal() as db:
+            self._ensure_table(db)
+            db.execute(text("DELETE FROM product_embeddings WHERE merchant_id = :merchant_id"), {"merchant_id": merchant_id})
+            if len(matrix):
+                db.execute(
+                    text(
+                        "INSERT INTO product_embeddings (merchant_id, tag, position, embedding) "
+                        "VALUES (:merchant_id, :tag, :position, CAST(:embedding AS vector))"
+                    ),
+                    [
+                        {"merchant_id": merchant_id, "tag": tag, "position": row, "embedding": self._literal(vector)}
+                        for row, vector in enumerate(matrix)
+                    ]
+                )
+            db.commit()
+
+    def search(self, merchant_id: str, tag: str, query: np.ndarray, top_k: int) -> List[int]:
+        with SessionLocal() as db:
+            rows = db.execute(
+                text(
+                    "SELECT position FROM product_embeddings WHERE merchant_id = :merchant_id AND tag = :tag "
+                    "ORDER BY embedding <=> CAST(:query AS vector) LIMIT :top_k"
+                ),
+                {"merchant_id": merchant_id, "tag": tag, "query": self._literal(query), "top_k": top_k}
+            ).all()
+        return [row[0] for row in rows]
+
+class ProductEmbeddings:
+    """Per-merchant catalog embeddings, rebuilt in the background when a catalog changes
+
+    Stored matrices are tagged with a hash of the embedder and the catalog
+    contents, so profile-only edits never re-embed and workers agree on which
+    matrix is current. Messages only embed their own query, within what the
+    message's deadline can spare; a catalog without a stored matrix is
+    scheduled for one batched build and answered lexically in the meantime.
+    """
+
+    def __init__(self, embedder: Embedder, store: Any, max_merchants: int = 500):
+        self.embedder = embedder
+        self.store = store
+        self.max_merchants = max_merchants
+        self._tags: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._building: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.builds = 0
+        self.searches = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def _tag(self, merchant_id: str, version: str, products: List[Dict[str, Any]]) -> str:
+        """Content tag of a catalog, memoized per merchant version"""
+        entry = self._tags.get(merchant_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        digest = hashlib.sha1(f"{self.embedder.name}\n{compact_json(products)}".encode("utf-8")).hexdigest()[:16]
+        self._tags[merchant_id] = (version, digest)
+        self._tags.move_to_end(merchant_id)
+        while len(self._tags) > self.max_merchants:
+            self._tags.popitem(last=False)
+        return digest
+
+    def schedule(self, merchant: Merchant) -> None:
+        """Start a background batch build of the merchant's current catalog"""
+        if merchant.id in self._building:
+            return
+        products = list(merchant.product_catalog or [])
+        tag = self._tag(merchant.id, merchant_version(merchant), products)
+        self._building.add(merchant.id)
+        task = asyncio.create_task(self._build(merchant.id, tag, products))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _build(self, merchant_id: str, tag: str, products: List[Dict[str, Any]]) -> None:
+        """Embed the whole catalog in batches and store it"""
+        try:
+            if await asyncio.to_thread(self.store.has, merchant_id, tag):
+                return
+            matrix = await self.embedder.embed([product_text(product) for product in products])
+            await asyncio.to_thread(self.store.save, merchant_id, tag, matrix)
+            self.builds += 1
+            print(f"🧭 Embedded {len(products)} products for merchant {merchant_id}")
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Product embedding build failed for merchant {merchant_id}: {e}")
+        finally:
+            self._building.discard(merchant_id)
+
+    async def search(
+        self,
+        merchant: Merchant,
+        query: str,
+        top_k: int,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[List[int]]:
+        """Catalog positions most similar to the query, or None when semantic search is unavailable
+
+        The query embedding may only use time the deadline can spare after
+        the model call and the send; with too little of it left the message
+        is answered from lexical retrieval alone.
+        """
+        timeout = None
+        if deadline is not None:
+            timeout = deadline.timeout(
+                settings.EMBEDDING_QUERY_TIMEOUT,
+                reserve=settings.DEADLINE_MIN_MODEL_SECONDS + settings.DEADLINE_SEND_RESERVE
+            )
+            if timeout < settings.EMBEDDING_QUERY_MIN_SECONDS:
+                self.skipped += 1
+                return None
+        products = merchant.product_catalog or []
+        tag = self._tag(merchant.id, merchant_version(merchant), products)
+        if not await asyncio.to_thread(self.store.has, merchant.id, tag):
+            self.schedule(merchant)
+            return None
+        try:
+            query_vector = (await self.embedder.embed([query], timeout=timeout))[0]
+        except LLMError as e:
+            self.errors += 1
+            print(f"⚠️ Query embedding failed: {e}")
+            return None
+        self.searches += 1
+        return await asyncio.to_thread(self.store.search, merchant.id, tag, query_vector, top_k)
+
+    def stats(self) -> dict:
+        """Build and search counters"""
+        return {
+            "embedder": self.embedder.name,
+            "builds": self.builds,
+            "building": len(self._building),
+            "searches": self.searches,
+            "skipped": self.skipped,
+            "errors": self.errors
+        }
+
+def create_product_embeddings() -> ProductEmbeddings:
+    """Build the registry from the configured embedder and vector backend"""
+    if settings.EMBEDDING_PROVIDER == "openai":
+        embedder: Embedder = OpenAIEmbedder(
+            llm_client,
+            model=settings.EMBEDDING_MODEL,
+            dimensions=settings.EMBEDDING_DIMENSIONS,
+            batch_size=settings.EMBEDDING_BATCH_SIZE
+        )
+    else:
+        embedder = HashingEmbedder(dimensions=settings.EMBEDDING_DIMENSIONS)
+
+    if settings.VECTOR_BACKEND == "pgvector":
+        store: Any = PgVectorStore(dimensions=settings.EMBEDDING_DIMENSIONS)
+    else:
+        store = NumpyVectorStore(settings.EMBEDDINGS_DIR, max_open=settings.PRODUCT_INDEX_CACHE_SIZE)
+    return ProductEmbeddings(embedder, store, max_merchants=settings.PRODUCT_INDEX_CACHE_SIZE)
+
+product_embeddings = create_product_embeddings()
@@ -0,0 +1,196 @@
+"""
+Product Retrieval Index for IG-Shop-Agent V2
+Per-merchant BM25 index so prompts carry only the products relevant to a message
+"""
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+from .prompt_compiler import compact_json, merchant_version
+from .text_normalizer import tokenize
+
+SEARCH_FIELDS: Tuple[Tuple[str, int], ...] = (
+    ("name", 3),         # field weights: repeat name tokens so they dominate
+    ("category", 2),
+    ("description", 1),
+)
+
+def product_terms(product: Dict[str, Any]) -> Counter:
+    """Weighted term frequencies over name, category and description"""
+    terms: Counter = Counter()
+    for field, weight in SEARCH_FIELDS:
+        for token in tokenize(str(product.get(field) or "")):
+            terms[token] += weight
+    return terms
+
+class ProductIndex:
+    """BM25 inverted index over one merchant's catalog
+
+    Documents have stable internal ids; _order maps catalog positions to ids so
+    updates and deletions by position (as the API exposes them) stay O(postings
+    of that product) instead of re-indexing the catalog.
+    """
+
+    def __init__(self, products: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._next_id = 0
+        self._order: List[int] = []
+        self._terms: Dict[int, Counter] = {}
+        self._lengths: Dict[int, int] = {}
+        self._lines: Dict[int, str] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        for product in products:
+            self.add(product)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _index(self, product: Dict[str, Any]) -> int:
+        """Index a product under a new document id"""
+        doc_id = self._next_id
+        self._next_id += 1
+        terms = product_terms(product)
+        self._terms[doc_id] = terms
+        self._lengths[doc_id] = sum(terms.values())
+        self._total_length += self._lengths[doc_id]
+        self._lines[doc_id] = compact_json(product)
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        return doc_id
+
+    def _unindex(self, doc_id: int) -> None:
+        """Remove a document's postings"""
+        for term in self._terms.pop(doc_id):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+        self._lines.pop(doc_id)
+
+    def add(self, product: Dict[str, Any]) -> None:
+        """Append a product to the catalog"""
+        self._order.append(self._index(product))
+
+    def update(self, position: int, product: Dict[str, Any]) -> None:
+        """Replace the product at a catalog position"""
+        self._unindex(self._order[position])
+        self._order[position] = self._index(product)
+
+    def delete(self, position: int) -> None:
+        """Remove the product at a catalog position"""
+        self._unindex(self._order.pop(position))
+
+    def search(self, query: str, top_k: int) -> List[int]:
+        """Catalog positions of the best BM25 matches (best first)"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self._order:
+            return []
+
+        doc_count = len(self._order)
+        average_length = self._total_length / doc_count or 1.0
+        scores: Dict[int, float] = {}
+        for term in query_terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        if not scores:
+            return []
+        position_of = {doc_id: position for position, doc_id in enumerate(self._order)}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], position_of[item[0]]))
+        return [position_of[doc_id] for doc_id, _ in ranked[:top_k]]
+
+    def lines(self, positions: List[int]) -> List[str]:
+        """Pre-rendered compact JSON lines for catalog positions"""
+        return [self._lines[self._order[position]] for position in positions]
+
+class ProductIndexRegistry:
+    """Bounded per-merchant registry of product indexes keyed on merchant version"""
+
+    def __init__(self, max_merchants: int = 500):
+        self.max_merchants = max_merchants
+        self._indexes: "OrderedDict[str, Tuple[str, ProductIndex]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, merchant: Merchant) -> ProductIndex:
+        """Index for the merchant's current catalog, rebuilt on a version mismatch"""
+        version = merchant_version(merchant)
+        with self._lock:
+            entry = self._indexes.get(merchant.id)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(merchant.id)
+                return entry[1]
+
+        index = ProductIndex(merchant.product_catalog or [])
+        with self._lock:
+            self.builds += 1
+            self._store(merchant.id, version, index)
+        return index
+
+    def _store(self, merchant_id: str, version: str, index: ProductIndex) -> None:
+        """Insert an index and evict the least recently used ones (lock held)"""
+        self._indexes[merchant_id] = (version, index)
+        self._indexes.move_to_end(merchant_id)
+        while len(self._indexes) > self.max_merchants:
+            self._indexes.popitem(last=False)
+
+    def _apply(self, merchant_id: str, previous_version: str, version: str, change) -> None:
+        """Apply an incremental change to an index built from the previous version"""
+        with self._lock:
+            entry = self._indexes.get(merchant_id)
+            if entry is None:
+                return
+            if entry[0] != previous_version:
+                # Built from an older catalog (e.g. changed by another worker); rebuild lazily
+                del self._indexes[merchant_id]
+                return
+            try:
+                change(entry[1])
+            except (IndexError, KeyError):
+                del self._indexes[merchant_id]
+                return
+            self._store(merchant_id, version, entry[1])
+
+    def on_product_added(self, merchant_id: str, previous_version: str, version: str, product: Dict[str, Any]) -> None:
+        """Incrementally index a newly added product"""
+        self._apply(merchant_id, previous_version, version, lambda index: index.add(product))
+
+    def on_product_updated(
+        self, merchant_id: str, previous_version: str, version: str, position: int, product: Dict[str, Any]
+    ) -> None:
+        """Incrementally re-index an updated product"""
+        self._apply(merchant_id, previous_version, version, lambda index: index.update(position, product))
+
+    def on_product_deleted(self, merchant_id: str, previous_version: str, version: str, position: int) -> None:
+        """Incrementally drop a deleted product"""
+        self._apply(merchant_id, previous_version, version, lambda index: index.delete(position))
+
+    def rebase(self, merchant_id: str, previous_version: str, version: str) -> None:
+        """Keep an index valid across a merchant change that did not touch the catalog"""
+        self._apply(merchant_id, previous_version, version, lambda index: None)
+
+    def invalidate(self, merchant_id: str) -> None:
+        """Drop a merchant's index"""
+        with self._lock:
+            self._indexes.pop(merchant_id, None)
+
+    def stats(self) -> dict:
+        """Registry size and rebuild count"""
+        return {
+            "merchants": len(self._indexes),
+            "builds": self.builds
+        }
+
+product_indexes = ProductIndexRegistry(max_merchants=settings.PRODUCT_INDEX_CACHE_SIZE)
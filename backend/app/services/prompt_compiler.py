@@ -0,0 +1,148 @@
+"""
+Prompt Compiler for IG-Shop-Agent V2
+Builds each merchant's system prompt once per merchant version and caches it
+"""
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+
+DEFAULT_PRODUCTS: List[Dict[str, Any]] = [
+    {
+        "name": "Sample Product",
+        "description": "A great product for customers",
+        "price": "Contact for pricing",
+        "availability": "In stock"
+    }
+]
+
+def compact_json(value: Any) -> str:
+    """Deterministic JSON without whitespace or escaped non-ASCII (fewer prompt tokens)"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+def merchant_version(merchant: Merchant) -> str:
+    """Version tag that changes whenever the merchant's profile or catalog is saved"""
+    return merchant.updated_at.isoformat() if merchant.updated_at else "0"
+
+def render_working_hours(working_hours: Any) -> str:
+    """Working hours as 'day: hours' pairs in their stored order"""
+    if isinstance(working_hours, dict):
+        return "; ".join(f"{day}: {hours}" for day, hours in working_hours.items())
+    return compact_json(working_hours)
+
+@dataclass
+class CompiledPrompt:
+    """A merchant's system prompt split around its product catalog section"""
+    head: str
+    tail: str
+    product_lines: List[str]
+    full: str
+
+    @property
+    def product_count(self) -> int:
+        return len(self.product_lines)
+
+    def with_products(self, product_lines: List[str]) -> str:
+        """System prompt carrying only the given products instead of the whole catalog"""
+        return (
+            f"{self.head}PRODUCT CATALOG (the {len(product_lines)} of {self.product_count} products "
+            f"most relevant to this message, one JSON object per line):\n"
+            + "\n".join(product_lines)
+            + self.tail
+        )
+
+class PromptCompiler:
+    """Bounded LRU of compiled system prompts keyed on (merchant id, version)"""
+
+    def __init__(self, max_size: int = 500):
+        self.max_size = max_size
+        self._prompts: "OrderedDict[str, Tuple[str, CompiledPrompt]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, merchant: Merchant) -> CompiledPrompt:
+        """Return the merchant's compiled prompt, building it only on a version change"""
+        version = merchant_version(merchant)
+        with self._lock:
+            entry = self._prompts.get(merchant.id)
+            if entry is not None and entry[0] == version:
+                self._prompts.move_to_end(merchant.id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        prompt = self.render(merchant)
+        with self._lock:
+            self._prompts[merchant.id] = (version, prompt)
+            self._prompts.move_to_end(merchant.id)
+            while len(self._prompts) > self.max_size:
+                self._prompts.popitem(last=False)
+        return prompt
+
+    def render(self, merchant: Merchant) -> CompiledPrompt:
+        """Render the system prompt from merchant settings"""
+        products = merchant.product_catalog or DEFAULT_PRODUCTS
+
+        hours_info = "We're available during business hours"
+        if merchant.working_hours:
+            hours_info = f"Our working hours: {render_working_hours(merchant.working_hours)}"
+
+        head = f"""You are a helpful AI assistant for {merchant.business_name}, an Instagram business.
+
+BUSINESS INFORMATION:
+- Business Name: {merchant.business_name}
+- Category: {merchant.business_category or 'General Business'}
+- Description: {merchant.business_description or 'A great business serving customers'}
+- Instagram: @{merchant.page_name}
+- {hours_info}
+
+COMMUNICATION STYLE:
+- Be {merchant.ai_personality or 'friendly'} and professional
+- Respond in {merchant.default_language or 'Arabic'} primarily, fallback to {merchant.fallback_language or 'English'}
+- Keep responses concise and helpful
+- Always be polite and customer-focused
+
+"""
+        tail = f"""
+
+CAPABILITIES:
+- Answer questions about products and services
+- Provide pricing information
+- Help with orders and inquiries
+- Give business information
+- Handle customer service requests
+
+GUIDELINES:
+- If asked about products, refer to the catalog above
+- For orders, collect: product name, quantity, customer info, delivery address
+- If you can't help, politely direct them to contact us directly
+- Never make up information not provided in the context
+- Be helpful but don't overpromise
+
+IMPORTANT: Keep responses under {settings.REPLY_MAX_CHARS} characters for Instagram DM limits."""
+
+        product_lines = [compact_json(product) for product in products]
+        full = f"{head}PRODUCT CATALOG (one JSON object per line):\n" + "\n".join(product_lines) + tail
+        return CompiledPrompt(head=head, tail=tail, product_lines=product_lines, full=full)
+
+    def invalidate(self, merchant_id: str) -> None:
+        """Drop a merchant's compiled prompt"""
+        with self._lock:
+            self._prompts.pop(merchant_id, None)
+
+    def stats(self) -> dict:
+        """Cache size and hit rate"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._prompts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+prompt_compiler = PromptCompiler(max_size=settings.PROMPT_CACHE_SIZE)
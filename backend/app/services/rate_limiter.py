@@ -0,0 +1,315 @@
+"""
+Rate Limiter for IG-Shop-Agent V2
+Token buckets per merchant and client IP, in process or shared across workers (SQLite or Redis)
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+try:
+    import redis.asyncio as redis_asyncio
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis_asyncio = None
+    REDIS_AVAILABLE = False
+
+@dataclass
+class RateDecision:
+    """Outcome of one bucket check"""
+    allowed: bool
+    retry_after: float  # seconds until the request would be allowed (0 when allowed)
+    remaining: float
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value: whole seconds, at least 1"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+def refill(tokens: float, elapsed: float, rate: float, capacity: float, cost: float) -> Tuple[float, RateDecision]:
+    """New token count and decision for a bucket last seen elapsed seconds ago"""
+    tokens = min(capacity, tokens + max(0.0, elapsed) * rate)
+    if tokens >= cost:
+        tokens = min(capacity, tokens - cost)  # a negative cost (refund) never overfills the bucket
+        return tokens, RateDecision(True, 0.0, tokens)
+    return tokens, RateDecision(False, (cost - tokens) / rate if rate > 0 else float("inf"), tokens)
+
+class BucketStore(ABC):
+    """Where bucket state lives; take() is one O(1) read-modify-write"""
+    name = "base"
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> RateDecision:
+        """Refill key's bucket and take cost tokens if it holds them"""
+
+    @abstractmethod
+    async def drain(self, key: str, tokens: float) -> None:
+        """Set a bucket's tokens as of now (negative tokens must be refilled before the next take)"""
+
+    async def close(self) -> None:
+        """Release connections held by the store"""
+
+class MemoryBucketStore(BucketStore):
+    """Buckets in this process only (limits are per worker)"""
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take_sync(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> RateDecision:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                # Dropping the least recently used bucket only ever refills it
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            bucket[0], decision = refill(bucket[0], now - bucket[1], rate, capacity, cost)
+            bucket[1] = now
+        return decision
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> RateDecision:
+        return self.take_sync(key, rate, capacity, cost)
+
+    def drain_sync(self, key: str, tokens: float) -> None:
+        with self._lock:
+            self._buckets[key] = [tokens, time.monotonic()]
+            self._buckets.move_to_end(key)
+
+    async def drain(self, key: str, tokens: float) -> None:
+        self.drain_sync(key, tokens)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class SQLiteBucketStore(BucketStore):
+    """Buckets in a local SQLite file, shared by every worker process on the host
+
+    Each check is a primary-key read and upsert inside BEGIN IMMEDIATE, so
+    concurrent workers serialize on the file lock. The blocking sqlite calls
+    run on one dedicated thread that owns the connection, never on the event
+    loop. Bucket state is disposable, so commits skip fsync.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str, prune_every: int = 10000):
+        self.path = path
+        self.prune_every = prune_every
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._checks = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA busy_timeout=2000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        """Run fn on the store's thread; one thread keeps checks serialized"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-buckets")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _take(self, key: str, rate: float, capacity: float, cost: float) -> RateDecision:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens, decision = refill(tokens, now - updated, rate, capacity, cost)
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            self._checks += 1
+            if self._checks % self.prune_every == 0:
+                # Buckets idle for an hour are full again; their rows can go
+                conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - 3600,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> RateDecision:
+        return await self._run(self._take, key, rate, capacity, cost)
+
+    def _drain(self, key: str, tokens: float) -> None:
+        self._connection().execute(
+            "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+            (key, tokens, time.time())
+        )
+
+    async def drain(self, key: str, tokens: float) -> None:
+        await self._run(self._drain, key, tokens)
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+# Refill and take atomically on the server, using the server clock
+_REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after), tostring(tokens)}
+"""
+
+_REDIS_DRAIN = """
+local clock = redis.call('TIME')
+redis.call('HSET', KEYS[1], 'tokens', ARGV[1], 'updated', tonumber(clock[1]) + tonumber(clock[2]) / 1000000)
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+"""
+
+class RedisBucketStore(BucketStore):
+    """Buckets in Redis (or a Redis-compatible server), shared across hosts
+
+    One script call per check; keys expire once their bucket would be full.
+    """
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "igshop:rate:"):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("redis package is not installed")
+        self.prefix = prefix
+        # Short timeouts: when Redis is unreachable checks fall back instead of stalling requests
+        self._client = redis_asyncio.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self._script = self._client.register_script(_REDIS_TAKE)
+        self._drain_script = self._client.register_script(_REDIS_DRAIN)
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> RateDecision:
+        allowed, retry_after, remaining = await self._script(keys=[self.prefix + key], args=[rate, capacity, cost])
+        return RateDecision(bool(allowed), float(retry_after), float(remaining))
+
+    async def drain(self, key: str, tokens: float) -> None:
+        await self._drain_script(keys=[self.prefix + key], args=[tokens])
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+class RateLimiter:
+    """Token-bucket checks against a shared store, falling back to in-process buckets
+
+    A bucket holds up to capacity tokens and refills at rate tokens per
+    second; each request takes one. When the shared store fails, checks
+    use the in-process buckets so a store outage never blocks traffic.
+    """
+
+    def __init__(self, store: BucketStore, fallback: Optional[MemoryBucketStore] = None):
+        self.store = store
+        self.fallback = fallback or (store if isinstance(store, MemoryBucketStore) else MemoryBucketStore())
+        self.checks: Dict[str, int] = {}
+        self.limited: Dict[str, int] = {}
+        self.store_errors = 0
+
+    def _store_failed(self, error: Exception) -> None:
+        self.store_errors += 1
+        if self.store_errors == 1 or self.store_errors % 1000 == 0:
+            print(f"⚠️ Rate limit store unavailable, using in-process buckets: {error}")
+
+    async def check(
+        self,
+        scope: str,
+        subject: str,
+        requests: float,
+        window: float,
+        cost: float = 1.0,
+        burst: Optional[float] = None
+    ) -> RateDecision:
+        """Take cost tokens from subject's bucket (requests per window, bursting up to burst or requests)"""
+        key = f"{scope}:{subject}"
+        rate = requests / window
+        capacity = burst or requests
+        try:
+            decision = await self.store.take(key, rate, capacity, cost)
+        except Exception as e:
+            self._store_failed(e)
+            decision = self.fallback.take_sync(key, rate, capacity, cost)
+        self.checks[scope] = self.checks.get(scope, 0) + 1
+        if not decision.allowed:
+            self.limited[scope] = self.limited.get(scope, 0) + 1
+        return decision
+
+    async def drain(self, scope: str, subject: str, tokens: float = 0.0) -> None:
+        """Empty subject's bucket (into debt with negative tokens), for every worker sharing the store"""
+        key = f"{scope}:{subject}"
+        try:
+            await self.store.drain(key, tokens)
+        except Exception as e:
+            self._store_failed(e)
+            self.fallback.drain_sync(key, tokens)
+
+    async def close(self) -> None:
+        await self.store.close()
+
+    def stats(self) -> dict:
+        """Checks and rejections per scope"""
+        return {
+            "backend": self.store.name,
+            "checks": dict(self.checks),
+            "limited": dict(self.limited),
+            "store_errors": self.store_errors
+        }
+
+def create_rate_limiter() -> RateLimiter:
+    """Rate limiter on the configured backend"""
+    backend = settings.RATE_LIMIT_BACKEND
+    try:
+        if backend == "redis":
+            return RateLimiter(RedisBucketStore(settings.RATE_LIMIT_REDIS_URL))
+        if backend == "sqlite":
+            return RateLimiter(SQLiteBucketStore(settings.RATE_LIMIT_SQLITE_PATH))
+    except Exception as e:
+        print(f"⚠️ Rate limit backend {backend} unavailable, limits are per worker: {e}")
+    return RateLimiter(MemoryBucketStore())
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,100 @@
+"""
+Reply Chunker for IG-Shop-Agent V2
+Cuts a streamed AI reply into Instagram-sized messages at sentence boundaries
+"""
+import re
+from typing import List
+
+# Sentence ends (Latin and Arabic punctuation, optionally closed by quotes or brackets)
+# followed by whitespace, or line breaks
+SENTENCE_END = re.compile(r"[.!?؟…](?:[\"'”’)\]]*)(?=\s)|\n+")
+
+def sentence_ends(text: str) -> List[int]:
+    """Offsets just past each complete sentence in text"""
+    return [match.end() for match in SENTENCE_END.finditer(text)]
+
+def cut_point(text: str, limit: int) -> int:
+    """Longest prefix of at most limit characters ending on a sentence, word or hard cut"""
+    ends = [end for end in sentence_ends(text) if end <= limit]
+    if ends:
+        return ends[-1]
+    space = text.rfind(" ", 0, limit + 1)
+    return space if space > 0 else limit
+
+def split_message(text: str, limit: int) -> List[str]:
+    """Text cut into messages of at most limit characters, at sentence or word boundaries"""
+    messages: List[str] = []
+    text = text.strip()
+    while len(text) > limit:
+        end = cut_point(text, limit)
+        messages.append(text[:end].strip())
+        text = text[end:].strip()
+    if text:
+        messages.append(text)
+    return messages
+
+class ReplyChunker:
+    """Incremental splitter for streamed reply text
+
+    feed() returns the messages that became complete. Generation should stop
+    once stopped is set: at the first sentence end past soft_limit, or at
+    the last sentence end before hard_limit (what Instagram will deliver).
+    With split_chars set, the reply goes out as several messages of about
+    that size, each released as soon as its last sentence is complete.
+    """
+
+    def __init__(self, soft_limit: int, hard_limit: int, split_chars: int = 0):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.split_chars = split_chars
+        self.buffer = ""
+        self.released = 0
+        self.stopped = False
+
+    def _release(self, length: int) -> List[str]:
+        """Take length characters off the buffer as one message"""
+        text, self.buffer = self.buffer[:length], self.buffer[length:]
+        self.released += length
+        text = text.strip()
+        return [text] if text else []
+
+    def _split(self) -> List[str]:
+        """Release complete sentences in messages of about split_chars"""
+        ready: List[str] = []
+        while self.split_chars and len(self.buffer) >= self.split_chars:
+            ends = sentence_ends(self.buffer)
+            if not ends:
+                break
+            fitting = [end for end in ends if end <= self.split_chars]
+            ready.extend(self._release(fitting[-1] if fitting else ends[0]))
+        return ready
+
+    def _stop(self, length: int) -> List[str]:
+        """Keep length more characters and end the reply"""
+        self.buffer = self.buffer[:length]
+        self.stopped = True
+        return self.finish()
+
+    def feed(self, delta: str) -> List[str]:
+        """Add streamed text; returns messages ready to send"""
+        if self.stopped or not delta:
+            return []
+        self.buffer += delta
+
+        room = self.hard_limit - self.released
+        if len(self.buffer) >= room:
+            return self._stop(cut_point(self.buffer, room))
+
+        past_soft = [end for end in sentence_ends(self.buffer) if self.released + end >= self.soft_limit]
+        if past_soft:
+            return self._stop(past_soft[0])
+
+        return self._split()
+
+    def finish(self) -> List[str]:
+        """Messages for whatever is left once the stream ends"""
+        ready = self._split()
+        while self.split_chars and len(self.buffer) > self.split_chars:
+            ready.extend(self._release(cut_point(self.buffer, self.split_chars)))
+        ready.extend(self._release(len(self.buffer)))
+        return ready
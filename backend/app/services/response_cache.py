@@ -0,0 +1,157 @@
+"""
+Response Cache for IG-Shop-Agent V2
+Per-merchant cache of AI replies to repeated customer questions
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from ..core.config import settings
+from ..models.merchant import Merchant
+from .product_embeddings import HashingEmbedder
+from .prompt_compiler import merchant_version
+from .text_normalizer import tokenize
+
+def normalize_question(message_text: str) -> str:
+    """Cache key text: folded tokens without punctuation, emoji or repeated spaces"""
+    return " ".join(tokenize(message_text, keep_stopwords=True))
+
+@dataclass
+class CachedResponse:
+    response: str
+    expires_at: float
+    vector: Optional[np.ndarray]
+
+class TenantCache:
+    """One merchant's LRU of replies, valid for a single merchant version"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+class ResponseCache:
+    """Replies keyed on (merchant version, normalized message)
+
+    A merchant's entries are dropped as soon as its version changes, which
+    happens on every profile, catalog or working-hours save. Entries also
+    expire after the TTL (0 disables the cache), and each merchant keeps at
+    most per_merchant of them. With a similarity threshold set, a miss falls back to the closest cached
+    question by local hashing embeddings (no API call) above that threshold.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 900,
+        per_merchant: int = 200,
+        max_merchants: int = 1000,
+        similarity: float = 0.0
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.per_merchant = per_merchant
+        self.max_merchants = max_merchants
+        self.similarity = similarity
+        self.embedder = HashingEmbedder(dimensions=256) if similarity > 0 else None
+        self._tenants: "OrderedDict[str, TenantCache]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _tenant(self, merchant: Merchant, create: bool) -> Optional[TenantCache]:
+        """The merchant's cache for its current version (lock held)"""
+        version = merchant_version(merchant)
+        tenant = self._tenants.get(merchant.id)
+        if tenant is not None and tenant.version != version:
+            del self._tenants[merchant.id]
+            tenant = None
+        if tenant is None and create:
+            tenant = self._tenants[merchant.id] = TenantCache(version)
+            while len(self._tenants) > self.max_merchants:
+                self._tenants.popitem(last=False)
+        if tenant is not None:
+            self._tenants.move_to_end(merchant.id)
+        return tenant
+
+    def _vector(self, key: str) -> Optional[np.ndarray]:
+        return self.embedder.embed_sync([key])[0] if self.embedder is not None and key else None
+
+    def get(self, merchant: Merchant, message_text: str) -> Optional[str]:
+        """Cached reply for this question, or None"""
+        key = normalize_question(message_text)
+        if not key or self.ttl_seconds <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            tenant = self._tenant(merchant, create=False)
+            entry = tenant.entries.get(key) if tenant is not None else None
+            if entry is not None and entry.expires_at > now:
+                tenant.entries.move_to_end(key)
+                self.hits += 1
+                return entry.response
+            if entry is not None:
+                del tenant.entries[key]
+            if tenant is None or not tenant.entries or self.embedder is None:
+                self.misses += 1
+                return None
+            candidates = [(cached_key, cached) for cached_key, cached in tenant.entries.items() if cached.expires_at > now]
+
+        match = self._closest(key, candidates)
+        with self._lock:
+            if match is None:
+                self.misses += 1
+                return None
+            self.similar_hits += 1
+            return match
+
+    def _closest(self, key: str, candidates) -> Optional[str]:
+        """Reply of the most similar cached question above the threshold"""
+        if not candidates:
+            return None
+        vectors = np.stack([cached.vector for _, cached in candidates])
+        scores = vectors @ self._vector(key)
+        best = int(np.argmax(scores))
+        return candidates[best][1].response if scores[best] >= self.similarity else None
+
+    def put(self, merchant: Merchant, message_text: str, response: str) -> None:
+        """Remember a reply for the merchant's current version"""
+        key = normalize_question(message_text)
+        if not key or not response or self.ttl_seconds <= 0:
+            return
+        entry = CachedResponse(response, time.monotonic() + self.ttl_seconds, self._vector(key))
+        with self._lock:
+            tenant = self._tenant(merchant, create=True)
+            tenant.entries[key] = entry
+            tenant.entries.move_to_end(key)
+            while len(tenant.entries) > self.per_merchant:
+                tenant.entries.popitem(last=False)
+            self.stores += 1
+
+    def invalidate(self, merchant_id: str) -> None:
+        """Drop every cached reply of a merchant"""
+        with self._lock:
+            self._tenants.pop(merchant_id, None)
+
+    def stats(self) -> dict:
+        """Cache size and hit rates"""
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "merchants": len(self._tenants),
+            "entries": sum(len(tenant.entries) for tenant in list(self._tenants.values())),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round((self.hits + self.similar_hits) / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(
+    ttl_seconds=settings.RESPONSE_CACHE_TTL,
+    per_merchant=settings.RESPONSE_CACHE_PER_MERCHANT,
+    max_merchants=settings.MERCHANT_CACHE_SIZE,
+    similarity=settings.RESPONSE_CACHE_SIMILARITY
+)
@@ -0,0 +1,67 @@
+"""
+Text Normalization for IG-Shop-Agent V2
+Arabic and English folding and tokenization shared by search and matching
+"""
+import re
+import unicodedata
+from typing import List
+
+# Tashkeel (harakat, tanween, shadda, sukun), superscript alef and tatweel
+_ARABIC_MARKS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+
+_ARABIC_FOLDING = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ة": "ه",
+    "ؤ": "و",
+    # Arabic-Indic and Persian digits
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+    "۰": "0", "۱": "1", "۲": "2", "۳": "3", "۴": "4",
+    "۵": "5", "۶": "6", "۷": "7", "۸": "8", "۹": "9",
+})
+
+_TOKEN = re.compile(r"\w+")
+
+STOPWORDS = frozenset({
+    # English
+    "a", "an", "the", "is", "are", "do", "does", "you", "your", "i", "me", "my",
+    "of", "for", "to", "in", "on", "and", "or", "it", "this", "that", "have", "has",
+    "what", "please", "pls", "can", "with",
+    # Arabic (already folded)
+    "في", "من", "على", "الى", "عن", "هل", "ما", "هذا", "هذه", "انا", "انت",
+    "عندكم", "عندك", "لو", "يا", "و", "او", "مع",
+})
+
+def _strip_latin_accents(text: str) -> str:
+    """Remove combining marks from Latin letters (café -> cafe) without touching Arabic"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(
+        char for char in decomposed
+        if not (unicodedata.combining(char) and "\u0300" <= char <= "\u036f")
+    )
+
+def normalize_text(text: str) -> str:
+    """Fold Arabic letter variants and diacritics, casefold Latin text"""
+    if not text:
+        return ""
+    text = _ARABIC_MARKS.sub("", text)
+    text = text.translate(_ARABIC_FOLDING)
+    text = _strip_latin_accents(text)
+    return unicodedata.normalize("NFKC", text).casefold()
+
+def _light_stem(token: str) -> str:
+    """Strip the Arabic definite article and simple English plurals"""
+    for prefix in ("وال", "بال", "فال", "كال", "ال"):
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    if token.isascii() and len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text: str, keep_stopwords: bool = False) -> List[str]:
+    """Normalized, lightly stemmed tokens"""
+    tokens = _TOKEN.findall(normalize_text(text))
+    if not keep_stopwords:
+        tokens = [token for token in tokens if token not in STOPWORDS]
+    return [_light_stem(token) for token in tokens]
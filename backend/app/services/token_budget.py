@@ -0,0 +1,198 @@
+"""
+Token Budget for IG-Shop-Agent V2
+Local token counting, per-tier prompt budgets and estimated-vs-actual token tracking
+"""
+import asyncio
+import math
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators around each chat message
+REPLY_PRIMING_TOKENS = 3     # tokens that open the assistant's reply
+
+def estimate_tokens(text: str) -> int:
+    """Heuristic token count (about four UTF-8 bytes per token for English and Arabic)"""
+    return max(1, (len(text.encode("utf-8")) + 3) // 4) if text else 0
+
+class TokenCounter:
+    """Counts tokens with the model's tiktoken encoding, or a byte heuristic without it"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        """Load the encoding once; it may be unavailable offline"""
+        with self._lock:
+            if self._loaded:
+                return
+            if TIKTOKEN_AVAILABLE:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"⚠️ tiktoken encoding unavailable, estimating tokens: {e}")
+            self._loaded = True
+
+    async def load(self) -> None:
+        """Load the encoding in a worker thread (the first load may download it)"""
+        await asyncio.to_thread(self._load)
+
+    def _get_encoding(self):
+        """The loaded encoding; None while it is unavailable or still loading
+
+        Off the event loop the encoding is loaded inline. On the loop a
+        missing encoding is loaded in a background thread and counts are
+        estimated meanwhile, so a first-use download never blocks the loop.
+        """
+        if not self._loaded:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                self._load()
+            else:
+                with self._lock:
+                    if self._loaded or self._loading:
+                        return self._encoding
+                    self._loading = True
+                threading.Thread(target=self._load, name="tiktoken-load", daemon=True).start()
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self._get_encoding() is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is None:
+            return estimate_tokens(text)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """Prompt tokens of a chat messages array"""
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages) + REPLY_PRIMING_TOKENS
+
+def completion_token_limit() -> int:
+    """max_tokens that still covers the longest reply Instagram will deliver"""
+    return math.ceil(settings.INSTAGRAM_MAX_MESSAGE_CHARS / settings.MIN_CHARS_PER_TOKEN)
+
+def input_token_budget(tier: Optional[str]) -> int:
+    """Prompt token budget of a subscription tier"""
+    limits = settings.TIER_LIMITS.get(tier or "starter") or settings.TIER_LIMITS["starter"]
+    return limits["input_tokens"]
+
+@dataclass
+class PromptPlan:
+    """What fits in a call's input budget"""
+    product_lines: List[str]
+    history: List[Dict[str, str]]
+    estimated_tokens: int
+    dropped_products: int
+    dropped_turns: int
+
+def plan_prompt(
+    counter: TokenCounter,
+    budget: int,
+    fixed_messages: List[Dict[str, str]],
+    product_lines: List[str],
+    turns: List[Tuple[str, str]],
+    history_cap: int,
+    product_share: float = 0.6
+) -> PromptPlan:
+    """Apportion the budget by priority: system prompt and current message, products, then history
+
+    Products are kept best-first up to product_share of what remains after
+    the fixed messages; history gets the rest (at most history_cap), newest
+    turns first. Whatever does not fit is dropped, never cut mid-item.
+    """
+    fixed = counter.count_messages(fixed_messages)
+    remaining = max(0, budget - fixed)
+
+    kept_products: List[str] = []
+    product_tokens = 0
+    product_budget = int(remaining * product_share)
+    for line in product_lines:
+        cost = counter.count(line) + 1  # newline
+        if product_tokens + cost > product_budget:
+            break
+        kept_products.append(line)
+        product_tokens += cost
+
+    history_budget = min(history_cap, remaining - product_tokens)
+    history: List[Dict[str, str]] = []
+    history_tokens = 0
+    for role, content in reversed(turns):
+        cost = counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+        if history_tokens + cost > history_budget:
+            break
+        history_tokens += cost
+        history.append({"role": role, "content": content})
+    # Never open the history with a dangling assistant reply
+    while history and history[-1]["role"] == "assistant":
+        history_tokens -= counter.count(history.pop()["content"]) + MESSAGE_OVERHEAD_TOKENS
+    history.reverse()
+
+    return PromptPlan(
+        product_lines=kept_products,
+        history=history,
+        estimated_tokens=fixed + product_tokens + history_tokens,
+        dropped_products=len(product_lines) - len(kept_products),
+        dropped_turns=len(turns) - len(history)
+    )
+
+class TokenUsageStats:
+    """Estimated vs actual prompt tokens and completion tokens of every AI call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.estimated_prompt_tokens = 0
+        self.actual_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.measured = 0  # calls that reported actual prompt tokens
+        self.absolute_error = 0
+        self.over_budget = 0
+
+    def record(self, estimated: int, actual: int, completion: int, budget: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.estimated_prompt_tokens += estimated
+            self.actual_prompt_tokens += actual
+            self.completion_tokens += completion
+            if actual:
+                self.measured += 1
+                self.absolute_error += abs(actual - estimated)
+            if budget and actual > budget:
+                self.over_budget += 1
+
+    def stats(self) -> dict:
+        """Totals and the mean estimation error"""
+        return {
+            "exact_counting": token_counter.exact,
+            "calls": self.calls,
+            "estimated_prompt_tokens": self.estimated_prompt_tokens,
+            "actual_prompt_tokens": self.actual_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "mean_estimate_error": round(self.absolute_error / self.measured, 1) if self.measured else 0.0,
+            "over_budget": self.over_budget,
+            "max_completion_tokens": completion_token_limit()
+        }
+
+token_counter = TokenCounter(settings.OPENAI_MODEL)
+token_usage = TokenUsageStats()
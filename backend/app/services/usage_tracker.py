@@ -0,0 +1,127 @@
+"""
+Usage Tracker for IG-Shop-Agent V2
+Write-behind monthly message counters flushed to the database in batches
+"""
+import asyncio
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.merchant import Merchant
+from .merchant_cache import merchant_cache
+
+class UsageTracker:
+    """In-memory per-merchant message counters with periodic set-based flushes
+
+    Replaces a commit per message with one UPDATE ... SET count = count + :n
+    statement per flush, which also removes the lost-update race of
+    incrementing an ORM attribute from concurrent workers. Limit checks use the
+    cached merchant plus the counts not yet written, so they are approximate
+    across worker processes but never wait on the database.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, int] = {}
+        self._flushing: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+
+    def record(self, merchant_id: str, count: int = 1) -> None:
+        """Count messages sent on behalf of a merchant"""
+        with self._lock:
+            self._pending[merchant_id] = self._pending.get(merchant_id, 0) + count
+
+    def unflushed(self, merchant_id: str) -> int:
+        """Messages counted in memory but not yet reflected in the cached merchant"""
+        with self._lock:
+            return self._pending.get(merchant_id, 0) + self._flushing.get(merchant_id, 0)
+
+    def can_send_message(self, merchant: Merchant) -> bool:
+        """Approximate limit check against the cached merchant and unflushed counts"""
+        if not merchant.is_active:
+            return False
+        used = (merchant.monthly_message_count or 0) + self.unflushed(merchant.id)
+        return used < merchant.monthly_message_limit
+
+    def flush(self) -> int:
+        """Write pending counters in one transaction; returns merchants updated"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+
+        merchants = Merchant.__table__
+        statement = (
+            update(merchants)
+            .where(merchants.c.id == bindparam("merchant_id"))
+            .values(
+                monthly_message_count=merchants.c.monthly_message_count + bindparam("count"),
+                # Usage is not a profile change; keep the merchant version stable
+                updated_at=merchants.c.updated_at
+            )
+        )
+        db = SessionLocal()
+        try:
+            db.execute(statement, [
+                {"merchant_id": merchant_id, "count": count}
+                for merchant_id, count in batch.items()
+            ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for merchant_id, count in batch.items():
+                    self._pending[merchant_id] = self._pending.get(merchant_id, 0) + count
+                self._flushing = {}
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            for merchant_id, count in batch.items():
+                merchant_cache.apply_usage(merchant_id, count)
+            self._flushing = {}
+        self.flushes += 1
+        return len(batch)
+
+    async def start(self) -> None:
+        """Start the periodic flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="usage-flush")
+
+    async def stop(self) -> None:
+        """Stop the flush task and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self.flush)
+        except Exception as e:
+            print(f"❌ Final usage flush failed: {e}")
+
+    async def _run(self) -> None:
+        """Flush loop"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"⚠️ Usage flush failed, will retry: {e}")
+
+    def stats(self) -> dict:
+        """Pending counters"""
+        with self._lock:
+            return {
+                "pending_merchants": len(self._pending),
+                "pending_messages": sum(self._pending.values()),
+                "flushes": self.flushes
+            }
+
+usage_tracker = UsageTracker(flush_interval=settings.USAGE_FLUSH_INTERVAL)
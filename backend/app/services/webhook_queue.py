@@ -0,0 +1,321 @@
+"""
+Webhook Ingress Queue for IG-Shop-Agent V2
+Durable SQLite-backed queue and async worker pool for Instagram webhook payloads
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+@dataclass
+class QueuedWebhook:
+    """A webhook payload claimed from the queue"""
+    id: int
+    payload: str
+    received_at: float
+    attempts: int
+
+
+class WebhookQueue:
+    """Persistent at-least-once queue backed by a local SQLite file
+
+    Rows move pending -> inflight on claim and are deleted on ack. An inflight
+    row whose visibility timeout has passed becomes claimable again, so events
+    held by a crashed worker are redelivered instead of lost. A row that has
+    already used up its attempts is dead-lettered at claim time rather than
+    handed out again, and dead rows are pruned after the retention period.
+
+    Deferred payloads park their conversations until they are due, so later
+    messages of the same conversation can be queued behind them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float = 120.0,
+        max_attempts: int = 5,
+        dead_retention: float = 7 * 86400,
+        prune_interval: float = 3600.0
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.dead_retention = dead_retention
+        self.prune_interval = prune_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Open the queue database lazily (WAL keeps enqueue commits sub-millisecond)"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS webhook_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    received_at REAL NOT NULL,
+                    available_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    last_error TEXT
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_webhook_queue_ready "
+                "ON webhook_queue (status, available_at)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS parked_conversations (
+                    conversation TEXT PRIMARY KEY,
+                    parked_until REAL NOT NULL,
+                    first_received_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def enqueue(
+        self,
+        payload: str,
+        received_at: Optional[float] = None,
+        delay: float = 0.0,
+        conversations: Iterable[str] = ()
+    ) -> int:
+        """Append a raw webhook payload and return its queue id
+
+        A delayed payload parks its conversations until it is due; a park
+        that is still live keeps its earliest received_at.
+        """
+        now = time.time()
+        received_at = received_at or now
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO webhook_queue (payload, received_at, available_at) VALUES (?, ?, ?)",
+                    (payload, received_at, now + delay)
+                )
+                for conversation in conversations:
+                    conn.execute(
+                        "INSERT INTO parked_conversations (conversation, parked_until, first_received_at) "
+                        "VALUES (?, ?, ?) ON CONFLICT(conversation) DO UPDATE SET "
+                        "first_received_at = CASE WHEN parked_until > ? "
+                        "THEN MIN(first_received_at, excluded.first_received_at) ELSE excluded.first_received_at END, "
+                        "parked_until = MAX(parked_until, excluded.parked_until)",
+                        (conversation, now + delay, received_at, now)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return cursor.lastrowid
+
+    def parked(self, conversations: Iterable[str], received_at: float) -> Dict[str, float]:
+        """Conversations with deferred messages received before received_at, and when those are due"""
+        conversations = list(conversations)
+        if not conversations:
+            return {}
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT conversation, parked_until FROM parked_conversations "
+                f"WHERE conversation IN ({', '.join('?' * len(conversations))}) "
+                f"AND parked_until > ? AND first_received_at < ?",
+                (*conversations, time.time(), received_at)
+            ).fetchall()
+        return dict(rows)
+
+    def claim(self) -> Optional[QueuedWebhook]:
+        """Claim the next ready payload and hide it for the visibility timeout
+
+        A row whose attempts are already exhausted was last claimed by a
+        worker that never acked or nacked it (crash or cancellation), so it
+        is dead-lettered here instead of being redelivered forever.
+        """
+        now = time.time()
+        if now - self._last_prune >= self.prune_interval:
+            self.prune_dead(now)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = conn.execute(
+                        "SELECT id, payload, received_at, attempts FROM webhook_queue "
+                        "WHERE status IN ('pending', 'inflight') AND available_at <= ? "
+                        "ORDER BY available_at, id LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+                    if row[3] < self.max_attempts:
+                        break
+                    conn.execute(
+                        "UPDATE webhook_queue SET status = 'dead', available_at = ?, last_error = ? "
+                        "WHERE id = ?",
+                        (now, f"abandoned after {row[3]} attempts", row[0])
+                    )
+                    print(f"❌ Webhook job {row[0]} dead-lettered after {row[3]} unfinished attempts")
+                conn.execute(
+                    "UPDATE webhook_queue SET status = 'inflight', attempts = attempts + 1, "
+                    "available_at = ? WHERE id = ?",
+                    (now + self.visibility_timeout, row[0])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return QueuedWebhook(id=row[0], payload=row[1], received_at=row[2], attempts=row[3] + 1)
+
+    def ack(self, job_id: int) -> None:
+        """Remove a successfully processed payload"""
+        with self._lock:
+            self._connection().execute("DELETE FROM webhook_queue WHERE id = ?", (job_id,))
+
+    def nack(self, job: QueuedWebhook, error: str, delay: float) -> bool:
+        """Schedule a failed payload for retry; returns False once it is dead-lettered"""
+        dead = job.attempts >= self.max_attempts
+        with self._lock:
+            self._connection().execute(
+                "UPDATE webhook_queue SET status = ?, available_at = ?, last_error = ? WHERE id = ?",
+                ("dead" if dead else "pending", time.time() + (0 if dead else delay), error[:500], job.id)
+            )
+        return not dead
+
+    def prune_dead(self, now: Optional[float] = None) -> int:
+        """Delete dead-lettered rows older than the retention period, and lapsed conversation parks"""
+        now = now or time.time()
+        self._last_prune = now
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "DELETE FROM webhook_queue WHERE status = 'dead' AND available_at < ?",
+                (now - self.dead_retention,)
+            )
+            conn.execute("DELETE FROM parked_conversations WHERE parked_until < ?", (now,))
+        if cursor.rowcount:
+            print(f"🧹 Pruned {cursor.rowcount} dead-lettered webhook jobs")
+        return cursor.rowcount
+
+    def depth(self) -> int:
+        """Number of payloads waiting or in flight"""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM webhook_queue WHERE status IN ('pending', 'inflight')"
+            ).fetchone()[0]
+
+    def backlog(self) -> int:
+        """Number of pending payloads already due (deferred ones count once their delay is over)"""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM webhook_queue WHERE status = 'pending' AND available_at <= ?",
+                (time.time(),)
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        """Queue counts by status"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM webhook_queue GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class WebhookWorkerPool:
+    """Pool of async workers draining a WebhookQueue with ack/retry"""
+
+    def __init__(
+        self,
+        queue: WebhookQueue,
+        handler: Callable[[QueuedWebhook], Awaitable[None]],
+        workers: int = 4,
+        poll_interval: float = 1.0,
+        retry_backoff: float = 2.0,
+        max_backoff: float = 300.0
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+
+    def notify(self) -> None:
+        """Wake idle workers after an enqueue"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        """Spawn the worker tasks"""
+        if self._running:
+            return
+        self._running = True
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run(worker_id), name=f"webhook-worker-{worker_id}")
+            for worker_id in range(self.workers)
+        ]
+        print(f"📥 Webhook worker pool started ({self.workers} workers, {self.queue.depth()} queued)")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop workers, letting in-flight jobs finish within the timeout"""
+        if not self._running:
+            return
+        self._running = False
+        self.notify()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        self.queue.close()
+        print("📴 Webhook worker pool stopped")
+
+    async def _run(self, worker_id: int) -> None:
+        """Worker loop: claim, handle, ack or schedule a retry"""
+        while self._running:
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.queue.claim)
+            except Exception as e:
+                print(f"❌ Webhook queue claim error: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await asyncio.wait_for(self.handler(job), timeout=self.queue.visibility_timeout)
+                await asyncio.to_thread(self.queue.ack, job.id)
+            except Exception as e:
+                delay = min(self.retry_backoff * (2 ** (job.attempts - 1)), self.max_backoff)
+                if await asyncio.to_thread(self.queue.nack, job, repr(e), delay):
+                    print(f"⚠️ Webhook job {job.id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {e}")
+                else:
+                    print(f"❌ Webhook job {job.id} dead-lettered after {job.attempts} attempts: {e}")
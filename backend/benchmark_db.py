@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Database Benchmark for IG-Shop-Agent V2
+Event-loop lag and throughput of the webhook pipeline's queries, sync Session vs AsyncSession
+
+Each simulated message runs the queries the webhook pipeline makes: merchant
+lookup by page ID, message ID claim, conversation history load and the
+exchange insert. "sync" runs them on a blocking Session inside coroutines
+(how the pipeline worked before the async port), "async" on AsyncSession.
+
+Usage: python benchmark_db.py [--url sqlite:///./igshop_benchmark.db] [--messages 2000] [--concurrency 16]
+Rows it creates are keyed "bench_" and deleted at the end.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+
+os.environ.setdefault("ENVIRONMENT", "development")
+
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base, async_database_url, create_async_database_engine
+from app.models.conversation_message import ConversationMessage
+from app.models.merchant import Merchant
+from app.models.processed_message import ProcessedMessage
+
+MERCHANTS = 50
+
+def history_query(merchant_id: str, sender_id: str):
+    return (
+        select(ConversationMessage.role, ConversationMessage.content)
+        .where(ConversationMessage.merchant_id == merchant_id, ConversationMessage.sender_id == sender_id)
+        .order_by(ConversationMessage.created_at.desc(), ConversationMessage.id.desc())
+        .limit(10)
+    )
+
+def exchange(merchant_id: str, sender_id: str):
+    return [
+        ConversationMessage(merchant_id=merchant_id, sender_id=sender_id, role="user", content="Do you have this in blue?"),
+        ConversationMessage(merchant_id=merchant_id, sender_id=sender_id, role="assistant", content="Yes, it is in stock.")
+    ]
+
+def sync_message(factory, n: int) -> None:
+    page_id, sender_id, mid = f"bench_page_{n % MERCHANTS}", f"bench_sender_{n % 500}", f"bench_{uuid.uuid4().hex}"
+    with factory() as db:
+        merchant = db.scalar(select(Merchant).where(Merchant.instagram_page_id == page_id))
+        if not set(db.scalars(select(ProcessedMessage.mid).where(ProcessedMessage.mid.in_([mid])))):
+            db.add(ProcessedMessage(mid=mid))
+            db.commit()
+        db.execute(history_query(merchant.id, sender_id)).all()
+        db.add_all(exchange(merchant.id, sender_id))
+        db.commit()
+
+async def async_message(factory, n: int) -> None:
+    page_id, sender_id, mid = f"bench_page_{n % MERCHANTS}", f"bench_sender_{n % 500}", f"bench_{uuid.uuid4().hex}"
+    async with factory() as db:
+        merchant = await db.scalar(select(Merchant).where(Merchant.instagram_page_id == page_id))
+        if not set(await db.scalars(select(ProcessedMessage.mid).where(ProcessedMessage.mid.in_([mid])))):
+            db.add(ProcessedMessage(mid=mid))
+            await db.commit()
+        (await db.execute(history_query(merchant.id, sender_id))).all()
+        db.add_all(exchange(merchant.id, sender_id))
+        await db.commit()
+
+async def measure(label: str, run_message, messages: int, concurrency: int) -> dict:
+    """Run messages through concurrency workers while a probe measures how late the loop wakes up"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            started = loop.time()
+            await asyncio.sleep(0.005)
+            lags.append(max(0.0, loop.time() - started - 0.005) * 1000)
+
+    counter = iter(range(messages))
+
+    async def worker():
+        for n in counter:
+            await run_message(n)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+    lags.sort()
+    return {
+        "mode": label,
+        "messages/s": round(messages / elapsed, 1),
+        "lag p50 ms": round(statistics.median(lags), 2) if lags else None,
+        "lag p99 ms": round(lags[int(len(lags) * 0.99) - 1], 2) if lags else None,
+        "lag max ms": round(lags[-1], 2) if lags else None,
+        "probes": len(lags)
+    }
+
+TABLES = [Merchant.__table__, ProcessedMessage.__table__, ConversationMessage.__table__]
+
+def cleanup(engine) -> None:
+    """Delete every row the benchmark created"""
+    with sessionmaker(bind=engine)() as db:
+        db.execute(delete(ConversationMessage).where(ConversationMessage.sender_id.like("bench_%")))
+        db.execute(delete(ProcessedMessage).where(ProcessedMessage.mid.like("bench_%")))
+        db.execute(delete(Merchant).where(Merchant.instagram_page_id.like("bench_page_%")))
+        db.commit()
+
+def seed(url: str) -> None:
+    engine = create_engine(url)
+    Base.metadata.create_all(engine, tables=TABLES)
+    cleanup(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all([
+            Merchant(
+                instagram_page_id=f"bench_page_{i}",
+                page_name=f"bench_{i}",
+                access_token_hash="bench",
+                business_name=f"Benchmark Shop {i}"
+            )
+            for i in range(MERCHANTS)
+        ])
+        db.commit()
+    engine.dispose()
+
+async def main(url: str, messages: int, concurrency: int) -> None:
+    seed(url)
+    sqlite = url.startswith("sqlite")
+    sync_engine = create_engine(url, connect_args={"check_same_thread": False} if sqlite else {})
+    sync_factory = sessionmaker(bind=sync_engine, autoflush=False)
+    async_engine = create_async_database_engine(async_database_url(url))
+    async_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def run_sync(n: int) -> None:
+        sync_message(sync_factory, n)
+
+    async def run_async(n: int) -> None:
+        await async_message(async_factory, n)
+
+    # Warm both pools so connection setup is not measured
+    await run_sync(0)
+    await run_async(0)
+    results = [
+        await measure("sync Session", run_sync, messages, concurrency),
+        await measure("AsyncSession", run_async, messages, concurrency)
+    ]
+    cleanup(sync_engine)
+    sync_engine.dispose()
+    await async_engine.dispose()
+
+    print(f"\n📊 {messages} messages, {concurrency} concurrent, {url}")
+    columns = list(results[0])
+    print(" | ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>12}" for column in columns))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--url", default="sqlite:///./igshop_benchmark.db", help="database to benchmark")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.messages, args.concurrency))
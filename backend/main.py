@@ -2,9 +2,8 @@
 IG-Shop-Agent V2: Ultra Low-Cost Instagram DM Automation Platform
 FastAPI Backend Application
 """
-import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
@@ -17,22 +16,57 @@ load_dotenv()
 # Import API routes
 from app.api.auth import auth_router
 from app.api.merchants import merchants_router
-from app.api.webhooks import webhook_router
+from app.api.webhooks import webhook_router, webhook_workers
 from app.api.health import health_router
+from app.api.rate_limits import limit_client_ip
 
 # Import database
-from app.core.database import engine, create_tables
+from app.core.database import async_engine, create_tables
 from app.core.config import settings
+from app.services.usage_tracker import usage_tracker
+from app.services.llm_client import llm_client
+from app.services.rate_limiter import rate_limiter
+from app.services.ai_service import get_ai_service
+from app.services.instagram_service import get_instagram_service
+from app.services.instagram_outbox import instagram_outbox
+from app.services.load_shedder import load_shedder
+from app.services.token_budget import token_counter
+from app.core.http_client import startup_http_client, shutdown_http_client
+from app.core.token_crypto import check_token_key
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
+    check_token_key()
     create_tables()
     print("🚀 Database tables created successfully")
     print(f"🌐 FastAPI server starting on {settings.HOST}:{settings.PORT}")
+    # Application-scoped services sharing pooled connections
+    await startup_http_client()
+    if settings.INSTAGRAM_DEMO_MODE:
+        print("⚠️ INSTAGRAM_DEMO_MODE is on: Instagram sends are only simulated and no customer receives a reply")
+    if settings.WEB_CONCURRENCY > 1 and rate_limiter.store.name == "memory":
+        print(
+            f"⚠️ {settings.WEB_CONCURRENCY} workers with per-worker rate limits: each one spends the whole "
+            "OpenAI and merchant budgets. Set RATE_LIMIT_BACKEND=sqlite or redis to share them."
+        )
+    await token_counter.load()
+    get_ai_service()
+    get_instagram_service()
+    await usage_tracker.start()
+    await webhook_workers.start()
+    await load_shedder.start()
     yield
     # Shutdown
+    await load_shedder.stop()
+    await webhook_workers.stop()
+    await instagram_outbox.close()
+    await usage_tracker.stop()
+    await llm_client.close()
+    await rate_limiter.close()
+    await async_engine.dispose()
+    await shutdown_http_client()
     print("📴 FastAPI server shutting down")
 
 # Create FastAPI application
@@ -76,8 +110,8 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 # Include API routers
 app.include_router(health_router, prefix="/api/health", tags=["Health"])
-app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
-app.include_router(merchants_router, prefix="/api/merchants", tags=["Merchants"])
+app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"], dependencies=[Depends(limit_client_ip)])
+app.include_router(merchants_router, prefix="/api/merchants", tags=["Merchants"], dependencies=[Depends(limit_client_ip)])
 app.include_router(webhook_router, prefix="/api/webhooks", tags=["Webhooks"])
 
 @app.get("/")
@@ -0,0 +1,43 @@
+"""
+Test configuration for IG-Shop-Agent V2
+Puts the backend on sys.path and points settings at throwaway local stores
+"""
+import os
+import sys
+import tempfile
+
+import pytest_asyncio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Must be set before app.core.config is imported: "test" skips the required-secrets check
+_TEST_DIR = tempfile.mkdtemp(prefix="igshop_tests_")
+os.environ["ENVIRONMENT"] = "test"
+os.environ["SECRET_KEY"] = "igshop-test-secret"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'app.db')}"
+os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(_TEST_DIR, "webhook_queue.db")
+os.environ["RATE_LIMIT_SQLITE_PATH"] = os.path.join(_TEST_DIR, "rate_limits.db")
+
+@pytest_asyncio.fixture
+async def session_factory(tmp_path):
+    """Async session factory on a fresh SQLite database with every table created"""
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app.core.database import Base, create_async_database_engine
+    import app.models.conversation_message  # noqa: F401  (registers the tables)
+    import app.models.merchant  # noqa: F401
+    import app.models.processed_message  # noqa: F401
+    import app.models.sent_message  # noqa: F401
+
+    engine = create_async_database_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    await engine.dispose()
+
+@pytest_asyncio.fixture
+async def db(session_factory):
+    """Async session on a fresh SQLite database with every table created"""
+    async with session_factory() as session:
+        yield session
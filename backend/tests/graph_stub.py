@@ -0,0 +1,53 @@
+"""
+Local stand-in for the Instagram Graph Send API
+Served in process through httpx's ASGI transport; records every request and fails on cue
+"""
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BASE_URL = "http://graph.test/v18.0"
+
+class GraphStub:
+    """POST /v18.0/me/messages that answers like the Send API
+
+    Queued failures are returned to the next requests in order; every
+    request, failed or not, is logged with its arrival time.
+    """
+
+    def __init__(self):
+        self.requests: List[Dict] = []
+        self._failures: List[JSONResponse] = []
+        self.app = FastAPI()
+        self.app.post("/v18.0/me/messages")(self._send)
+
+    def fail_next(self, status: int, code: int, retry_after: Optional[float] = None, transient: bool = False) -> None:
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        error = {"message": f"stub error {code}", "code": code, "is_transient": transient}
+        self._failures.append(JSONResponse({"error": error}, status_code=status, headers=headers))
+
+    async def _send(self, request: Request):
+        body = await request.json()
+        entry = {
+            "at": time.monotonic(),
+            "recipient": body["recipient"]["id"],
+            "text": body["message"]["text"],
+            "access_token": body.get("access_token"),
+            "idempotency_key": request.headers.get("idempotency-key")
+        }
+        self.requests.append(entry)
+        if self._failures:
+            entry["status"] = self._failures[0].status_code
+            return self._failures.pop(0)
+        entry["status"] = 200
+        return {"recipient_id": entry["recipient"], "message_id": f"m{len(self.requests)}"}
+
+    @property
+    def delivered(self) -> List[Dict]:
+        return [entry for entry in self.requests if entry["status"] == 200]
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app))
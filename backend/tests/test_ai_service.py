@@ -0,0 +1,160 @@
+"""
+Tests for reply delivery within the message deadline
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.models.merchant import Merchant
+from app.services.ai_service import AIService, PreparedPrompt
+from app.services.deadline import Deadline
+from app.services.llm_client import LLMError, LLMRequestError
+from app.services.model_router import Route
+from app.services.response_cache import ResponseCache
+
+class FakeStream:
+    """LLM stream that produces its reply after delay seconds"""
+
+    def __init__(self, deltas, delay: float = 0.0, error: Exception = None):
+        self.deltas = deltas
+        self.delay = delay
+        self.error = error
+        self.model = "gpt-4o-mini"
+        self.first_token_latency = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    async def chunks(self):
+        await asyncio.sleep(self.delay)
+        self.first_token_latency = self.delay
+        for delta in self.deltas:
+            yield delta
+        if self.error:
+            raise self.error
+
+class FakeLLM:
+    def __init__(self, stream: FakeStream):
+        self._stream = stream
+
+    def stream(self, **request):
+        return self._stream
+
+def merchant() -> Merchant:
+    return Merchant(id="m1", business_name="Shop", subscription_tier="starter", product_catalog=[], working_hours={})
+
+def prepared(merchant: Merchant, text: str) -> PreparedPrompt:
+    route = Route(complexity="simple", model="gpt-4o-mini", tier="starter", language="en", reason="test")
+    return PreparedPrompt([{"role": "user", "content": text}], 10, 1000, True, merchant, text, route)
+
+@pytest.fixture
+def sends():
+    sent = []
+
+    async def send(text: str) -> bool:
+        sent.append(text)
+        return True
+
+    return sent, send
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("streaming", [True, False])
+async def test_expired_deadline_sends_nothing(sends, monkeypatch, streaming):
+    sent, send = sends
+    monkeypatch.setattr(settings, "ENABLE_STREAMING_REPLIES", streaming)
+    service = AIService()
+    deadline = Deadline(settings.EVENT_DEADLINE, started_at=time.time() - settings.EVENT_DEADLINE - 5)
+
+    delivered = await service.deliver_response("What are your hours?", merchant(), "user", None, send, deadline)
+    assert delivered is None
+    assert sent == []
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("streaming", [True, False])
+async def test_templated_reply_is_not_sent_after_the_deadline(sends, monkeypatch, streaming):
+    sent, send = sends
+    monkeypatch.setattr(settings, "ENABLE_STREAMING_REPLIES", streaming)
+    service = AIService()
+
+    async def slow_prepare(message_text, merchant, sender_id, db, deadline=None):
+        await asyncio.sleep(0.1)  # e.g. a slow history lookup
+        return "We're open 9 to 5.", None
+
+    monkeypatch.setattr(service, "_prepare", slow_prepare)
+    delivered = await service.deliver_response("hours?", merchant(), "user", None, send, Deadline(0.05))
+    assert delivered is None
+    assert sent == []
+
+@pytest.mark.asyncio
+async def test_streamed_reply_past_the_deadline_is_dropped(sends, monkeypatch):
+    sent, send = sends
+    monkeypatch.setattr(settings, "ENABLE_STREAMING_REPLIES", True)
+    service = AIService()
+    shop = merchant()
+
+    async def prepare(message_text, merchant, sender_id, db, deadline=None):
+        return None, prepared(shop, message_text)
+
+    monkeypatch.setattr(service, "_prepare", prepare)
+    monkeypatch.setattr(service, "_skip_model", lambda deadline, merchant: False)
+    service.llm = FakeLLM(FakeStream(["Hello there. ", "How can I help?"], delay=0.2))
+    delivered = await service.deliver_response("hello", shop, "user", None, send, Deadline(0.1))
+    assert delivered is None
+    assert sent == []
+
+@pytest.fixture
+def streamed(monkeypatch):
+    """Service streaming split replies into a fresh response cache"""
+    monkeypatch.setattr(settings, "ENABLE_STREAMING_REPLIES", True)
+    monkeypatch.setattr(settings, "REPLY_SPLIT_CHARS", 20)
+    cache = ResponseCache(ttl_seconds=60)
+    monkeypatch.setattr("app.services.ai_service.response_cache", cache)
+    service = AIService()
+    shop = merchant()
+
+    async def prepare(message_text, merchant, sender_id, db, deadline=None):
+        return None, prepared(shop, message_text)
+
+    monkeypatch.setattr(service, "_prepare", prepare)
+    monkeypatch.setattr(service, "_skip_model", lambda deadline, merchant: False)
+    return service, shop, cache
+
+@pytest.mark.asyncio
+async def test_complete_streamed_reply_is_cached(streamed, sends):
+    service, shop, cache = streamed
+    sent, send = sends
+    service.llm = FakeLLM(FakeStream(["Hello there. ", "How can I help?"]))
+
+    delivered = await service.deliver_response("hello", shop, "user", None, send, Deadline(5))
+    assert sent == ["Hello there.", "How can I help?"]
+    assert delivered == "Hello there.\nHow can I help?"
+    assert cache.get(shop, "hello") == delivered
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [LLMError("connection reset"), LLMRequestError("context length exceeded")])
+async def test_stream_failing_partway_is_not_cached(streamed, sends, error):
+    service, shop, cache = streamed
+    sent, send = sends
+    service.llm = FakeLLM(FakeStream(["Hello there. ", "How can"], error=error))
+
+    delivered = await service.deliver_response("hello", shop, "user", None, send, Deadline(5))
+    assert sent == ["Hello there."]
+    assert delivered == "Hello there."
+    assert cache.get(shop, "hello") is None
+
+@pytest.mark.asyncio
+async def test_reply_with_a_failed_send_is_not_cached(streamed):
+    service, shop, cache = streamed
+    sent = []
+
+    async def send(text: str) -> bool:
+        if sent:
+            return False  # the second message is rejected
+        sent.append(text)
+        return True
+
+    service.llm = FakeLLM(FakeStream(["Hello there. ", "How can I help?"]))
+    delivered = await service.deliver_response("hello", shop, "user", None, send, Deadline(5))
+    assert delivered == "Hello there."
+    assert cache.get(shop, "hello") is None
@@ -0,0 +1,89 @@
+"""
+Tests for the async database layer and the merchant API running on it
+"""
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from app.api import merchants
+from app.core.database import async_database_url, create_async_database_engine, get_async_db
+from app.models.merchant import Merchant
+from app.services.merchant_cache import merchant_cache
+
+@pytest.mark.parametrize("url, expected", [
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    ("postgresql://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("postgres://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("postgresql+psycopg2://u:p@db/shop", "postgresql+asyncpg://u:p@db/shop"),
+    ("sqlite+aiosqlite:///x.db", "sqlite+aiosqlite:///x.db"),
+])
+def test_async_driver_urls(url, expected):
+    assert async_database_url(url) == expected
+
+@pytest.mark.asyncio
+async def test_sqlite_connections_use_wal_and_wait_for_the_lock(tmp_path):
+    engine = create_async_database_engine(f"sqlite+aiosqlite:///{tmp_path / 'pragmas.db'}")
+    async with engine.connect() as connection:
+        assert (await connection.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        assert (await connection.execute(text("PRAGMA busy_timeout"))).scalar() == 10000
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_concurrent_async_writers_do_not_fail(session_factory):
+    async def add(n: int):
+        async with session_factory() as db:
+            db.add(Merchant(
+                id=f"m{n}", instagram_page_id=f"p{n}", page_name="Shop",
+                access_token_hash="token", business_name="Shop"
+            ))
+            await db.commit()
+
+    await asyncio.gather(*(add(n) for n in range(10)))
+    async with session_factory() as db:
+        assert (await db.execute(text("SELECT COUNT(*) FROM merchants"))).scalar() == 10
+
+@pytest_asyncio.fixture
+async def api(session_factory):
+    """Merchant API on the test database, authenticated as merchant m1"""
+    async with session_factory() as db:
+        db.add(Merchant(
+            id="m1", instagram_page_id="p1", page_name="Shop", access_token_hash="token",
+            business_name="Shop", product_catalog=[]
+        ))
+        await db.commit()
+
+    async def test_db():
+        async with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(merchants.merchants_router)
+    app.dependency_overrides[get_async_db] = test_db
+    app.dependency_overrides[merchants.get_current_merchant_id] = lambda: "m1"
+    merchant_cache.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api.test") as client:
+        yield client
+    merchant_cache.clear()
+
+PRODUCT = {"name": "Ceramic Mug", "description": "Holds hot drinks", "price": "10"}
+
+@pytest.mark.asyncio
+async def test_profile_update_is_visible_to_cached_reads(api):
+    assert (await api.get("/profile")).json()["business_name"] == "Shop"
+    response = await api.put("/profile", json={"business_info": {"business_name": "Mug House"}})
+    assert response.status_code == 200
+    assert (await api.get("/profile")).json()["business_name"] == "Mug House"
+
+@pytest.mark.asyncio
+async def test_product_changes_are_persisted(api):
+    assert (await api.get("/products")).json()["total_products"] == 0
+    assert (await api.post("/products", json=PRODUCT)).status_code == 200
+    assert (await api.put("/products/0", json={**PRODUCT, "price": "12"})).json()["product"]["price"] == "12"
+    assert (await api.get("/products")).json()["products"][0]["price"] == "12"
+
+    assert (await api.delete("/products/0")).json()["remaining_products"] == 0
+    assert (await api.get("/products")).json()["total_products"] == 0
@@ -0,0 +1,60 @@
+"""
+Tests for bounded conversation history
+"""
+import pytest
+
+from app.services.conversation_store import ConversationStore
+
+async def chat(store: ConversationStore, db, exchanges: int, sender_id: str = "s1") -> None:
+    for n in range(exchanges):
+        await store.record_exchange(db, "m1", sender_id, f"question {n}", f"answer {n}")
+
+@pytest.mark.asyncio
+async def test_history_keeps_only_the_latest_turns(db):
+    store = ConversationStore(max_turns=4)
+    await chat(store, db, 3)
+    assert await store.history(db, "m1", "s1") == [
+        ("user", "question 1"), ("assistant", "answer 1"),
+        ("user", "question 2"), ("assistant", "answer 2")
+    ]
+
+@pytest.mark.asyncio
+async def test_truncated_history_reloads_from_the_table(db):
+    await chat(ConversationStore(max_turns=4), db, 3)
+    # A new worker (or one that evicted the thread) reads the same latest turns
+    store = ConversationStore(max_turns=3)
+    assert await store.history(db, "m1", "s1") == [
+        ("assistant", "answer 1"), ("user", "question 2"), ("assistant", "answer 2")
+    ]
+    assert store.stats()["reloads"] == 1
+
+@pytest.mark.asyncio
+async def test_conversations_are_kept_apart(db):
+    store = ConversationStore()
+    await chat(store, db, 1, "s1")
+    await chat(store, db, 2, "s2")
+    assert len(await store.history(db, "m1", "s1")) == 2
+    assert len(await store.history(db, "m1", "s2")) == 4
+    assert await store.history(db, "m2", "s1") == []
+
+@pytest.mark.asyncio
+async def test_idle_and_overflowing_threads_are_evicted(db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("app.services.conversation_store.time.monotonic", lambda: clock[0])
+    store = ConversationStore(idle_seconds=60, max_conversations=2)
+    for sender_id in ("s1", "s2", "s3"):
+        await chat(store, db, 1, sender_id)
+    assert store.stats()["conversations"] == 2
+
+    clock[0] += 61
+    assert await store.history(db, "m1", "s1") == [("user", "question 0"), ("assistant", "answer 0")]
+    assert store.stats()["conversations"] == 1
+    assert store.stats()["evictions"] == 3
+
+@pytest.mark.asyncio
+async def test_no_history_without_a_session_or_sender(db):
+    store = ConversationStore()
+    await store.record_exchange(None, "m1", "s1", "hi", "hello")
+    assert await store.history(db, "m1", "s1") == []
+    assert await store.history(db, "m1", "") == []
+    assert await ConversationStore(max_turns=0).history(db, "m1", "s1") == []
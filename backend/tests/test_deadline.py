@@ -0,0 +1,56 @@
+"""
+Tests for per-message deadlines
+"""
+import pytest
+
+from app.services.deadline import Deadline, DeadlineStats
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.deadline.time.time", lambda: now[0])
+    return now
+
+def test_deadline_expires_after_its_budget(clock):
+    deadline = Deadline(10)
+    assert deadline.remaining() == 10 and not deadline.expired
+    clock[0] += 9.5
+    assert deadline.allows(0.5) and not deadline.allows(1)
+    clock[0] += 0.5
+    assert deadline.expired
+    clock[0] += 5
+    assert deadline.remaining() == 0.0
+
+def test_clock_starts_at_receipt(clock):
+    deadline = Deadline(10, started_at=clock[0] - 12)
+    assert deadline.expired
+    assert deadline.timeout(5) == 0.0
+
+def test_timeout_reserves_time_for_later_stages(clock):
+    deadline = Deadline(10)
+    assert deadline.timeout(3) == 3
+    assert deadline.timeout(30, reserve=2) == 8
+    clock[0] += 9
+    assert deadline.timeout(30, reserve=2) == 0.0
+
+def test_laps_charge_each_stage(clock):
+    deadline = Deadline(10, started_at=clock[0] - 1)
+    assert deadline.lap("queue") == 1
+    clock[0] += 2
+    deadline.lap("model")
+    clock[0] += 0.5
+    deadline.lap("model")
+    assert deadline.stages == {"queue": 1, "model": 2.5}
+
+def test_stats_count_met_degraded_and_late(clock):
+    stats = DeadlineStats()
+    on_time = Deadline(10)
+    degraded = Deadline(10)
+    degraded.degraded = True
+    late = Deadline(10, started_at=clock[0] - 11)
+    on_time.lap("model")
+    for deadline in (on_time, degraded, late):
+        stats.record(deadline)
+    summary = stats.stats()
+    assert summary["outcomes"] == {"met": 1, "degraded": 1, "late": 1}
+    assert set(summary["stages"]) == {"model"}
@@ -0,0 +1,43 @@
+"""
+Tests for per-conversation ordering in the event dispatcher
+"""
+import asyncio
+import random
+
+import pytest
+
+from app.services.event_dispatcher import EventDispatcher
+
+@pytest.mark.asyncio
+async def test_jobs_of_one_conversation_run_in_submission_order():
+    dispatcher = EventDispatcher(lanes=8, max_concurrency=4)
+    finished = {"alice": [], "bob": []}
+
+    async def job(key: str, n: int):
+        await asyncio.sleep(random.uniform(0, 0.01))  # later jobs may be quicker
+        finished[key].append(n)
+
+    await asyncio.gather(*[
+        dispatcher.run(key, lambda key=key, n=n: job(key, n))
+        for n in range(10)
+        for key in ("alice", "bob")
+    ])
+    assert finished == {"alice": list(range(10)), "bob": list(range(10))}
+
+@pytest.mark.asyncio
+async def test_conversations_run_concurrently_up_to_the_limit():
+    dispatcher = EventDispatcher(lanes=64, max_concurrency=2)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    keys = [key for key in range(100) if dispatcher.lane_for(key) != dispatcher.lane_for(0)][:3] + [0]
+    await asyncio.gather(*[dispatcher.run(key, job) for key in keys])
+    assert peak == 2
+    assert dispatcher.stats()["in_flight"] == 0
@@ -0,0 +1,103 @@
+"""
+Tests for the weighted fair scheduler
+"""
+import asyncio
+
+import pytest
+
+from app.services.fair_scheduler import FairScheduler
+
+TIERS = {
+    "starter": {"scheduler_weight": 1, "max_in_flight": 4, "max_queued": 4},
+    "business": {"scheduler_weight": 4, "max_in_flight": 8, "max_queued": 16},
+}
+
+@pytest.mark.asyncio
+async def test_slots_are_shared_by_weight():
+    scheduler = FairScheduler(max_concurrency=1, tiers=TIERS)
+    order = []
+    gate = asyncio.Event()
+
+    async def job(name):
+        order.append(name)
+        await asyncio.sleep(0)
+
+    # Hold the only slot until both merchants have a backlog
+    blocker = asyncio.create_task(scheduler.run("blocker", "starter", gate.wait))
+    await asyncio.sleep(0)
+    jobs = [asyncio.create_task(scheduler.run("big", "business", lambda: job("big"))) for _ in range(10)]
+    jobs += [asyncio.create_task(scheduler.run("small", "starter", lambda: job("small"))) for _ in range(10)]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *jobs)
+
+    first_ten = order[:10]
+    assert first_ten.count("big") == 8
+    assert first_ten.count("small") == 2
+    assert scheduler.in_flight == 0 and scheduler.waiting == 0
+
+@pytest.mark.asyncio
+async def test_merchant_is_capped_at_max_in_flight():
+    scheduler = FairScheduler(max_concurrency=10, tiers=TIERS)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await asyncio.gather(*(scheduler.run("m1", "starter", job) for _ in range(12)))
+    assert peak == TIERS["starter"]["max_in_flight"]
+
+@pytest.mark.asyncio
+async def test_capped_merchant_leaves_slots_to_others():
+    scheduler = FairScheduler(max_concurrency=6, tiers=TIERS)
+    gate = asyncio.Event()
+    started = []
+
+    async def job(name):
+        started.append(name)
+        await gate.wait()
+
+    tasks = [asyncio.create_task(scheduler.run("busy", "starter", lambda: job("busy"))) for _ in range(6)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(scheduler.run("other", "starter", lambda: job("other"))))
+    await asyncio.sleep(0.01)
+    assert started.count("busy") == 4
+    assert "other" in started
+    gate.set()
+    await asyncio.gather(*tasks)
+
+@pytest.mark.asyncio
+async def test_room_reflects_queue_depth():
+    scheduler = FairScheduler(max_concurrency=1, tiers=TIERS)
+    assert scheduler.room("m1", "starter") == 4
+    assert scheduler.room("m1", "unknown-tier") == 4
+
+    gate = asyncio.Event()
+    tasks = [asyncio.create_task(scheduler.run("m1", "starter", gate.wait)) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert scheduler.room("m1", "starter") == 2  # one running, two waiting
+    gate.set()
+    await asyncio.gather(*tasks)
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    scheduler = FairScheduler(max_concurrency=1, tiers=TIERS)
+    gate = asyncio.Event()
+    running = asyncio.create_task(scheduler.run("m1", "starter", gate.wait))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(scheduler.run("m2", "starter", gate.wait))
+    await asyncio.sleep(0)
+    assert scheduler.waiting == 1
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.waiting == 0
+    gate.set()
+    await running
+    assert scheduler.in_flight == 0
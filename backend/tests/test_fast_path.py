@@ -0,0 +1,138 @@
+"""
+Tests for fast-path answers and business hours parsing
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.merchant import Merchant
+from app.services.business_hours import compile_schedule, parse_ranges
+from app.services.fast_path import AVAILABILITY, HOURS, PRICE, FastPathResponder, day_references, detect_intents
+from app.services.text_normalizer import normalize_text
+
+HOURS_JSON = {
+    "timezone": "UTC",
+    "mon-fri": "9:00 AM - 6:00 PM",
+    "saturday": "10-14, 16-22",
+    "sunday": "Closed",
+}
+CATALOG = [
+    {"name": "Leather Wallet", "price": "$25", "availability": "In stock"},
+    {"name": "Canvas Tote Bag", "price": "$18", "availability": "Sold out"},
+]
+
+# 2024-06-03 is a Monday
+MONDAY_NOON = datetime(2024, 6, 3, 12, 0, tzinfo=timezone.utc)
+MONDAY_NIGHT = datetime(2024, 6, 3, 20, 0, tzinfo=timezone.utc)
+SATURDAY_AFTERNOON = datetime(2024, 6, 8, 15, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def merchant():
+    return Merchant(id="merchant-1", working_hours=HOURS_JSON, product_catalog=CATALOG)
+
+@pytest.mark.parametrize("value, expected", [
+    ("9:00 AM - 6:00 PM", [(540, 1080)]),
+    ("9 - 6", [(540, 1080)]),
+    ("10-14, 16-22", [(600, 840), (960, 1320)]),
+    ("6 PM - 2 AM", [(1080, 1560)]),
+    ("24/7", [(0, 1440)]),
+    ("Closed", []),
+    ("٩ص - ٥م", [(540, 1020)]),
+    ("whenever", None),
+])
+def test_parse_ranges(value, expected):
+    assert parse_ranges(value) == expected
+
+def test_schedule_open_checks():
+    schedule = compile_schedule(HOURS_JSON)
+    assert schedule.open_range(MONDAY_NOON) == (540, 1080)
+    assert not schedule.is_open(MONDAY_NIGHT)
+    assert not schedule.is_open(SATURDAY_AFTERNOON)  # lunch break
+    assert schedule.next_opening(MONDAY_NIGHT) == (1, 540)
+    assert schedule.next_opening(datetime(2024, 6, 8, 23, 0, tzinfo=timezone.utc)) == (2, 540)
+
+def test_overnight_hours_carry_into_next_day():
+    schedule = compile_schedule({"timezone": "UTC", "friday": "6 PM - 2 AM"})
+    assert schedule.open_range(datetime(2024, 6, 8, 1, 0, tzinfo=timezone.utc)) == (-360, 120)
+
+def test_unreadable_hours_compile_to_none():
+    assert compile_schedule({"monday": "whenever"}) is None
+    assert compile_schedule({}) is None
+
+@pytest.mark.parametrize("message, intents", [
+    ("What are your opening hours?", [HOURS]),
+    ("how much is the wallet", [PRICE]),
+    ("Do you have the tote bag?", [AVAILABILITY]),
+    ("متى تفتحون؟ شو الدوام", [HOURS]),
+    ("بكم المحفظة", [PRICE]),
+    ("hello there", []),
+])
+def test_detect_intents(message, intents):
+    assert detect_intents(normalize_text(message)) == intents
+
+def test_hours_open_now(merchant):
+    result = FastPathResponder().match(merchant, "are you open?", MONDAY_NOON)
+    assert result.intent == HOURS
+    assert result.confidence >= 0.9
+    assert result.response.startswith("Yes, we're open now until 6:00 PM")
+
+def test_hours_closed_names_next_opening(merchant):
+    result = FastPathResponder().match(merchant, "what are your hours", MONDAY_NIGHT)
+    assert "open again tomorrow at 9:00 AM" in result.response
+
+def test_hours_reply_in_arabic(merchant):
+    result = FastPathResponder().match(merchant, "شو مواعيد الدوام", MONDAY_NOON)
+    assert result.response.startswith("نعم، نحن مفتوحون الآن")
+
+def test_price_of_named_product(merchant):
+    responder = FastPathResponder()
+    assert responder.answer(merchant, "how much is the leather wallet?") == "Leather Wallet costs $25."
+    assert responder.stats()["answered"][PRICE] == 1
+
+def test_availability_of_sold_out_product(merchant):
+    reply = FastPathResponder().answer(merchant, "is the canvas tote bag available?")
+    assert reply == "Sorry, Canvas Tote Bag is currently out of stock."
+
+def test_out_of_scope_goes_to_the_model(merchant):
+    responder = FastPathResponder()
+    assert responder.answer(merchant, "I want to order the leather wallet, how much is delivery?") is None
+    assert responder.stats()["low_confidence"] == 1
+
+def test_no_intent_is_unmatched(merchant):
+    responder = FastPathResponder()
+    assert responder.answer(merchant, "thank you!") is None
+    assert responder.stats()["unmatched"] == 1
+
+@pytest.mark.parametrize("message, references", [
+    ("are you open on Friday?", [("on", 4)]),
+    ("open tomorrow?", [("in", 1)]),
+    ("بكرة فاتحين؟", [("in", 1)]),
+    ("بعد بكرة مفتوحين؟", [("in", 2)]),
+    ("هل انتم مفتوحين يوم الجمعة؟", [("on", 4)]),
+    ("open saturday or sunday?", [("on", 5), ("on", 6)]),
+    ("are you open now?", []),
+])
+def test_day_references(message, references):
+    assert day_references(normalize_text(message)) == references
+
+def test_hours_for_a_named_day(merchant):
+    result = FastPathResponder().match(merchant, "are you open on Saturday?", MONDAY_NOON)
+    assert result.confidence >= 0.9
+    assert result.response.startswith("Yes, we're open on Saturday from 10:00 AM to 2:00 PM and 4:00 PM to 10:00 PM.")
+
+def test_hours_for_a_closed_day(merchant):
+    result = FastPathResponder().match(merchant, "open sunday?", MONDAY_NOON)
+    assert result.response.startswith("Sorry, we're closed on Sunday.")
+
+def test_hours_tomorrow_in_arabic(merchant):
+    # Saturday afternoon: tomorrow is Sunday, when the shop is closed
+    result = FastPathResponder().match(merchant, "بكرة فاتحين؟", SATURDAY_AFTERNOON)
+    assert result.response.startswith("عذراً، نحن مغلقون غداً")
+
+def test_hours_today_keeps_open_now_answer(merchant):
+    result = FastPathResponder().match(merchant, "are you open today?", MONDAY_NOON)
+    assert result.response.startswith("Yes, we're open now until 6:00 PM")
+
+def test_several_days_go_to_the_model(merchant):
+    responder = FastPathResponder(min_confidence=0.75)
+    assert responder.answer(merchant, "open saturday or sunday?", MONDAY_NOON) is None
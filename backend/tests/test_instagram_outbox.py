@@ -0,0 +1,119 @@
+"""
+Tests for the Instagram outbox against a local Graph API stand-in
+"""
+import asyncio
+import hashlib
+import time
+
+import pytest
+from cryptography.fernet import Fernet
+
+from app.core import token_crypto
+from app.core.config import settings
+from app.core.token_crypto import TokenDecryptionError, TokenKeyError, decrypt_token, encrypt_token
+from app.models.merchant import Merchant
+from app.services.instagram_outbox import InstagramOutbox
+from app.services.instagram_service import InstagramService
+from app.services.rate_limiter import MemoryBucketStore, RateLimiter
+from graph_stub import BASE_URL, GraphStub
+
+@pytest.fixture
+def graph():
+    return GraphStub()
+
+def make_outbox(graph: GraphStub, session_factory=None, **options) -> InstagramOutbox:
+    settings = {"rate_per_second": 100.0, "burst": 20.0, "backoff_base": 0.01, "backoff_max": 0.05}
+    settings.update(options)
+    return InstagramOutbox(
+        BASE_URL,
+        RateLimiter(MemoryBucketStore()),
+        http_client=graph.client(),
+        session_factory=session_factory,
+        **settings
+    )
+
+@pytest.mark.asyncio
+async def test_sends_are_paced_per_page(graph):
+    outbox = make_outbox(graph, rate_per_second=20.0, burst=2.0)
+    started = time.monotonic()
+    results = await asyncio.gather(*[
+        outbox.send("page", f"user{n}", [f"hello {n}"], "token") for n in range(6)
+    ])
+    assert all(results)
+    assert len(graph.delivered) == 6
+    # Two go out on the burst, the other four one refill (50 ms) apart
+    assert time.monotonic() - started >= 4 / 20.0 - 0.02
+    assert outbox.stats()["paced"] >= 4
+
+@pytest.mark.asyncio
+async def test_throttled_send_waits_for_retry_after(graph):
+    outbox = make_outbox(graph)
+    graph.fail_next(429, code=613, retry_after=0.2)
+    assert await outbox.send("page", "user", ["hello"], "token")
+
+    first, second = graph.requests
+    assert (first["status"], second["status"]) == (429, 200)
+    assert second["at"] - first["at"] >= 0.2
+    assert first["idempotency_key"] == second["idempotency_key"]
+    stats = outbox.stats()
+    assert (stats["throttled"], stats["retries"], stats["sent"]) == (1, 1, 1)
+
+@pytest.mark.asyncio
+async def test_chunks_arrive_in_order_across_retries(graph):
+    outbox = make_outbox(graph)
+    graph.fail_next(500, code=2, transient=True)  # the first chunk fails once
+    reply = outbox.send("page", "user", ["part 1", "part 2", "part 3"], "token", idempotency_key="mid.1:1")
+    follow_up = outbox.send("page", "user", ["follow up"], "token", idempotency_key="mid.2:1")
+    assert await reply and await follow_up
+    assert [entry["text"] for entry in graph.delivered] == ["part 1", "part 2", "part 3", "follow up"]
+
+@pytest.mark.asyncio
+async def test_later_chunks_are_dropped_when_one_fails(graph):
+    outbox = make_outbox(graph, max_attempts=1)
+    graph.fail_next(400, code=100)
+    assert not await outbox.send("page", "user", ["part 1", "part 2"], "token")
+    assert graph.delivered == []
+    assert outbox.stats()["skipped"] == 1
+
+@pytest.mark.asyncio
+async def test_sent_chunks_are_not_sent_again_by_another_outbox(graph, session_factory):
+    first = make_outbox(graph, session_factory=session_factory)
+    assert await first.send("page", "user", ["part 1", "part 2"], "token", idempotency_key="mid.1:1")
+
+    # A fresh process (empty memory) retrying the same webhook job
+    second = make_outbox(graph, session_factory=session_factory)
+    assert await second.send("page", "user", ["part 1", "part 2"], "token", idempotency_key="mid.1:1")
+    assert len(graph.delivered) == 2
+    assert second.stats()["duplicates"] == 2
+
+def test_access_tokens_round_trip_through_encryption():
+    stored = encrypt_token("IGQVJ-secret")
+    assert stored != "IGQVJ-secret"
+    assert decrypt_token(stored) == "IGQVJ-secret"
+
+@pytest.mark.parametrize("secret_key", ["ultra-low-cost-instagram-ai-agent-v2", "your-super-secret-key-change-in-production"])
+def test_public_secret_key_is_refused(monkeypatch, secret_key):
+    monkeypatch.setattr(token_crypto, "_cipher", None)
+    monkeypatch.setattr(settings, "TOKEN_ENCRYPTION_KEY", "")
+    monkeypatch.setattr(settings, "SECRET_KEY", secret_key)
+    with pytest.raises(TokenKeyError):
+        token_crypto.check_token_key()
+    with pytest.raises(TokenKeyError):
+        encrypt_token("IGQVJ-secret")
+
+    # An explicit encryption key does not depend on SECRET_KEY
+    monkeypatch.setattr(settings, "TOKEN_ENCRYPTION_KEY", Fernet.generate_key().decode())
+    token_crypto.check_token_key()
+    assert decrypt_token(encrypt_token("IGQVJ-secret")) == "IGQVJ-secret"
+
+@pytest.mark.asyncio
+async def test_undecryptable_token_fails_loudly(graph):
+    service = InstagramService(outbox=make_outbox(graph))
+    legacy = Merchant(instagram_page_id="page", access_token_hash=hashlib.sha256(b"token").hexdigest())
+    with pytest.raises(TokenDecryptionError):
+        await service.send_message("user", "hello", legacy)
+    assert graph.requests == []
+
+    merchant = Merchant(instagram_page_id="page", access_token_hash=encrypt_token("IGQVJ-secret"))
+    assert await service.send_message("user", "hello", merchant)
+    assert graph.delivered[0]["access_token"] == "IGQVJ-secret"
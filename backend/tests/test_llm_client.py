@@ -0,0 +1,74 @@
+"""
+Tests for LLM client timeouts and governor token accounting
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.llm_client import LLMClient, LLMThrottledError, LLMTimeoutError
+from app.services.llm_governor import LLMGovernor
+from app.services.rate_limiter import MemoryBucketStore, RateLimiter
+
+TPM = 60000
+
+class FakeCompletions:
+    """chat.completions stand-in answering after delay seconds"""
+
+    def __init__(self, delay: float = 0.0, prompt_tokens: int = 200, completion_tokens: int = 100):
+        self.delay = delay
+        self.usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    async def create(self, model, **kwargs):
+        await asyncio.sleep(self.delay)
+        message = SimpleNamespace(content="Hello!")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self.usage, model=model)
+
+def make_client(completions: FakeCompletions, max_concurrency: int = 4):
+    store = MemoryBucketStore()
+    governor = LLMGovernor(
+        RateLimiter(store), {"m": {"rpm": 600, "tpm": TPM}}, headroom=1.0, burst=1.0, max_concurrency=max_concurrency
+    )
+    client = LLMClient("test-key", max_concurrency=max_concurrency, governor=governor)
+    client._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return client, governor, store
+
+def tpm_tokens(store: MemoryBucketStore) -> float:
+    return store._buckets["llm_tpm:m"][0]
+
+async def complete(client: LLMClient, timeout: float = 1.0):
+    messages = [{"role": "user", "content": "hi"}]
+    return await client.complete(messages, "m", max_tokens=500, temperature=0.0, timeout=timeout, estimated_tokens=1000)
+
+@pytest.mark.asyncio
+async def test_completion_refunds_unused_tokens():
+    client, governor, store = make_client(FakeCompletions())
+    completion = await complete(client)
+    assert completion.content == "Hello!"
+    # 1500 tokens were admitted (prompt estimate plus max_tokens); 300 were used
+    assert tpm_tokens(store) == pytest.approx(TPM - 300, abs=5)
+    assert governor.stats()["refunded_tokens"] == 1200
+
+@pytest.mark.asyncio
+async def test_slot_wait_timeout_leaves_the_limit_and_refunds_tokens():
+    client, governor, store = make_client(FakeCompletions(delay=0.3))
+    client.max_concurrency = 1
+    client._semaphore = asyncio.Semaphore(1)
+    busy = asyncio.create_task(complete(client))
+    await asyncio.sleep(0.01)
+    limit = governor.limits["m"].limit
+    with pytest.raises(LLMThrottledError):
+        await complete(client, timeout=0.05)
+    assert governor.limits["m"].limit == limit
+    assert governor.limits["m"].decreases == 0
+    await busy
+    # The throttled call gets all 1500 tokens back, the one that ran its unused 1200
+    assert governor.stats()["refunded_tokens"] == 2700
+
+@pytest.mark.asyncio
+async def test_timeout_after_send_cuts_the_limit():
+    client, governor, store = make_client(FakeCompletions(delay=0.3))
+    with pytest.raises(LLMTimeoutError):
+        await complete(client, timeout=0.05)
+    assert governor.limits["m"].decreases == 1
+    assert governor.limits["m"].limit < 2
@@ -0,0 +1,168 @@
+"""
+Tests for circuit breakers, hedged requests and the model fallback chain
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services import llm_resilience
+from app.services.llm_client import (
+    LLMCompletion, LLMRequestError, LLMThrottledError, LLMUnavailableError
+)
+from app.services.llm_resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LLMCircuitOpenError, ResilientLLM
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_resilience.time, "monotonic", lambda: now[0])
+    return now
+
+def tripped(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(window_seconds=30, min_calls=4, error_rate=0.5, cooldown=10)
+    for ok in (True, True, False, False):
+        assert breaker.allow()
+        breaker.record(ok)
+    return breaker
+
+def test_breaker_opens_at_the_error_rate(clock):
+    breaker = tripped(clock)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+def test_breaker_needs_min_calls_and_forgets_old_errors(clock):
+    breaker = CircuitBreaker(window_seconds=30, min_calls=4, error_rate=0.5)
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == CLOSED
+    clock[0] += 31
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    assert breaker.error_rate == 1.0
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = tripped(clock)
+    clock[0] += 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+def test_failed_probe_reopens(clock):
+    breaker = tripped(clock)
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    assert not breaker.allow()
+
+def test_skipped_probe_can_go_again(clock):
+    breaker = tripped(clock)
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.skip()  # e.g. the governor held the call back
+    assert breaker.allow()
+
+class FakeClient:
+    """LLM client whose models answer, fail or hang as scripted"""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = []
+        self.cancelled = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_concurrency = 8
+
+    async def complete(self, messages, model, max_tokens, temperature, timeout=None, estimated_tokens=None):
+        self.calls.append(model)
+        action = self.behaviour[model]
+        if isinstance(action, list):
+            action = action.pop(0)
+        if isinstance(action, Exception):
+            raise action
+        try:
+            await asyncio.sleep(action)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return LLMCompletion(content=f"from {model}", model=model, prompt_tokens=1, completion_tokens=1, latency=action)
+
+def resilient(client: FakeClient, **options) -> ResilientLLM:
+    options.setdefault("hedge_enabled", False)
+    return ResilientLLM(client, ["primary", "backup"], **options)
+
+async def ask(llm: ResilientLLM, **options) -> LLMCompletion:
+    return await llm.complete([{"role": "user", "content": "hi"}], 50, 0.2, **options)
+
+@pytest.mark.asyncio
+async def test_failure_falls_back_to_the_next_model():
+    client = FakeClient({"primary": LLMUnavailableError("502"), "backup": 0})
+    llm = resilient(client)
+    completion = await ask(llm)
+    assert completion.model == "backup"
+    assert llm.stats()["fallbacks"] == 1
+    assert llm.breakers["primary"].stats()["calls_in_window"] == 1
+
+@pytest.mark.asyncio
+async def test_routed_model_goes_first():
+    client = FakeClient({"primary": 0, "backup": 0})
+    assert (await ask(resilient(client), model="backup")).model == "backup"
+    assert client.calls == ["backup"]
+
+@pytest.mark.asyncio
+async def test_invalid_request_is_not_retried_elsewhere():
+    client = FakeClient({"primary": LLMRequestError("context too long"), "backup": 0})
+    llm = resilient(client)
+    with pytest.raises(LLMRequestError):
+        await ask(llm)
+    assert client.calls == ["primary"]
+    assert llm.breakers["primary"].error_rate == 0.0
+
+@pytest.mark.asyncio
+async def test_throttled_model_is_skipped_without_counting_against_it():
+    client = FakeClient({"primary": LLMThrottledError("no budget"), "backup": 0})
+    llm = resilient(client)
+    assert (await ask(llm)).model == "backup"
+    assert llm.breakers["primary"].stats()["calls_in_window"] == 0
+
+@pytest.mark.asyncio
+async def test_open_breakers_short_circuit_the_chain():
+    client = FakeClient({"primary": 0, "backup": 0})
+    llm = resilient(client)
+    for model in ("primary", "backup"):
+        llm.breakers[model]._trip(time.monotonic())
+    with pytest.raises(LLMCircuitOpenError):
+        await ask(llm)
+    assert client.calls == []
+    assert llm.stats()["exhausted"] == 1
+
+@pytest.mark.asyncio
+async def test_slow_attempt_is_hedged_and_the_loser_cancelled():
+    client = FakeClient({"primary": [5.0, 0.0], "backup": 0})
+    llm = resilient(client, hedge_enabled=True, hedge_min_delay=0.05, hedge_max_ratio=1.0)
+    for _ in range(20):
+        llm._tracker("primary", "complete").add(0.01)
+
+    completion = await asyncio.wait_for(ask(llm, tier="business"), timeout=2)
+    assert completion.model == "primary"
+    assert client.calls == ["primary", "primary"]
+    assert client.cancelled == 1
+    assert llm.stats()["hedged"] == llm.stats()["hedge_wins"] == 1
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_a_spare_connection_slot():
+    client = FakeClient({"primary": [0.2], "backup": 0})
+    client.in_flight = client.max_concurrency
+    llm = resilient(client, hedge_enabled=True, hedge_min_delay=0.05, hedge_max_ratio=1.0)
+    for _ in range(20):
+        llm._tracker("primary", "complete").add(0.01)
+
+    assert (await ask(llm, tier="business")).model == "primary"
+    assert client.calls == ["primary"]
+    assert llm.stats()["hedged"] == 0
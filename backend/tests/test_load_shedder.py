@@ -0,0 +1,75 @@
+"""
+Tests for staged load shedding
+"""
+import pytest
+
+from app.services.load_shedder import DEFER, DEGRADE, NORMAL, SHED, LoadShedder
+
+THRESHOLDS = {
+    "loop_lag": {"degrade": 0.1, "defer": 0.3, "shed": 1.0},
+    "queue_depth": {"defer": 100, "shed": 500},
+}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.load_shedder.time.monotonic", lambda: now[0])
+    return now
+
+@pytest.fixture
+def shedder(clock):
+    depth = [0]
+    shedder = LoadShedder(THRESHOLDS, recovery=5, defer_tiers=["starter"])
+    shedder.watch("queue_depth", lambda: depth[0])
+    shedder.depth = depth
+    return shedder
+
+def test_level_rises_at_once_to_the_worst_signal(shedder):
+    assert shedder.sample(0.0) == NORMAL
+    assert shedder.sample(0.15) == DEGRADE
+    shedder.depth[0] = 600
+    assert shedder.sample(0.15) == SHED
+    assert shedder.causes == ["queue_depth"]
+    assert shedder.stats()["transitions"] == 2
+
+def test_level_falls_one_step_per_calm_period(shedder, clock):
+    shedder.sample(2.0)
+    assert shedder.level == SHED
+    clock[0] += 4
+    assert shedder.sample(0.0) == SHED  # not calm for long enough
+    clock[0] += 1
+    assert shedder.sample(0.0) == DEFER
+    clock[0] += 5
+    assert shedder.sample(0.0) == DEGRADE
+    clock[0] += 5
+    assert shedder.sample(0.0) == NORMAL
+
+def test_renewed_pressure_restarts_the_calm_period(shedder, clock):
+    shedder.sample(0.5)
+    clock[0] += 4
+    shedder.sample(0.3)  # still at defer
+    clock[0] += 4
+    assert shedder.sample(0.0) == DEFER
+    clock[0] += 1
+    assert shedder.sample(0.0) == DEGRADE
+
+def test_decisions_follow_the_level(shedder):
+    assert not shedder.degrades("m1") and not shedder.sheds()
+    shedder.sample(0.5)
+    assert shedder.degrades("m1")
+    assert shedder.defers("starter", "m1") and shedder.defers(None, "m1")
+    assert not shedder.defers("business", "m2")
+    assert not shedder.sheds()
+    shedder.sample(1.0)
+    assert shedder.sheds()
+    assert shedder.stats()["decisions"] == {"degraded": 1, "deferred": 2, "shed": 1}
+
+def test_failing_probe_is_ignored(clock):
+    shedder = LoadShedder(THRESHOLDS)
+
+    def broken():
+        raise RuntimeError("queue unavailable")
+
+    shedder.watch("queue_depth", broken)
+    assert shedder.sample(0.0) == NORMAL
+    assert "queue_depth" not in shedder.signals
@@ -0,0 +1,91 @@
+"""
+Tests for the in-process merchant cache
+"""
+import pytest
+
+from app.models.merchant import Merchant
+from app.services.merchant_cache import MerchantCache
+
+async def add_merchant(db, merchant_id: str = "m1", page_id: str = "p1") -> Merchant:
+    merchant = Merchant(
+        id=merchant_id,
+        instagram_page_id=page_id,
+        page_name="Shop",
+        access_token_hash="token",
+        business_name="Shop"
+    )
+    db.add(merchant)
+    await db.commit()
+    db.expunge(merchant)
+    return merchant
+
+@pytest.mark.asyncio
+async def test_lookups_by_id_and_page_share_an_entry(db):
+    await add_merchant(db)
+    cache = MerchantCache()
+
+    first = await cache.get_by_page_id(db, "p1")
+    assert await cache.get_by_id(db, "m1") is first
+    assert await cache.get_by_page_id(db, "p1") is first
+    assert cache.stats()["hits"] == 2
+
+@pytest.mark.asyncio
+async def test_unknown_merchant_is_not_cached(db):
+    cache = MerchantCache()
+    assert await cache.get_by_id(db, "missing") is None
+    assert await cache.get_by_page_id(db, "missing") is None
+    assert cache.stats()["size"] == 0
+
+@pytest.mark.asyncio
+async def test_invalidate_reloads_the_updated_row(db):
+    await add_merchant(db)
+    cache = MerchantCache()
+    assert (await cache.get_by_id(db, "m1")).business_name == "Shop"
+
+    row = await db.get(Merchant, "m1")
+    row.business_name = "Renamed"
+    await db.commit()
+    db.expunge(row)
+    # Until invalidated the snapshot is served
+    assert (await cache.get_by_id(db, "m1")).business_name == "Shop"
+
+    cache.invalidate("m1")
+    assert (await cache.get_by_page_id(db, "p1")).business_name == "Renamed"
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_reloaded(db, monkeypatch):
+    await add_merchant(db)
+    cache = MerchantCache(ttl_seconds=10)
+    clock = [1000.0]
+    monkeypatch.setattr("app.services.merchant_cache.time.monotonic", lambda: clock[0])
+
+    first = await cache.get_by_id(db, "m1")
+    clock[0] += 11
+    assert await cache.get_by_id(db, "m1") is not first
+    assert cache.stats()["misses"] == 2
+
+@pytest.mark.asyncio
+async def test_least_recently_used_merchant_is_evicted(db):
+    for n in range(3):
+        await add_merchant(db, f"m{n}", f"p{n}")
+    cache = MerchantCache(max_size=2)
+
+    await cache.get_by_id(db, "m0")
+    await cache.get_by_id(db, "m1")
+    await cache.get_by_id(db, "m0")  # m1 is now the oldest
+    await cache.get_by_id(db, "m2")
+
+    assert cache.stats()["size"] == 2
+    hits = cache.stats()["hits"]
+    await cache.get_by_page_id(db, "p0")
+    assert cache.stats()["hits"] == hits + 1
+    await cache.get_by_page_id(db, "p1")
+    assert cache.stats()["hits"] == hits + 1
+
+@pytest.mark.asyncio
+async def test_apply_usage_updates_the_snapshot(db):
+    await add_merchant(db)
+    cache = MerchantCache()
+    merchant = await cache.get_by_id(db, "m1")
+    cache.apply_usage("m1", 3)
+    assert merchant.monthly_message_count == 3
@@ -0,0 +1,119 @@
+"""
+Tests for coalescing rapid-fire DMs
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.message_coalescer import MessageCoalescer, merge_message_events
+
+def text_event(mid: str, text: str) -> dict:
+    return {"sender": {"id": "c1"}, "message": {"mid": mid, "text": text}}
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, events):
+        self.batches.append(([event["message"]["mid"] for event in events], time.monotonic()))
+
+@pytest.mark.asyncio
+async def test_burst_within_window_is_one_batch():
+    coalescer = MessageCoalescer(window_ms=50, max_wait_ms=1000, max_messages=5)
+    flush = Recorder()
+
+    async def send(mid, after):
+        await asyncio.sleep(after)
+        await coalescer.submit("key", text_event(mid, mid), flush)
+
+    await asyncio.gather(send("m1", 0), send("m2", 0.02), send("m3", 0.04))
+    assert [mids for mids, _ in flush.batches] == [["m1", "m2", "m3"]]
+    assert coalescer.stats()["messages_coalesced"] == 2
+
+@pytest.mark.asyncio
+async def test_messages_after_window_start_new_batch():
+    coalescer = MessageCoalescer(window_ms=20, max_wait_ms=1000, max_messages=5)
+    flush = Recorder()
+    await coalescer.submit("key", text_event("m1", "hi"), flush)
+    await coalescer.submit("key", text_event("m2", "there"), flush)
+    assert [mids for mids, _ in flush.batches] == [["m1"], ["m2"]]
+
+@pytest.mark.asyncio
+async def test_max_wait_bounds_a_continuous_burst():
+    coalescer = MessageCoalescer(window_ms=50, max_wait_ms=100, max_messages=100)
+    flush = Recorder()
+    started = time.monotonic()
+
+    async def send(index):
+        await asyncio.sleep(index * 0.03)
+        await coalescer.submit("key", text_event(f"m{index}", "x"), flush)
+
+    # Each message restarts the window, but the first batch still flushes by max_wait
+    await asyncio.gather(*(send(index) for index in range(8)))
+    first_mids, first_at = flush.batches[0]
+    assert first_at - started < 0.15
+    assert len(first_mids) < 8
+    assert sum(len(mids) for mids, _ in flush.batches) == 8
+
+@pytest.mark.asyncio
+async def test_max_messages_flushes_early():
+    coalescer = MessageCoalescer(window_ms=10000, max_wait_ms=10000, max_messages=2)
+    flush = Recorder()
+    await asyncio.wait_for(asyncio.gather(
+        coalescer.submit("key", text_event("m1", "a"), flush),
+        coalescer.submit("key", text_event("m2", "b"), flush)
+    ), timeout=1)
+    assert [mids for mids, _ in flush.batches] == [["m1", "m2"]]
+
+@pytest.mark.asyncio
+async def test_conversations_are_kept_apart():
+    coalescer = MessageCoalescer(window_ms=20, max_wait_ms=100, max_messages=5)
+    flush = Recorder()
+    await asyncio.gather(
+        coalescer.submit("a", text_event("m1", "x"), flush),
+        coalescer.submit("b", text_event("m2", "y"), flush)
+    )
+    assert sorted(mids for mids, _ in flush.batches) == [["m1"], ["m2"]]
+
+@pytest.mark.asyncio
+async def test_flush_error_reaches_every_submitter():
+    coalescer = MessageCoalescer(window_ms=20, max_wait_ms=100, max_messages=5)
+
+    async def failing(events):
+        raise RuntimeError("send failed")
+
+    results = await asyncio.gather(
+        coalescer.submit("key", text_event("m1", "x"), failing),
+        coalescer.submit("key", text_event("m2", "y"), failing),
+        return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_merge_joins_text_and_keeps_mids():
+    merged = merge_message_events([text_event("m1", "hi"), text_event("m2", "price of X?")])
+    assert merged["message"]["text"] == "hi\nprice of X?"
+    assert merged["message"]["mid"] == "m2"
+    assert merged["message"]["mids"] == ["m1", "m2"]
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_releases_every_submitter():
+    coalescer = MessageCoalescer(window_ms=10, max_wait_ms=1000, max_messages=5)
+    started = asyncio.Event()
+
+    async def stuck(events):
+        started.set()
+        await asyncio.sleep(60)
+
+    submitters = [
+        asyncio.create_task(coalescer.submit("key", text_event(mid, mid), stuck))
+        for mid in ("m1", "m2")
+    ]
+    await started.wait()
+    assert coalescer.stats()["flushing"] == 1
+    for task in list(coalescer._flushing):
+        task.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*submitters, return_exceptions=True), timeout=1)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    await asyncio.sleep(0)
+    assert coalescer.stats()["flushing"] == 0
@@ -0,0 +1,60 @@
+"""
+Tests for message ID claims
+"""
+import asyncio
+
+import pytest
+
+from app.services.message_dedup import MessageDeduplicator
+
+@pytest.mark.asyncio
+async def test_claim_then_redelivery_is_held(db):
+    dedup = MessageDeduplicator()
+    assert await dedup.claim_many(db, ["m1", "m2", None]) == ({"m1", "m2"}, set())
+    # Still being processed: a redelivery must come back later, not be dropped
+    assert await dedup.claim_many(db, ["m1"]) == (set(), {"m1"})
+
+@pytest.mark.asyncio
+async def test_done_ids_are_dropped(db):
+    dedup = MessageDeduplicator()
+    await dedup.claim_many(db, ["m1"])
+    await dedup.mark_done(db, ["m1"])
+    assert await dedup.claim_many(db, ["m1", "m1"]) == (set(), set())
+    assert dedup.stats()["duplicates_dropped"] == 2
+
+    # Another worker without the LRU entry sees the done row
+    assert await MessageDeduplicator().claim_many(db, ["m1"]) == (set(), set())
+
+@pytest.mark.asyncio
+async def test_release_allows_reprocessing(db):
+    dedup = MessageDeduplicator()
+    await dedup.claim_many(db, ["m1"])
+    await dedup.release(db, ["m1"])
+    assert await dedup.claim_many(db, ["m1"]) == ({"m1"}, set())
+
+@pytest.mark.asyncio
+async def test_release_keeps_done_rows(db):
+    dedup = MessageDeduplicator()
+    await dedup.claim_many(db, ["m1"])
+    await dedup.mark_done(db, ["m1"])
+    await dedup.release(db, ["m1"])
+    assert await MessageDeduplicator().claim_many(db, ["m1"]) == (set(), set())
+
+@pytest.mark.asyncio
+async def test_abandon_skips_handed_off_claims(db):
+    dedup = MessageDeduplicator()
+    await dedup.claim_many(db, ["m1", "m2"])
+    dedup.hand_off(["m1"])
+    await dedup.abandon(db, ["m1", "m2"])
+    assert await dedup.claim_many(db, ["m1", "m2"]) == ({"m2"}, {"m1"})
+
+@pytest.mark.asyncio
+async def test_lapsed_lease_is_taken_over(db):
+    crashed = MessageDeduplicator(lease_seconds=0.05)
+    await crashed.claim_many(db, ["m1"])
+    await asyncio.sleep(0.06)
+
+    dedup = MessageDeduplicator()
+    assert await dedup.claim_many(db, ["m1"]) == ({"m1"}, set())
+    assert dedup.stats()["leases_taken_over"] == 1
+    assert await crashed.claim_many(db, ["m1"]) == (set(), {"m1"})
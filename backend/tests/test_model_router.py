@@ -0,0 +1,68 @@
+"""
+Tests for message classification and model routing
+"""
+from datetime import datetime
+
+import pytest
+
+from app.core.config import settings
+from app.models.merchant import Merchant
+from app.services.model_router import COMPLEX, SIMPLE, STANDARD, ModelRouter, classify
+
+def merchant(tier: str = "starter") -> Merchant:
+    return Merchant(
+        id=f"router-{tier}",
+        subscription_tier=tier,
+        updated_at=datetime(2026, 1, 1),
+        product_catalog=[
+            {"name": "Ceramic Mug", "price": "10"},
+            {"name": "Green Tea", "price": "5"},
+        ]
+    )
+
+@pytest.mark.parametrize("message, complexity, reason, language", [
+    ("thanks so much!", SIMPLE, "small_talk", "en"),
+    ("شكرا جزيلا", SIMPLE, "small_talk", "ar"),
+    ("what time do you open?", SIMPLE, "lookup", "en"),
+    ("بكم الشاي؟", SIMPLE, "lookup", "ar"),
+    ("I want to order two mugs", COMPLEX, "order", "en"),
+    ("my number is +966 55 123 4567", COMPLEX, "order", "en"),
+    ("ceramic mug or green tea as a gift?", COMPLEX, "comparison", "en"),
+    ("tell me about your shop", STANDARD, "default", "en"),
+])
+def test_classification(message, complexity, reason, language):
+    assert classify(merchant(), message) == (complexity, reason, language)
+
+def test_reply_to_an_order_question_continues_the_order():
+    assert classify(merchant(), "ok", previous_user_message="can you deliver to Jeddah?")[:2] == (COMPLEX, "order_follow_up")
+    assert classify(merchant(), "ok")[:2] == (SIMPLE, "small_talk")
+
+def test_long_messages_are_complex():
+    assert classify(merchant(), " ".join(["word"] * 41))[:2] == (COMPLEX, "long")
+    assert classify(merchant(), "a? b? c?")[:2] == (COMPLEX, "long")
+
+def router(enabled: bool = True) -> ModelRouter:
+    return ModelRouter(settings.MODEL_ROUTES, large_model="large-model", small_model="small-model", enabled=enabled)
+
+def test_tier_routes_pick_the_model():
+    models = router()
+    assert models.route(merchant("starter"), "tell me about your shop", []).model == "small-model"
+    assert models.route(merchant("business"), "tell me about your shop", []).model == "large-model"
+    assert models.route(merchant("starter"), "I want to order", []).model == "large-model"
+    # Unknown tiers route like starter
+    assert models.route(merchant("platinum"), "thanks", []).tier == "starter"
+    assert models.stats()["reasons"] == {"default": 2, "order": 1, "small_talk": 1}
+
+def test_history_supplies_the_previous_customer_message():
+    turns = [("user", "what's the shipping cost?"), ("assistant", "Free over 100.")]
+    assert router().route(merchant(), "ok", turns).reason == "order_follow_up"
+
+def test_disabled_routing_always_uses_the_large_model():
+    route = router(enabled=False).route(merchant(), "thanks", [])
+    assert (route.complexity, route.model, route.reason) == (STANDARD, "large-model", "disabled")
+
+def test_latencies_are_tracked_per_routed_model():
+    models = router()
+    route = models.route(merchant(), "thanks", [])
+    models.record(route, 0.4, first_token_latency=0.1)
+    assert models.stats()["models"]["small-model"] == {"p50_latency": 0.4, "p95_latency": 0.4, "p95_first_token": 0.1}
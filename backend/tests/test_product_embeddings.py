@@ -0,0 +1,64 @@
+"""
+Tests for semantic product retrieval with the local hashing embedder
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.models.merchant import Merchant
+from app.services.deadline import Deadline
+from app.services.product_embeddings import (
+    HashingEmbedder,
+    NumpyVectorStore,
+    ProductEmbeddings,
+    reciprocal_rank_fusion,
+)
+
+CATALOG = [
+    {"name": "Leather Wallet", "category": "Accessories", "description": "Slim bifold wallet"},
+    {"name": "Canvas Tote Bag", "category": "Bags", "description": "Large shopping tote"},
+    {"name": "Running Shoes", "category": "Footwear", "description": "Lightweight trainers"},
+    {"name": "Silk Scarf", "category": "Accessories", "description": "Printed silk scarf"},
+]
+
+@pytest.fixture
+def embeddings(tmp_path):
+    return ProductEmbeddings(HashingEmbedder(dimensions=256), NumpyVectorStore(str(tmp_path)))
+
+@pytest.fixture
+def merchant():
+    return Merchant(id="merchant-1", product_catalog=CATALOG)
+
+def test_hashing_embedder_is_deterministic_and_unit_length():
+    embedder = HashingEmbedder(dimensions=64)
+    first, second = embedder.embed_sync(["leather wallet", "leather wallet"])
+    assert np.array_equal(first, second)
+    assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-5)
+
+def test_hashing_embedder_tolerates_misspellings():
+    vectors = HashingEmbedder().embed_sync(["leather wallet", "lether walet", "running shoes"])
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+@pytest.mark.asyncio
+async def test_search_builds_catalog_then_ranks(embeddings, merchant):
+    # No stored matrix yet: answered lexically while the build runs
+    assert await embeddings.search(merchant, "wallet", top_k=2) is None
+    await asyncio.gather(*embeddings._tasks)
+    assert embeddings.stats()["builds"] == 1
+
+    positions = await embeddings.search(merchant, "a tote for shopping", top_k=2)
+    assert positions[0] == 1
+    assert len(positions) == 2
+
+@pytest.mark.asyncio
+async def test_search_is_skipped_when_deadline_is_short(embeddings, merchant):
+    embeddings.schedule(merchant)
+    await asyncio.gather(*embeddings._tasks)
+
+    assert await embeddings.search(merchant, "wallet", top_k=2, deadline=Deadline(15)) is not None
+    assert await embeddings.search(merchant, "wallet", top_k=2, deadline=Deadline(1)) is None
+    assert embeddings.stats()["skipped"] == 1
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([[0, 1, 2], [1, 3, 4]], top_k=2) == [1, 0]
@@ -0,0 +1,75 @@
+"""
+Tests for product retrieval and text normalization
+"""
+from datetime import datetime
+
+from app.models.merchant import Merchant
+from app.services.product_index import ProductIndex, ProductIndexRegistry
+from app.services.text_normalizer import normalize_text, tokenize
+
+CATALOG = [
+    {"name": "Ceramic Mug", "category": "Kitchen", "description": "Holds hot drinks"},
+    {"name": "Green Tea", "category": "Drinks", "description": "Loose leaf tea"},
+    {"name": "Tea Pot", "category": "Kitchen", "description": "Brews tea for four"},
+    {"name": "عباية سوداء", "category": "ملابس", "description": "عباءة نسائية"},
+]
+
+def test_arabic_variants_and_diacritics_fold_together():
+    assert normalize_text("أَحْمَد") == normalize_text("احمد")
+    assert normalize_text("مدرسة") == "مدرسه"
+    assert normalize_text("١٢٣") == "123"
+    assert normalize_text("Café") == "cafe"
+
+def test_tokenize_drops_stopwords_and_stems():
+    assert tokenize("Do you have the mugs?") == ["mug"]
+    assert tokenize("هل عندكم العباية") == ["عبايه"]
+    assert tokenize("the glass", keep_stopwords=True) == ["the", "glass"]
+
+def test_name_matches_rank_first():
+    index = ProductIndex(CATALOG)
+    assert index.search("tea", top_k=2) == [1, 2]
+    assert index.search("mugs", top_k=3) == [0]
+    assert index.search("العباية", top_k=3) == [3]
+    assert index.search("bicycle", top_k=3) == []
+    assert index.search("the", top_k=3) == []
+
+def test_incremental_changes_match_a_rebuild():
+    index = ProductIndex(CATALOG)
+    index.update(0, {"name": "Tea Cup", "category": "Kitchen"})
+    index.delete(1)
+    index.add({"name": "Tea Strainer"})
+    catalog = [{"name": "Tea Cup", "category": "Kitchen"}, CATALOG[2], CATALOG[3], {"name": "Tea Strainer"}]
+    rebuilt = ProductIndex(catalog)
+
+    assert len(index) == 4
+    assert index.search("tea", top_k=4) == rebuilt.search("tea", top_k=4)
+    assert index.lines([0, 3]) == rebuilt.lines([0, 3])
+    assert index.search("mug", top_k=4) == []
+
+def merchant(version: datetime) -> Merchant:
+    return Merchant(id="m1", product_catalog=list(CATALOG), updated_at=version)
+
+def test_registry_rebuilds_only_on_a_version_change():
+    registry = ProductIndexRegistry()
+    shop = merchant(datetime(2026, 1, 1))
+    index = registry.get(shop)
+    assert registry.get(shop) is index
+
+    shop.updated_at = datetime(2026, 1, 2)
+    assert registry.get(shop) is not index
+    assert registry.stats()["builds"] == 2
+
+def test_registry_applies_changes_from_the_indexed_version():
+    registry = ProductIndexRegistry()
+    shop = merchant(datetime(2026, 1, 1))
+    index = registry.get(shop)
+
+    previous = shop.updated_at.isoformat()
+    shop.updated_at = datetime(2026, 1, 2)
+    registry.on_product_added("m1", previous, shop.updated_at.isoformat(), {"name": "Tea Strainer"})
+    assert registry.get(shop) is index
+    assert len(index) == 5
+
+    # A change based on a version this worker never indexed drops the index
+    registry.on_product_deleted("m1", "stale", "newer", 0)
+    assert registry.get(shop) is not index
@@ -0,0 +1,63 @@
+"""
+Tests for compiled merchant system prompts
+"""
+from datetime import datetime, timedelta
+
+from app.models.merchant import Merchant
+from app.services.prompt_compiler import PromptCompiler, compact_json, merchant_version
+
+SAVED_AT = datetime(2026, 1, 1, 12, 0)
+
+def merchant(merchant_id: str = "m1", **fields) -> Merchant:
+    fields.setdefault("product_catalog", [{"name": "Mug", "price": "10"}, {"name": "Tea", "price": "5"}])
+    fields.setdefault("updated_at", SAVED_AT)
+    return Merchant(id=merchant_id, business_name="Shop", page_name="shop", **fields)
+
+def test_prompt_is_reused_until_the_merchant_is_saved():
+    compiler = PromptCompiler()
+    shop = merchant()
+    first = compiler.compile(shop)
+    assert compiler.compile(shop) is first
+
+    shop.business_name = "Renamed"
+    shop.updated_at = SAVED_AT + timedelta(seconds=1)
+    second = compiler.compile(shop)
+    assert second is not first
+    assert "Renamed" in second.full
+    assert compiler.stats()["hits"] == 1
+    assert compiler.stats()["misses"] == 2
+
+def test_invalidate_forces_a_rebuild():
+    compiler = PromptCompiler()
+    shop = merchant()
+    first = compiler.compile(shop)
+    compiler.invalidate("m1")
+    assert compiler.compile(shop) is not first
+
+def test_least_recently_used_prompt_is_evicted():
+    compiler = PromptCompiler(max_size=2)
+    shops = [merchant(f"m{n}") for n in range(3)]
+    for shop in shops:
+        compiler.compile(shop)
+    assert compiler.stats()["size"] == 2
+    compiler.compile(shops[0])
+    assert compiler.stats()["misses"] == 4
+
+def test_products_are_compact_json_lines():
+    prompt = PromptCompiler().render(merchant())
+    assert prompt.product_lines == ['{"name":"Mug","price":"10"}', '{"name":"Tea","price":"5"}']
+    assert "\n".join(prompt.product_lines) in prompt.full
+    assert compact_json({"name": "شاي"}) == '{"name":"شاي"}'
+
+def test_with_products_keeps_the_rest_of_the_prompt():
+    prompt = PromptCompiler().render(merchant())
+    narrowed = prompt.with_products(prompt.product_lines[1:])
+    assert narrowed.startswith(prompt.head)
+    assert narrowed.endswith(prompt.tail)
+    assert "the 1 of 2 products" in narrowed
+    assert "Mug" not in narrowed
+
+def test_unsaved_merchant_has_a_stable_version():
+    shop = merchant(updated_at=None)
+    assert merchant_version(shop) == "0"
+    assert merchant_version(merchant()) == SAVED_AT.isoformat()
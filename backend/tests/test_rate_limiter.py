@@ -0,0 +1,106 @@
+"""
+Tests for token-bucket rate limiting
+"""
+import asyncio
+import threading
+
+import pytest
+
+from app.services.rate_limiter import BucketStore, MemoryBucketStore, RateLimiter, SQLiteBucketStore, refill
+
+RATE = 20.0  # tokens per second: one token every 50 ms
+
+def test_refill_math():
+    tokens, decision = refill(0.0, elapsed=2.0, rate=1.5, capacity=10, cost=1)
+    assert decision.allowed and tokens == pytest.approx(2.0)
+    tokens, decision = refill(0.5, elapsed=0.0, rate=0.5, capacity=10, cost=1)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(1.0)
+    assert decision.retry_after_header == "1"
+    tokens, _ = refill(9.0, elapsed=100.0, rate=1.0, capacity=10, cost=0)
+    assert tokens == 10  # never above capacity
+
+@pytest.mark.asyncio
+async def test_memory_bucket_bursts_then_refills():
+    store = MemoryBucketStore()
+    results = [(await store.take("k", rate=RATE, capacity=3)).allowed for _ in range(4)]
+    assert results == [True, True, True, False]
+
+    await asyncio.sleep(0.06)
+    assert (await store.take("k", rate=RATE, capacity=3)).allowed
+    assert not (await store.take("k", rate=RATE, capacity=3)).allowed
+
+@pytest.mark.asyncio
+async def test_drain_into_debt_delays_refill():
+    store = MemoryBucketStore()
+    await store.drain("k", -2.0)
+    decision = await store.take("k", rate=RATE, capacity=5)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(3 / RATE, abs=0.02)
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryBucketStore(max_keys=2)
+    for key in ("a", "b", "c"):
+        store.take_sync(key, rate=1.0, capacity=1)
+    assert len(store) == 2
+
+@pytest.mark.asyncio
+async def test_sqlite_buckets_are_shared_between_stores(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    # Opening the connections takes longer than a refill interval
+    await first.take("warmup", rate=RATE, capacity=1)
+    await second.take("warmup", rate=RATE, capacity=1)
+    assert (await first.take("k", rate=RATE, capacity=2)).allowed
+    assert (await second.take("k", rate=RATE, capacity=2)).allowed
+    assert not (await first.take("k", rate=RATE, capacity=2)).allowed
+
+    await asyncio.sleep(0.06)
+    assert (await second.take("k", rate=RATE, capacity=2)).allowed
+
+    await second.drain("k", -1.0)
+    decision = await first.take("k", rate=RATE, capacity=2)
+    assert not decision.allowed
+    assert decision.retry_after == pytest.approx(2 / RATE, abs=0.02)
+    await first.close()
+    await second.close()
+
+@pytest.mark.asyncio
+async def test_sqlite_store_keeps_blocking_calls_off_the_loop(tmp_path, monkeypatch):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.db"))
+    threads = []
+    take = store._take
+    monkeypatch.setattr(store, "_take", lambda *args: threads.append(threading.current_thread()) or take(*args))
+    await store.take("k", rate=RATE, capacity=1)
+    await store.take("k", rate=RATE, capacity=1)
+    assert threading.main_thread() not in threads
+    assert threads[0] is threads[1]  # one dedicated thread owns the connection
+    await store.close()
+    # A closed store reopens on the next check
+    assert (await store.take("other", rate=RATE, capacity=1)).allowed
+    await store.close()
+
+def test_bucket_store_is_abstract():
+    with pytest.raises(TypeError):
+        BucketStore()
+
+class BrokenStore(BucketStore):
+    name = "broken"
+
+    async def take(self, key, rate, capacity, cost=1.0):
+        raise ConnectionError("store down")
+
+    async def drain(self, key, tokens):
+        raise ConnectionError("store down")
+
+@pytest.mark.asyncio
+async def test_limiter_falls_back_to_memory_when_store_fails():
+    limiter = RateLimiter(BrokenStore())
+    decisions = [await limiter.check("webhook", "m1", requests=2, window=60) for _ in range(3)]
+    assert [decision.allowed for decision in decisions] == [True, True, False]
+    assert decisions[-1].retry_after == pytest.approx(30.0, abs=0.01)
+
+    stats = limiter.stats()
+    assert stats["store_errors"] == 3
+    assert stats["checks"] == {"webhook": 3}
+    assert stats["limited"] == {"webhook": 1}
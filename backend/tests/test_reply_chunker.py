@@ -0,0 +1,59 @@
+"""
+Tests for cutting streamed replies into Instagram messages
+"""
+from app.services.reply_chunker import ReplyChunker, cut_point, sentence_ends, split_message
+
+def feed_all(chunker: ReplyChunker, text: str, step: int = 7) -> list:
+    messages = []
+    for start in range(0, len(text), step):
+        messages.extend(chunker.feed(text[start:start + step]))
+    if not chunker.stopped:
+        messages.extend(chunker.finish())
+    return messages
+
+def test_sentence_ends_cover_latin_and_arabic_punctuation():
+    text = 'One. Two! "Three?" أربعة؟ five\nsix'
+    assert [text[end - 1] for end in sentence_ends(text)] == [".", "!", '"', "؟", "\n"]
+
+def test_cut_point_prefers_sentence_then_word():
+    assert cut_point("Hello there. General Kenobi", 20) == len("Hello there.")
+    assert cut_point("no sentence end here at all", 12) == len("no sentence")
+    assert cut_point("x" * 30, 10) == 10
+
+def test_split_message_respects_limit():
+    text = "First sentence here. Second one is longer than that. Third."
+    parts = split_message(text, 25)
+    assert all(len(part) <= 25 for part in parts)
+    assert " ".join(parts) == text
+
+def test_short_reply_goes_out_whole_at_finish():
+    chunker = ReplyChunker(soft_limit=100, hard_limit=200)
+    assert feed_all(chunker, "Hi! We open at 10.") == ["Hi! We open at 10."]
+    assert not chunker.stopped
+
+def test_stops_at_first_sentence_past_soft_limit():
+    chunker = ReplyChunker(soft_limit=20, hard_limit=200)
+    text = "This is sentence one. This is sentence two. Three."
+    assert feed_all(chunker, text) == ["This is sentence one."]
+    assert chunker.stopped
+    assert chunker.feed("more text.") == []
+
+def test_hard_limit_cuts_at_last_sentence_that_fits():
+    chunker = ReplyChunker(soft_limit=1000, hard_limit=30)
+    messages = feed_all(chunker, "Short one. Another short one. A sentence that runs past the limit")
+    assert messages == ["Short one. Another short one."]
+    assert chunker.stopped
+
+def test_split_chars_releases_messages_as_sentences_complete():
+    chunker = ReplyChunker(soft_limit=1000, hard_limit=2000, split_chars=25)
+    early = chunker.feed("First sentence is here. Second")
+    assert early == ["First sentence is here."]
+    rest = chunker.feed(" sentence too. Third.") + chunker.finish()
+    assert rest == ["Second sentence too.", "Third."]
+
+def test_split_chars_never_exceeds_hard_limit_overall():
+    chunker = ReplyChunker(soft_limit=1000, hard_limit=60, split_chars=20)
+    messages = feed_all(chunker, "Alpha beta. Gamma delta. " * 10)
+    assert chunker.stopped
+    assert sum(len(message) for message in messages) <= 60
+    assert all(len(message) <= 20 for message in messages)
@@ -0,0 +1,76 @@
+"""
+Tests for cached AI replies
+"""
+from datetime import datetime
+
+from app.models.merchant import Merchant
+from app.services.response_cache import ResponseCache, normalize_question
+
+def merchant(merchant_id: str = "m1") -> Merchant:
+    return Merchant(id=merchant_id, updated_at=datetime(2026, 1, 1))
+
+def test_equivalent_questions_share_an_entry():
+    cache = ResponseCache()
+    shop = merchant()
+    cache.put(shop, "What are your hours?", "9 to 5")
+    assert cache.get(shop, "what are   your HOURS??") == "9 to 5"
+    assert cache.get(merchant("m2"), "What are your hours?") is None
+    assert normalize_question("Hi 👋!!") == "hi"
+
+def test_merchant_update_drops_its_replies():
+    cache = ResponseCache()
+    shop = merchant()
+    cache.put(shop, "hours?", "9 to 5")
+    cache.put(merchant("m2"), "hours?", "10 to 6")
+
+    shop.updated_at = datetime(2026, 1, 2)  # the merchant saved new working hours
+    assert cache.get(shop, "hours?") is None
+    # Restoring the old snapshot must not bring the reply back
+    shop.updated_at = datetime(2026, 1, 1)
+    assert cache.get(shop, "hours?") is None
+    assert cache.get(merchant("m2"), "hours?") == "10 to 6"
+
+def test_invalidate_drops_every_reply_of_the_merchant():
+    cache = ResponseCache()
+    shop = merchant()
+    cache.put(shop, "hours?", "9 to 5")
+    cache.put(shop, "delivery?", "Two days")
+    cache.invalidate("m1")
+    assert cache.get(shop, "hours?") is None
+    assert cache.get(shop, "delivery?") is None
+
+def test_profile_change_invalidates_the_cache(monkeypatch):
+    from app.api import merchants
+
+    cache = ResponseCache()
+    monkeypatch.setattr(merchants, "response_cache", cache)
+    shop = merchant()
+    cache.put(shop, "hours?", "9 to 5")
+    merchants.invalidate_merchant_caches("m1")
+    assert cache.get(shop, "hours?") is None
+
+def test_entries_expire(monkeypatch):
+    cache = ResponseCache(ttl_seconds=10)
+    clock = [1000.0]
+    monkeypatch.setattr("app.services.response_cache.time.monotonic", lambda: clock[0])
+    shop = merchant()
+    cache.put(shop, "hours?", "9 to 5")
+    clock[0] += 11
+    assert cache.get(shop, "hours?") is None
+    assert ResponseCache(ttl_seconds=0).get(shop, "hours?") is None
+
+def test_each_merchant_keeps_its_most_recent_replies():
+    cache = ResponseCache(per_merchant=2)
+    shop = merchant()
+    for question in ("one", "two", "three"):
+        cache.put(shop, question, question.upper())
+    assert cache.get(shop, "one") is None
+    assert cache.get(shop, "three") == "THREE"
+
+def test_similar_question_hits_above_the_threshold():
+    cache = ResponseCache(similarity=0.8)
+    shop = merchant()
+    cache.put(shop, "do you deliver to riyadh", "Yes, in two days")
+    assert cache.get(shop, "do you deliver to riyadh please") == "Yes, in two days"
+    assert cache.get(shop, "how much is the red mug") is None
+    assert cache.stats()["similar_hits"] == 1
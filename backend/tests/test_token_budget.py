@@ -0,0 +1,85 @@
+"""
+Tests for token counting and prompt budget trimming
+"""
+import pytest
+
+from app.core.config import settings
+from app.services.token_budget import (
+    MESSAGE_OVERHEAD_TOKENS,
+    REPLY_PRIMING_TOKENS,
+    TokenCounter,
+    TokenUsageStats,
+    completion_token_limit,
+    estimate_tokens,
+    input_token_budget,
+    plan_prompt
+)
+
+@pytest.fixture
+def counter() -> TokenCounter:
+    """Counter on the byte heuristic, so counts do not depend on tiktoken being installed"""
+    counter = TokenCounter("gpt-4o-mini")
+    counter._loaded = True
+    return counter
+
+SYSTEM = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": "y" * 8}]
+PRODUCTS = ["p" * 39 for _ in range(5)]  # 10 tokens, 11 with the newline
+
+def turns(count: int):
+    return [("user" if n % 2 == 0 else "assistant", f"{n:02d}" + "t" * 14) for n in range(count)]  # 4 tokens each
+
+def test_estimate_counts_utf8_bytes():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("مرحبا") == 3  # ten bytes
+    assert estimate_tokens("abcde") == 2
+
+def test_message_overheads(counter):
+    assert counter.count_messages(SYSTEM) == 10 + 2 + 2 * MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS
+
+def test_everything_fits_a_large_budget(counter):
+    plan = plan_prompt(counter, 10_000, SYSTEM, PRODUCTS, turns(4), history_cap=1000)
+    assert plan.product_lines == PRODUCTS
+    assert [turn["content"] for turn in plan.history] == [content for _, content in turns(4)]
+    assert (plan.dropped_products, plan.dropped_turns) == (0, 0)
+
+def test_products_are_trimmed_to_their_share(counter):
+    fixed = counter.count_messages(SYSTEM)
+    plan = plan_prompt(counter, fixed + 60, SYSTEM, PRODUCTS, [], history_cap=1000)
+    # 60% of 60 tokens holds three 11-token product lines, best first
+    assert plan.product_lines == PRODUCTS[:3]
+    assert plan.dropped_products == 2
+    assert plan.estimated_tokens == fixed + 33
+
+def test_history_keeps_the_newest_turns(counter):
+    fixed = counter.count_messages(SYSTEM)
+    plan = plan_prompt(counter, fixed + 100, SYSTEM, [], turns(6), history_cap=4 * 8)
+    assert [turn["content"][:2] for turn in plan.history] == ["02", "03", "04", "05"]
+    assert plan.dropped_turns == 2
+
+def test_history_never_opens_with_an_assistant_reply(counter):
+    fixed = counter.count_messages(SYSTEM)
+    plan = plan_prompt(counter, fixed + 100, SYSTEM, [], turns(6), history_cap=3 * 8)
+    # The newest three turns start with an assistant reply, which is dropped
+    assert [turn["content"][:2] for turn in plan.history] == ["04", "05"]
+    assert [turn["role"] for turn in plan.history] == ["user", "assistant"]
+    assert plan.estimated_tokens == fixed + 2 * 8
+
+def test_budget_smaller_than_the_fixed_messages_keeps_only_them(counter):
+    plan = plan_prompt(counter, 5, SYSTEM, PRODUCTS, turns(2), history_cap=1000)
+    assert plan.product_lines == [] and plan.history == []
+    assert plan.estimated_tokens == counter.count_messages(SYSTEM)
+
+def test_tier_budgets_and_completion_limit():
+    assert input_token_budget("business") == settings.TIER_LIMITS["business"]["input_tokens"]
+    assert input_token_budget(None) == input_token_budget("unknown") == settings.TIER_LIMITS["starter"]["input_tokens"]
+    assert completion_token_limit() * settings.MIN_CHARS_PER_TOKEN >= settings.INSTAGRAM_MAX_MESSAGE_CHARS
+
+def test_usage_stats_track_estimation_error():
+    stats = TokenUsageStats()
+    stats.record(estimated=100, actual=110, completion=20, budget=105)
+    stats.record(estimated=50, actual=0, completion=5, budget=105)
+    summary = stats.stats()
+    assert summary["mean_estimate_error"] == 10.0
+    assert summary["over_budget"] == 1
+    assert summary["completion_tokens"] == 25
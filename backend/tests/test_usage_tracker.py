@@ -0,0 +1,85 @@
+"""
+Tests for write-behind usage counters
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.models.merchant import Merchant
+from app.services import usage_tracker as usage_module
+from app.services.usage_tracker import UsageTracker
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    """Sync session factory the tracker flushes through, with merchant m1 at 5 of 10 messages"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'usage.db'}")
+    Base.metadata.create_all(engine, tables=[Merchant.__table__])
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        db.add(Merchant(
+            id="m1", instagram_page_id="p1", page_name="Shop", access_token_hash="token",
+            business_name="Shop", monthly_message_count=5, monthly_message_limit=10
+        ))
+        db.commit()
+    monkeypatch.setattr(usage_module, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+def stored_count(factory) -> int:
+    with factory() as db:
+        return db.get(Merchant, "m1").monthly_message_count
+
+def test_flush_adds_pending_counts_in_one_statement(sessions):
+    tracker = UsageTracker()
+    tracker.record("m1")
+    tracker.record("m1", 2)
+    assert tracker.stats()["pending_messages"] == 3
+
+    assert tracker.flush() == 1
+    assert stored_count(sessions) == 8
+    assert tracker.unflushed("m1") == 0
+    assert tracker.flush() == 0
+
+def test_flush_keeps_the_merchant_version(sessions):
+    with sessions() as db:
+        updated_at = db.get(Merchant, "m1").updated_at
+    tracker = UsageTracker()
+    tracker.record("m1")
+    tracker.flush()
+    with sessions() as db:
+        assert db.get(Merchant, "m1").updated_at == updated_at
+
+def test_limit_check_counts_unflushed_messages(sessions):
+    tracker = UsageTracker()
+    merchant = Merchant(id="m1", is_active=True, monthly_message_count=5, monthly_message_limit=10)
+    tracker.record("m1", 4)
+    assert tracker.can_send_message(merchant)
+    tracker.record("m1")
+    assert not tracker.can_send_message(merchant)
+
+    merchant.is_active = False
+    assert not UsageTracker().can_send_message(merchant)
+
+def test_failed_flush_keeps_the_counts(sessions, monkeypatch):
+    tracker = UsageTracker()
+    tracker.record("m1", 2)
+
+    class LockedSession:
+        def execute(self, *args):
+            raise RuntimeError("database is locked")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(usage_module, "SessionLocal", LockedSession)
+    with pytest.raises(RuntimeError):
+        tracker.flush()
+    assert tracker.unflushed("m1") == 2
+
+    monkeypatch.setattr(usage_module, "SessionLocal", sessions)
+    tracker.flush()
+    assert stored_count(sessions) == 7
@@ -0,0 +1,85 @@
+"""
+Tests for webhook processing: deferral and the receipt-to-send deadline
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.api import webhooks
+from app.core.config import settings
+from app.services.message_dedup import MessageDeduplicator
+from app.services.webhook_queue import WebhookQueue
+
+def message(mid: str, sender: str = "user", text: str = "hi") -> dict:
+    return {"sender": {"id": sender}, "recipient": {"id": "page"}, "message": {"mid": mid, "text": text}}
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    queue = WebhookQueue(str(tmp_path / "queue.db"))
+    dedup = MessageDeduplicator()
+    monkeypatch.setattr(webhooks, "webhook_queue", queue)
+    monkeypatch.setattr(webhooks, "message_deduplicator", dedup)
+    yield queue, dedup
+    queue.close()
+
+@pytest.mark.asyncio
+async def test_deferred_events_keep_their_receipt_time(db, pipeline):
+    queue, dedup = pipeline
+    received_at = time.time() - 3
+    entry = {"id": "page", "messaging": [message("m1")]}
+    await dedup.claim_many(db, ["m1"])
+
+    assert await webhooks.defer_events({"object": "instagram"}, entry, entry["messaging"], db, 0.0, received_at)
+    job = queue.claim()
+    assert job.received_at == received_at
+    assert json.loads(job.payload)["entry"][0]["messaging"][0]["message"]["mid"] == "m1"
+    # The claim was released, so the deferred copy is not taken for a duplicate
+    assert await dedup.claim_many(db, ["m1"]) == ({"m1"}, set())
+
+@pytest.mark.asyncio
+async def test_events_due_past_their_deadline_are_dropped(db, pipeline):
+    queue, dedup = pipeline
+    entry = {"id": "page", "messaging": [message("m1")]}
+    await dedup.claim_many(db, ["m1"])
+
+    delay = settings.EVENT_DEADLINE + 1
+    assert not await webhooks.defer_events({"object": "instagram"}, entry, entry["messaging"], db, delay, time.time())
+    assert queue.depth() == 0
+    assert await dedup.claim_many(db, ["m1"]) == (set(), set())
+
+@pytest.mark.asyncio
+async def test_expired_webhook_is_dropped_without_processing(db, pipeline, monkeypatch):
+    queue, dedup = pipeline
+
+    async def no_lookup(db, page_id):
+        raise AssertionError("an expired webhook must not be processed")
+
+    monkeypatch.setattr(webhooks.merchant_cache, "get_by_page_id", no_lookup)
+    payload = {"object": "instagram", "entry": [{"id": "page", "messaging": [message("m1")]}]}
+
+    await webhooks.process_webhook_data(payload, db, received_at=time.time() - settings.EVENT_DEADLINE - 1)
+    assert await dedup.claim_many(db, ["m1"]) == (set(), set())
+
+@pytest.mark.asyncio
+async def test_later_messages_wait_behind_deferred_ones(db, pipeline, monkeypatch):
+    queue, dedup = pipeline
+
+    async def no_lookup(db, page_id):
+        raise AssertionError("a parked conversation must not be processed ahead of its deferred messages")
+
+    monkeypatch.setattr(webhooks.merchant_cache, "get_by_page_id", no_lookup)
+    first_received = time.time()
+    earlier = {"id": "page", "messaging": [message("m1", sender="alice")]}
+    await dedup.claim_many(db, ["m1"])
+    assert await webhooks.defer_events({"object": "instagram"}, earlier, earlier["messaging"], db, 0.3, first_received)
+
+    later = {"object": "instagram", "entry": [{"id": "page", "messaging": [message("m2", sender="alice")]}]}
+    await webhooks.process_webhook_data(later, db, received_at=first_received + 0.5)
+
+    jobs = queue.stats()
+    assert jobs == {"pending": 2}
+    await asyncio.sleep(0.4)
+    order = [json.loads(queue.claim().payload)["entry"][0]["messaging"][0]["message"]["mid"] for _ in range(2)]
+    assert order == ["m1", "m2"]
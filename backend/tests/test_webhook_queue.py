@@ -0,0 +1,88 @@
+"""
+Tests for the durable webhook queue
+"""
+import time
+
+import pytest
+
+from app.services.webhook_queue import WebhookQueue
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WebhookQueue(str(tmp_path / "queue.db"), visibility_timeout=60, max_attempts=3)
+    yield queue
+    queue.close()
+
+def test_claim_hides_job_until_acked(queue):
+    job_id = queue.enqueue('{"entry": []}', received_at=123.0)
+    job = queue.claim()
+    assert job.id == job_id
+    assert job.received_at == 123.0
+    assert job.attempts == 1
+    assert queue.claim() is None
+    assert queue.stats() == {"inflight": 1}
+
+    queue.ack(job.id)
+    assert queue.depth() == 0
+
+def test_delayed_job_waits(queue):
+    queue.enqueue("later", delay=60)
+    ready = queue.enqueue("ready")
+    assert queue.backlog() == 1
+    assert queue.claim().id == ready
+    assert queue.claim() is None
+    assert queue.depth() == 2
+
+def test_visibility_timeout_redelivers(tmp_path):
+    queue = WebhookQueue(str(tmp_path / "queue.db"), visibility_timeout=0.05, max_attempts=3)
+    queue.enqueue("payload")
+    assert queue.claim().attempts == 1
+    assert queue.claim() is None
+    time.sleep(0.06)
+    assert queue.claim().attempts == 2
+    queue.close()
+
+def test_nack_retries_then_dead_letters(queue):
+    queue.enqueue("payload")
+    for attempt in range(1, 3):
+        job = queue.claim()
+        assert job.attempts == attempt
+        assert queue.nack(job, "boom", delay=0)
+    job = queue.claim()
+    assert not queue.nack(job, "boom", delay=0)
+    assert queue.claim() is None
+    assert queue.stats() == {"dead": 1}
+
+def test_claim_dead_letters_exhausted_jobs(tmp_path):
+    queue = WebhookQueue(str(tmp_path / "queue.db"), visibility_timeout=0, max_attempts=2)
+    queue.enqueue("crashes the worker")
+    # Claimed twice and never acked or nacked, as when the worker process dies
+    assert queue.claim().attempts == 1
+    assert queue.claim().attempts == 2
+    assert queue.claim() is None
+    assert queue.stats() == {"dead": 1}
+    queue.close()
+
+def test_prune_removes_only_old_dead_rows(tmp_path):
+    queue = WebhookQueue(str(tmp_path / "queue.db"), max_attempts=1, dead_retention=60)
+    queue.enqueue("dead")
+    queue.nack(queue.claim(), "boom", delay=0)
+    queue.enqueue("alive")
+
+    assert queue.prune_dead() == 0
+    assert queue.prune_dead(now=time.time() + 120) == 1
+    assert queue.stats() == {"pending": 1}
+    queue.close()
+
+def test_deferred_payload_parks_its_conversations(queue):
+    queue.enqueue("deferred", received_at=100.0, delay=60, conversations=["page:alice"])
+    # Later messages of the conversation are parked until the deferred one is due
+    parked = queue.parked(["page:alice", "page:bob"], received_at=101.0)
+    assert list(parked) == ["page:alice"]
+    assert parked["page:alice"] == pytest.approx(time.time() + 60, abs=1)
+    # The deferred payload itself is not parked behind its own park
+    assert queue.parked(["page:alice"], received_at=100.0) == {}
+
+def test_park_lapses_once_due(queue):
+    queue.enqueue("deferred", received_at=100.0, delay=0, conversations=["page:alice"])
+    assert queue.parked(["page:alice"], received_at=101.0) == {}
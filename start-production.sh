@@ -75,18 +75,21 @@ echo "🌟 Starting FastAPI application..."
 
 if [ "$CLOUD_MODE" = true ]; then
     # Cloud deployment - use gunicorn for better performance
+    # The app reads WEB_CONCURRENCY to share rate limits between the workers
+    export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
     exec gunicorn main:app \
         --bind 0.0.0.0:$PORT \
-        --workers 2 \
+        --workers $WEB_CONCURRENCY \
         --worker-class uvicorn.workers.UvicornWorker \
         --access-logfile - \
         --error-logfile - \
         --log-level info
 else
     # Local production - use uvicorn
+    export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
     exec uvicorn main:app \
         --host 0.0.0.0 \
         --port $PORT \
-        --workers 1 \
+        --workers $WEB_CONCURRENCY \
         --log-level info
 fi 
\ No newline at end of file